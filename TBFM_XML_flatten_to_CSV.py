@@ -1,187 +1,917 @@
-##@Copyright 2020. Ulrich Linder, Al Capps
-##@Organization - aviationdatascience.org non-profit, through release from Penn State
-##@License - This work is licensed under MIT license - https://opensource.org/licenses/MIT
-## This permissive license lets you do basically whatever you want.
-## Per the details of the MIT license, the software is provided "as is".
-## Have fun!
-
-## In support of Penn State Data Science, this is the first step in data parsing 
-##of publicly available TBFM SWIM data
-## This program parses the "air" messages in xml and places them in CSV
-## format in the specified directory for later processing.
-import gzip
-import os
-import argparse
-import os.path
-import time
-from bs4 import BeautifulSoup as bs
-
-
-###The following can be treated as static and immutable. These are for
-## Writing to a zipped file directly. 
-comma_enc=",".encode()
-newl_enc="\n".encode()
-    
-## Main loop###
-## searches the directory given, processes each TBFM SWIM file
-## splits up the messages into air, adp, oth, con
-## formats the air into CSV
-def main():
- 
-    ldir=os.listdir(parms["readDir"])
-    path=parms["readDir"]
-    out_dir=parms["outdir"]
-
-    for filename in ldir:
-        print(filename)
-        ## Only process files that are bzipped
-        if not filename.endswith(".xml.gz"):
-            continue
-        full_path=path + "/" + filename
-
-        outname=out_dir + "/" +filename + "_air.csv.gz"
-        airF = gzip.open(outname, "wb")
-        write_air_header(airF)
-
-        ### Just storing raw adp messages right now
-        conoutname=out_dir + "/" + filename + "_con.xml.gz"
-        conF = gzip.open(conoutname, "wb")
-        
-        ### Just storing raw adp messages right now
-        adpoutname=out_dir + "/" + filename +"_adp.xml.gz"
-        adpF = gzip.open(adpoutname, "wb")
-        
-        ### Just storing raw oth messages right now
-        othoutname=out_dir + "/" + filename +"_oth.xml.gz"
-        othF = gzip.open(othoutname, "wb")
-
-        start = time.time()
-        print("Processing "+full_path + " at " +str(start),flush=True)  
-
-        with gzip.open(full_path,'rt') as f:
-         for line in f:
-          str_line=str(line)
-          if not "capture-timestamp" in str_line:
-                ##This next step should not be necessary, but it 
-                ##looks like the binary we are reading from was stored wrong
-                str_line=str_line.split("b'")[1]
-                
-                ##airType is parsed and printed in a flat CSV format               
-                if "airType=" in str_line:
-                    parse_air(str_line,airF)
-                elif "<con>" in str_line:
-                    ##Just writing the raw data to a gzipped file
-                    conF.write(str_line.encode())
-                elif "<adp>" in str_line:
-                    ##Just writing the raw data to a gzipped file
-                    adpF.write(str_line.encode())
-                elif "<oth>" in str_line:
-                    ##Just writing the raw data to a gzipped file
-                    othF.write(str_line.encode())
-                else:
-                    pass
-                                   
-    f.close()
-    stop = time.time()
-    duration = (stop - start)/60
-    print("Processing took "+ str(duration) + " minutes",flush=True)
-    airF.close()
-    conF.close()
-    adpF.close()
-    othF.close()
-    
-### Simple method to write CSV header
-def write_air_header(airF):
-    
-    str_header='msgtime,aid,tmaId,dap,apt,mfx,cat,gat,bcn,rwy,scn,fps,'+\
-    'acs,typ,eng,spd,trw,sfz,rfz,eta_rwy,eta_mfx,eta_oma,eta_sfx,'+\
-    'eta_dfx,eta_o4a,eta_o3a,eta_ooa,sta_o4a,sta_o3a,sta_ooa,sta_oma,'+\
-    'sta_dfx,sta_sfx,ara,tds,cfx,ctm,etd,std,etm,est,a10,tcr,dfx,sfx,oma,'+\
-    'ooa,o3a,o4a,ina,sus,man,sta_rwy,sta_mfx,cfg,tra\n'         
-    airF.write(str_header.encode())     
- 
-##############################
-###  
-###  This method extracts all the useful information 
-###  from the air messages and flattens them, stores them.
-###  This is not efficient, but worked well at time of writing.
-#############################
-def parse_air(str_line,airF):
-    
-    ## msgd initializes all possible name value pairs with a blank "" value
-    ## This come in handy later when printing all elements of each flight
-    msgd={'mfx':"",'cat':"",'gat':"",'bcn':"",
-          'rwy':"",'scn':"",'fps':"",'acs':"",
-          'typ':"",'eng':"",'spd':"",'trw':"",
-          'sfz':"",'rfz':"",'eta_rwy':"",
-          'eta_mfx':"",'eta_oma':"",
-          'eta_sfx':"",'eta_dfx':"",
-          'eta_o4a':"",'eta_o3a':"",
-          'eta_ooa':"",'sta_o4a':"",
-          'sta_o3a':"",'sta_ooa':"",
-          'sta_oma':"",'sta_dfx':"",
-          'sta_sfx':"",'ara':"",'tds':"",
-          'cfx':"",'ctm':"",'etd':"",'std':"",
-          'etm':"",'est':"",'a10':"",'tcr':"",
-          'dfx':"",'sfx':"",'oma':"",'ooa':"",
-          'o3a':"",'o4a':"",'ina':"",'sus':"",
-          'man':"",'sta_rwy':"",'sta_mfx':"",'cfg':"",
-          'tra':""}            
-    
-    ##Here "bs" is beautiful soup, which is used for many parsing utilities          
-    response = bs(str_line,"lxml")
-    
-    ### Here we iterate through all (or most) descendants of the XML element 
-    ### and assign any populated values to the appropriate
-    ### python dictionary with the same name as the element
-    for child in response.descendants:
-        if (child.name == "tma"):
-            msgtime=child['msgtime']
-            continue
-        elif (child.name == "air"):
-            aid=child['aid']
-            apt=child['apt']
-            dap=child['dap']
-            tmaid=child['tmaid']           
-        elif (child.name not in msgd.keys()):
-            continue
-        else:
-            msgd.update({child.name:child.text})
-            
-
-    ### Write the elements to CSV file
-    ### This section takes the longest (writing to disk)
-    ##Write first few elements that are not in dictionary
-    key=msgtime+","+aid+","+tmaid+","+dap+","+apt+","
-    airF.write(key.encode())
-    
-    ##Write each populated value. Prints in order defined at beginning
-    ## of this method
-    for key, value in msgd.items():
-        airF.write(value.encode()+comma_enc)
-
-    ## Finish it off with a cherry on top - newline
-    airF.write(newl_enc)
-    
-
-def build_parms(args):
-    """Helper function to parse command line arguments into dictionary
-        input: ArgumentParser class object
-        output: dictionary of expected parameters
-    """
-    readDir=args.dir
-    outdir=args.outdir  
-    parms = {"readDir":readDir,
-             "outdir":outdir}
-    
-    return(parms)
-     
-if __name__ == "__main__":
-    
-    parser = argparse.ArgumentParser(description = \
-                 "Step1 Parsing of TBFM SWIM.")
-    parser.add_argument("dir", 
-                        help = "Directory to obtain raw compressed TBFM SWIM.")
-    parser.add_argument("--outdir", default = "./")
-    parms = build_parms(parser.parse_args())
-    main()
+##@Copyright 2020. Ulrich Linder, Al Capps
+##@Organization - aviationdatascience.org non-profit, through release from Penn State
+##@License - This work is licensed under MIT license - https://opensource.org/licenses/MIT
+## This permissive license lets you do basically whatever you want.
+## Per the details of the MIT license, the software is provided "as is".
+## Have fun!
+
+## In support of Penn State Data Science, this is the first step in data parsing 
+##of publicly available TBFM SWIM data
+## This program parses the "air" messages in xml and places them in CSV
+## format in the specified directory for later processing.
+## With --parse-other the con, adp and oth messages are flattened into
+## tables in the same pass instead of being stored as raw XML.
+import gzip
+import os
+import argparse
+import os.path
+import time
+import io
+import itertools
+import queue
+import threading
+import multiprocessing
+from tbfm_extract import extract_air
+from tbfm_extract import EXTRACT_STATS
+from tbfm_extract import extract_other
+from tbfm_columnar import OTHER_COLUMNS
+from tbfm_columnar import COLUMNAR_STATS
+from tbfm_columnar import ParquetAirWriter
+from tbfm_columnar import ParquetOtherWriter
+from tbfm_columnar import AirRowBatch
+from tbfm_index import IndexedAirWriter
+from tbfm_dedup import DedupAirWriter
+from tbfm_delta import DeltaAirWriter
+from tbfm_partition import PartitionedAirWriter
+from tbfm_partition import PARTITION_SUFFIX
+from tbfm_partition import PARTITION_COLUMNS
+from tbfm_partition import partition_bytes
+from tbfm_partition import update_partition_manifest
+from tbfm_index import index_name
+from tbfm_manifest import TMP_SUFFIX
+from tbfm_manifest import load_manifest
+from tbfm_manifest import save_manifest
+from tbfm_manifest import needs_processing
+from tbfm_manifest import commit_outputs
+from tbfm_metrics import RunMetrics
+from tbfm_metrics import new_stats
+from tbfm_metrics import start_profiler
+from tbfm_metrics import finish_run
+from tbfm_metrics import add_metrics_arguments
+
+
+###The following can be treated as static and immutable. These are for
+## Writing to a zipped file directly. 
+newl_enc="\n".encode()
+
+## Pipeline mode: lines per batch and batches allowed in flight per queue
+BATCH_LINES=2000
+QUEUE_BATCHES=4
+
+## Binary mode: bytes of decompressed data read at a time
+READ_CHUNK_BYTES=1<<20
+
+## Air rows are handed to gzip in blocks of about this many characters
+AIR_FLUSH_BYTES=1<<18
+
+## file_parms that change the content of the outputs. A manifest entry
+## made with other values is not reused by --incremental.
+OUTPUT_PARMS=("format","trailing_comma","indexed","parse_other","dedup",
+              "partition_by")
+    
+## Main loop###
+## searches the directory given, processes each TBFM SWIM file
+## splits up the messages into air, adp, oth, con
+## formats the air into CSV
+## With --workers N the files are spread across a process pool, each
+## worker writing its own _air/_con/_adp/_oth outputs for its file.
+def main():
+ 
+    metrics=RunMetrics("TBFM_XML_flatten_to_CSV")
+    profiler=start_profiler(parms["profile"],parms["profile_interval"])
+    ldir=os.listdir(parms["readDir"])
+    path=parms["readDir"]
+    out_dir=parms["outdir"]
+    workers=parms["workers"]
+
+    filenames=[]
+    for filename in ldir:
+        print(filename)
+        ## Only process files that are bzipped
+        if not filename.endswith(".xml.gz"):
+            continue
+        filenames.append(filename)
+
+    start = time.time()
+    file_parms={"compresslevel":parms["compresslevel"],
+                "binary":parms["binary"],
+                "trailing_comma":parms["trailing_comma"],
+                "format":parms["format"],
+                "indexed":parms["indexed"],
+                "parse_other":parms["parse_other"],
+                "dedup":parms["dedup"],
+                "partition_by":parms["partition_by"],
+                "pipeline":parms["pipeline"],
+                "parse_threads":parms["parse_threads"]}
+
+    ## With --incremental only new or changed inputs are flattened
+    manifest=None
+    entries={}
+    if parms["incremental"]:
+        manifest=load_manifest(out_dir)
+        options={name:file_parms[name] for name in OUTPUT_PARMS}
+        todo=[]
+        for filename in filenames:
+            needed,entry=needs_processing(manifest,filename,
+                                          path + "/" + filename,options,
+                                          output_names(out_dir,filename,
+                                                       file_parms))
+            if needed:
+                todo.append(filename)
+                entries[filename]=entry
+                ## Forget the old entry first so a crash leaves nothing stale
+                manifest["files"].pop(filename,None)
+            else:
+                manifest["files"][filename]=entry
+        save_manifest(out_dir,manifest)
+        print("Skipping "+str(len(filenames)-len(todo))+
+              " unchanged files",flush=True)
+        metrics.count("files_skipped",len(filenames)-len(todo))
+        filenames=todo
+
+    jobs=[(path,filename,out_dir,file_parms) for filename in filenames]
+    results=[]
+    if workers > 1:
+        with multiprocessing.Pool(workers) as pool:
+            for result in pool.imap_unordered(flatten_file_job,jobs):
+                finish_file(result,manifest,entries,out_dir)
+                results.append(result)
+                report_file(result,len(results),len(jobs))
+    else:
+        for job in jobs:
+            result=flatten_file_job(job)
+            finish_file(result,manifest,entries,out_dir)
+            results.append(result)
+            report_file(result,len(results),len(jobs))
+    stop = time.time()
+    report_totals(results,stop-start,workers)
+    if parms["partition_by"]:
+        partitions=update_partition_manifest(out_dir)["partitions"]
+        print("Air rows in "+str(len(partitions))+" "+parms["partition_by"]+
+              " partitions",flush=True)
+
+    for filename,secs,counts,stats in results:
+        metrics.count("files")
+        for msg_type in counts:
+            metrics.count("messages_"+msg_type,counts[msg_type])
+        metrics.merge(stats)
+    finish_run(metrics,parms["metrics"],profiler)
+
+## Records a completed file in the manifest (when running --incremental)
+def finish_file(result,manifest,entries,out_dir):
+    if manifest is None:
+        return
+    filename=result[0]
+    manifest["files"][filename]=entries[filename]
+    save_manifest(out_dir,manifest)
+
+## Pool friendly wrapper, arguments are passed explicitly since the
+## module-global parms is not set in spawned worker processes
+def flatten_file_job(job):
+    path,filename,out_dir,file_parms=job
+    if file_parms["pipeline"]:
+        return flatten_file_pipelined(path,filename,out_dir,file_parms)
+    return flatten_file(path,filename,out_dir,file_parms)
+
+## Suffix of the air output of an input file in each format
+def air_suffix(file_parms):
+    if file_parms["format"] == "parquet":
+        return "_air.parquet"
+    if file_parms["format"] == "delta":
+        return "_air.delta.csv.gz"
+    return "_air.csv.gz"
+
+## Final names of the air, con, adp and oth outputs of one input file,
+## followed by the air index with --indexed. With --partition-by the air
+## output is the input's partition list, the rows are in the partitions.
+def output_names(out_dir,filename,file_parms):
+    if file_parms.get("partition_by"):
+        outname=out_dir + "/" +filename + "_air" + PARTITION_SUFFIX
+    else:
+        outname=out_dir + "/" +filename + air_suffix(file_parms)
+    ## Parsed con/adp/oth tables use the air format, raw XML otherwise
+    if not file_parms.get("parse_other"):
+        other_suffix=".xml.gz"
+    elif file_parms["format"] == "parquet":
+        other_suffix=".parquet"
+    else:
+        other_suffix=".csv.gz"
+    conoutname=out_dir + "/" + filename + "_con" + other_suffix
+    adpoutname=out_dir + "/" + filename + "_adp" + other_suffix
+    othoutname=out_dir + "/" + filename + "_oth" + other_suffix
+    if file_parms.get("indexed"):
+        return [outname,conoutname,adpoutname,othoutname,index_name(outname)]
+    return [outname,conoutname,adpoutname,othoutname]
+
+## Opens the four gzipped outputs of one input file and writes the air header
+## With --format parquet the air rows go to a typed Parquet file instead
+## With --format delta only their changes are written (see tbfm_delta.py)
+## With --indexed they go to block gzip members plus a per-flight index
+## With --partition-by each partition gets such a writer of its own
+## With --dedup unchanged air messages are dropped first
+## Everything is written under a temporary name, see commit_outputs
+## With stats the time spent writing the gzip outputs is added up there
+def open_outputs(out_dir,filename,file_parms,stats=None):
+
+    names=[name + TMP_SUFFIX for name in output_names(out_dir,filename,
+                                                      file_parms)]
+    outname,conoutname,adpoutname,othoutname=names[:4]
+    if file_parms.get("partition_by"):
+        airF = PartitionedAirWriter(out_dir,filename,air_suffix(file_parms),
+                                    outname,
+                                    lambda partname: open_air_output(
+                                        partname,None,file_parms,stats),
+                                    file_parms["partition_by"])
+    else:
+        airF = open_air_output(outname,names[4:],file_parms,stats)
+    if file_parms.get("dedup"):
+        airF = DedupAirWriter(airF)
+
+    ### Raw con, adp and oth messages unless --parse-other
+    conF = open_other_output(conoutname,"con",file_parms,stats)
+    adpF = open_other_output(adpoutname,"adp",file_parms,stats)
+    othF = open_other_output(othoutname,"oth",file_parms,stats)
+
+    return airF,conF,adpF,othF
+
+## The air row writer of the format, header written
+def open_air_output(outname,index_names,file_parms,stats):
+    compresslevel=file_parms["compresslevel"]
+    if file_parms["format"] == "parquet":
+        return ParquetAirWriter(outname)
+    if file_parms["format"] == "delta":
+        return DeltaAirWriter(timed_output(gzip.open(outname, "wb",
+                                                     compresslevel=compresslevel),
+                                           stats))
+    if file_parms.get("indexed"):
+        airF = IndexedAirWriter(outname,index_names[0],compresslevel,
+                                file_parms["trailing_comma"],stats=stats)
+    else:
+        airF = AirRowWriter(timed_output(gzip.open(outname, "wb",
+                                                   compresslevel=compresslevel),
+                                         stats),
+                            file_parms["trailing_comma"])
+    write_air_header(airF)
+    return airF
+
+## A raw gzip output, or with --parse-other a parser feeding a table
+def open_other_output(outname,msg_type,file_parms,stats):
+    compresslevel=file_parms["compresslevel"]
+    if not file_parms.get("parse_other"):
+        return timed_output(gzip.open(outname, "wb",
+                                      compresslevel=compresslevel),stats)
+    if file_parms["format"] == "parquet":
+        rowsF=ParquetOtherWriter(outname)
+    else:
+        rowsF=OtherRowWriter(timed_output(gzip.open(outname, "wb",
+                                                    compresslevel=compresslevel),
+                                          stats))
+        rowsF.write((",".join(OTHER_COLUMNS)+"\n").encode())
+    return OtherMessageParser(rowsF,msg_type)
+
+def timed_output(outF,stats):
+    if stats is None:
+        return outF
+    return TimedOutput(outF,stats)
+
+## Adds the time spent in write() and close() (compression) to write_secs
+class TimedOutput:
+    def __init__(self,outF,stats):
+        self.outF=outF
+        self.stats=stats
+
+    def write(self,data):
+        start=time.perf_counter()
+        self.outF.write(data)
+        self.stats["write_secs"]+=time.perf_counter()-start
+
+    def close(self):
+        start=time.perf_counter()
+        self.outF.close()
+        self.stats["write_secs"]+=time.perf_counter()-start
+
+## Splits up a single TBFM SWIM file into its air, adp, oth, con outputs.
+## Returns the filename, duration in seconds, the message counts and the
+## file's stats for the run metrics (lines, bytes, fallbacks and the time
+## spent decompressing, parsing and writing)
+def flatten_file(path,filename,out_dir,file_parms):
+
+    full_path=path + "/" + filename
+    stats=new_stats("decompress","parse","write")
+    airF,conF,adpF,othF=open_outputs(out_dir,filename,file_parms,stats)
+
+    counts={"air":0,"con":0,"adp":0,"oth":0}
+    fallbacks=fallback_counts()
+    start = time.time()
+    print("Processing "+full_path + " at " +str(start),flush=True)  
+
+    if file_parms["binary"]:
+        split=split_messages_binary
+        mode='rb'
+    else:
+        split=split_messages
+        mode='rt'
+    lines_read=0
+    with gzip.open(full_path,mode) as f:
+        if file_parms["binary"]:
+            batches=read_binary_lines(f)
+        else:
+            batches=iter(lambda: list(itertools.islice(f,BATCH_LINES)),[])
+        while True:
+            ## Decompressing happens while the next batch is read
+            read_start=time.perf_counter()
+            lines=next(batches,None)
+            parse_start=time.perf_counter()
+            stats["decompress_secs"]+=parse_start-read_start
+            if lines is None:
+                break
+            split(lines,airF,conF,adpF,othF,counts)
+            lines_read+=len(lines)
+            stats["parse_secs"]+=time.perf_counter()-parse_start
+    ## Writes happen inside the parse loop, keep the two apart
+    stats["parse_secs"]-=stats["write_secs"]
+                               
+    airF.close()
+    conF.close()
+    adpF.close()
+    othF.close()
+    commit_outputs(output_names(out_dir,filename,file_parms))
+    stop = time.time()
+
+    file_stats(stats,full_path,output_names(out_dir,filename,file_parms),
+               lines_read,fallbacks)
+    if file_parms.get("partition_by"):
+        stats["bytes_out"]+=partition_bytes(output_names(out_dir,filename,
+                                                         file_parms)[0])
+    if file_parms.get("dedup"):
+        stats["air_dropped"]=airF.dropped
+    return (filename,stop-start,counts,stats)
+
+### Messages handed to BeautifulSoup and Parquet times kept as text so far
+def fallback_counts():
+    return {**EXTRACT_STATS,**COLUMNAR_STATS}
+
+### Fills in the counters that are the same for every flattening mode
+def file_stats(stats,full_path,outputs,lines_read,fallbacks):
+    stats["lines"]=lines_read
+    for name in fallbacks:
+        stats[name]=fallback_counts()[name]-fallbacks[name]
+    stats["bytes_in"]=os.path.getsize(full_path)
+    stats["bytes_out"]=sum(os.path.getsize(outname) for outname in outputs)
+
+## Classifies each raw line, air is parsed and printed in a flat CSV
+## format, the others are stored raw (or parsed by the OtherMessageParser
+## given as conF/adpF/othF). Works on any iterable of lines.
+def split_messages(lines,airF,conF,adpF,othF,counts):
+    for line in lines:
+        str_line=str(line)
+        if "capture-timestamp" in str_line:
+            continue
+        ##This next step should not be necessary, but it 
+        ##looks like the binary we are reading from was stored wrong
+        str_line=str_line.split("b'")[1]
+        
+        ##airType is parsed and printed in a flat CSV format               
+        if "airType=" in str_line:
+            parse_air(str_line,airF)
+            counts["air"]+=1
+        elif "<con>" in str_line:
+            ##Just writing the raw data to a gzipped file
+            conF.write(str_line.encode())
+            counts["con"]+=1
+        elif "<adp>" in str_line:
+            ##Just writing the raw data to a gzipped file
+            adpF.write(str_line.encode())
+            counts["adp"]+=1
+        elif "<oth>" in str_line:
+            ##Just writing the raw data to a gzipped file
+            othF.write(str_line.encode())
+            counts["oth"]+=1
+
+##############################
+###
+###  Binary fast path. The decompressed stream is read as bytes in large
+###  chunks and cut into lines, so the text layer, str() and the
+###  decode/encode round trip are skipped. con, adp and oth payloads are
+###  sliced out of the line and written as is. Only air payloads are
+###  decoded, for parse_air. Same classification and output bytes as
+###  split_messages.
+#############################
+def read_binary_lines(f):
+    rest=b""
+    while True:
+        chunk=f.read(READ_CHUNK_BYTES)
+        if not chunk:
+            break
+        chunk=rest+chunk
+        end=chunk.rfind(newl_enc)+1
+        if end == 0:
+            rest=chunk
+            continue
+        rest=chunk[end:]
+        yield binary_chunk_lines(chunk[:end])
+    if rest:
+        yield binary_chunk_lines(rest)
+
+## Text mode translates \r\n and lone \r to \n, do the same here. A \r
+## ending a chunk is carried over with the partial line so pairs stay whole.
+def binary_chunk_lines(chunk):
+    if b"\r" in chunk:
+        chunk=chunk.replace(b"\r\n",newl_enc).replace(b"\r",newl_enc)
+    return chunk.splitlines(keepends=True)
+
+def split_messages_binary(lines,airF,conF,adpF,othF,counts):
+    for line in lines:
+        if b"capture-timestamp" in line:
+            continue
+        ## Same odd b'...' wrapping as the text path
+        payload=line.split(b"b'",2)[1]
+
+        if b"airType=" in payload:
+            parse_air(payload.decode(),airF)
+            counts["air"]+=1
+        elif b"<con>" in payload:
+            conF.write(payload)
+            counts["con"]+=1
+        elif b"<adp>" in payload:
+            adpF.write(payload)
+            counts["adp"]+=1
+        elif b"<oth>" in payload:
+            othF.write(payload)
+            counts["oth"]+=1
+
+##############################
+###
+###  Pipelined version of flatten_file. Decompression, parsing and
+###  recompression otherwise serialize on one core. Here a reader thread
+###  feeds batches of lines through bounded queues to parse threads, and
+###  one writer thread per output compresses the results. zlib releases
+###  the GIL so the gzip stages overlap with parsing. Batches carry a
+###  sequence number and are handed to the writers in read order, so the
+###  message order of every output file is the same as flatten_file.
+#############################
+def flatten_file_pipelined(path,filename,out_dir,file_parms):
+
+    full_path=path + "/" + filename
+    outputs=open_outputs(out_dir,filename,file_parms)
+    parse_threads=max(1,file_parms["parse_threads"])
+
+    counts={"air":0,"con":0,"adp":0,"oth":0}
+    fallbacks=fallback_counts()
+    ## Every thread adds up its own busy time, summed over threads below
+    thread_stats=[new_stats("decompress","parse","write")
+                  for i in range(1+parse_threads+len(outputs))]
+    start = time.time()
+    print("Processing "+full_path + " at " +str(start),flush=True)
+
+    batch_q=queue.Queue(maxsize=parse_threads*QUEUE_BATCHES)
+    result_q=queue.Queue(maxsize=parse_threads*QUEUE_BATCHES)
+    write_qs=[queue.Queue(maxsize=QUEUE_BATCHES) for outF in outputs]
+    errors=[]
+    stop_reading=threading.Event()
+
+    binary=file_parms["binary"]
+    threads=[threading.Thread(target=pipeline_reader,
+                              args=(full_path,binary,batch_q,parse_threads,
+                                    stop_reading,errors,thread_stats[0]))]
+    for i in range(parse_threads):
+        threads.append(threading.Thread(target=pipeline_parser,
+                                        args=(file_parms,batch_q,result_q,
+                                              errors,thread_stats[1+i])))
+    for outF,write_q,write_stats in zip(outputs,write_qs,
+                                        thread_stats[1+parse_threads:]):
+        threads.append(threading.Thread(target=pipeline_writer,
+                                        args=(outF,write_q,errors,
+                                              write_stats)))
+    for thread in threads:
+        thread.start()
+
+    ## Put the parsed batches back in read order before they reach the writers
+    pending={}
+    next_seq=0
+    parsers_done=0
+    while parsers_done < parse_threads:
+        result=result_q.get()
+        if result is None:
+            parsers_done+=1
+            continue
+        seq,chunks,batch_counts=result
+        pending[seq]=(chunks,batch_counts)
+        while next_seq in pending:
+            chunks,batch_counts=pending.pop(next_seq)
+            next_seq+=1
+            if chunks is None:
+                stop_reading.set()
+                continue
+            for chunk,write_q in zip(chunks,write_qs):
+                if chunk:
+                    write_q.put(chunk)
+            for msg_type in counts:
+                counts[msg_type]+=batch_counts[msg_type]
+    for write_q in write_qs:
+        write_q.put(None)
+    for thread in threads:
+        thread.join()
+
+    close_start=time.perf_counter()
+    for outF in outputs:
+        outF.close()
+    close_secs=time.perf_counter()-close_start
+    if errors:
+        raise errors[0]
+    commit_outputs(output_names(out_dir,filename,file_parms))
+    stop = time.time()
+
+    stats=new_stats("decompress","parse","write")
+    stats["write_secs"]=close_secs
+    lines_read=0
+    for one_stats in thread_stats:
+        lines_read+=one_stats.pop("lines",0)
+        for name in stats:
+            stats[name]+=one_stats[name]
+    file_stats(stats,full_path,output_names(out_dir,filename,file_parms),
+               lines_read,fallbacks)
+    return (filename,stop-start,counts,stats)
+
+## Pipeline stage: decompress and hand out numbered batches of lines
+def pipeline_reader(full_path,binary,batch_q,parse_threads,stop_reading,
+                    errors,stats):
+    stats["lines"]=0
+    try:
+        if binary:
+            with gzip.open(full_path,'rb') as f:
+                batches=read_binary_lines(f)
+                seq=0
+                while not stop_reading.is_set():
+                    read_start=time.perf_counter()
+                    lines=next(batches,None)
+                    stats["decompress_secs"]+=time.perf_counter()-read_start
+                    if lines is None:
+                        break
+                    stats["lines"]+=len(lines)
+                    batch_q.put((seq,lines))
+                    seq+=1
+        else:
+            with gzip.open(full_path,'rt') as f:
+                seq=0
+                while not stop_reading.is_set():
+                    read_start=time.perf_counter()
+                    lines=list(itertools.islice(f,BATCH_LINES))
+                    stats["decompress_secs"]+=time.perf_counter()-read_start
+                    if not lines:
+                        break
+                    stats["lines"]+=len(lines)
+                    batch_q.put((seq,lines))
+                    seq+=1
+    except Exception as e:
+        errors.append(e)
+    finally:
+        for i in range(parse_threads):
+            batch_q.put(None)
+
+## Pipeline stage: classify and parse a batch into four output chunks
+def pipeline_parser(file_parms,batch_q,result_q,errors,stats):
+    while True:
+        batch=batch_q.get()
+        if batch is None:
+            result_q.put(None)
+            return
+        parse_start=time.perf_counter()
+        seq,lines=batch
+        counts={"air":0,"con":0,"adp":0,"oth":0}
+        buffers=[io.BytesIO() for i in range(4)]
+        if file_parms["format"] == "parquet":
+            airF=AirRowBatch()
+        else:
+            airF=AirRowWriter(buffers[0],file_parms["trailing_comma"])
+        try:
+            if file_parms["binary"]:
+                split_messages_binary(lines,airF,*buffers[1:],counts)
+            else:
+                split_messages(lines,airF,*buffers[1:],counts)
+            chunks=[buf.getvalue() for buf in buffers]
+            if file_parms["format"] == "parquet":
+                chunks[0]=airF.rows
+            else:
+                airF.flush()
+                chunks[0]=buffers[0].getvalue()
+        except Exception as e:
+            errors.append(e)
+            chunks=None
+        stats["parse_secs"]+=time.perf_counter()-parse_start
+        result_q.put((seq,chunks,counts))
+
+## Pipeline stage: compress the chunks of one output in order
+def pipeline_writer(outF,write_q,errors,stats):
+    while True:
+        chunk=write_q.get()
+        if chunk is None:
+            return
+        if errors:
+            continue
+        write_start=time.perf_counter()
+        try:
+            outF.write(chunk)
+        except Exception as e:
+            errors.append(e)
+        stats["write_secs"]+=time.perf_counter()-write_start
+
+##############################
+###
+###  Fused mode for callers that want the parsed air rows themselves, like
+###  the daily summary run on raw files. Yields the air rows of one raw
+###  TBFM SWIM file as tuples (msgtime, aid, tmaId, dap, apt, *values), a
+###  list per decompressed chunk, parsed with the binary path and
+###  parse_air. With out_dir set the usual outputs are written along the
+###  way, otherwise con/adp/oth are dropped and nothing is compressed.
+#############################
+def iter_air_rows(path,filename,out_dir=None,file_parms=None):
+
+    full_path=path + "/" + filename
+    counts={"air":0,"con":0,"adp":0,"oth":0}
+    if out_dir is None:
+        airF=None
+        conF=adpF=othF=DiscardOutput()
+    else:
+        airF,conF,adpF,othF=open_outputs(out_dir,filename,file_parms)
+    rows=AirRowTee(airF)
+
+    with gzip.open(full_path,'rb') as f:
+        for lines in read_binary_lines(f):
+            split_messages_binary(lines,rows,conF,adpF,othF,counts)
+            yield rows.rows
+            rows.rows=[]
+
+    if out_dir is not None:
+        for outF in (airF,conF,adpF,othF):
+            outF.close()
+        commit_outputs(output_names(out_dir,filename,file_parms))
+
+## Collects parsed air rows, and writes them on to airF when there is one
+class AirRowTee:
+    def __init__(self,airF=None):
+        self.airF=airF
+        self.rows=[]
+
+    def write_row(self,msgtime,aid,tmaid,dap,apt,values):
+        self.rows.append((msgtime,aid,tmaid,dap,apt,*values))
+        if self.airF is not None:
+            self.airF.write_row(msgtime,aid,tmaid,dap,apt,values)
+
+## Stands in for an output that is not wanted
+class DiscardOutput:
+    def write(self,data):
+        pass
+
+    def close(self):
+        pass
+
+### Progress line for each finished file
+def report_file(result,num_done,num_files):
+    filename,secs,counts,stats=result
+    print("["+str(num_done)+"/"+str(num_files)+"] "+filename+
+          " took "+str(secs/60)+" minutes ("+
+          str(sum(counts.values()))+" messages)",flush=True)
+
+### Aggregated timing over all files of the run
+def report_totals(results,wall_secs,workers):
+    totals={"air":0,"con":0,"adp":0,"oth":0}
+    file_secs=0
+    for filename,secs,counts,stats in results:
+        file_secs=file_secs+secs
+        for msg_type in totals:
+            totals[msg_type]=totals[msg_type]+counts[msg_type]
+    num_msgs=sum(totals.values())
+    print("Processed "+str(len(results))+" files with "+str(workers)+
+          " worker(s)",flush=True)
+    print("Messages: "+", ".join(msg_type+"="+str(totals[msg_type])
+                                 for msg_type in totals),flush=True)
+    dropped=sum(stats.get("air_dropped",0) for filename,secs,counts,stats
+                in results)
+    if dropped:
+        print("Dropped "+str(dropped)+" unchanged air messages ("+
+              str(round(100.0*dropped/max(totals["air"],1),1))+"%)",
+              flush=True)
+    time_fallbacks=sum(stats.get("time_fallbacks",0) for filename,secs,
+                       counts,stats in results)
+    if time_fallbacks:
+        print("Kept "+str(time_fallbacks)+" times that do not fit a "+
+              "timestamp as text in the time_text column",flush=True)
+    print("Sum of per-file time "+str(file_secs/60)+" minutes",flush=True)
+    if wall_secs > 0:
+        print("Throughput "+str(round(num_msgs/wall_secs,1))+
+              " messages/sec",flush=True)
+    print("Processing took "+ str(wall_secs/60) + " minutes",flush=True)
+    
+### Simple method to write CSV header
+def write_air_header(airF):
+    
+    str_header='msgtime,aid,tmaId,dap,apt,mfx,cat,gat,bcn,rwy,scn,fps,'+\
+    'acs,typ,eng,spd,trw,sfz,rfz,eta_rwy,eta_mfx,eta_oma,eta_sfx,'+\
+    'eta_dfx,eta_o4a,eta_o3a,eta_ooa,sta_o4a,sta_o3a,sta_ooa,sta_oma,'+\
+    'sta_dfx,sta_sfx,ara,tds,cfx,ctm,etd,std,etm,est,a10,tcr,dfx,sfx,oma,'+\
+    'ooa,o3a,o4a,ina,sus,man,sta_rwy,sta_mfx,cfg,tra\n'         
+    airF.write(str_header.encode())     
+ 
+##############################
+###  
+###  This method extracts all the useful information 
+###  from the air messages and flattens them, stores them.
+###  The extraction itself lives in tbfm_extract which avoids building
+###  a BeautifulSoup tree per message (falls back to it when needed).
+#############################
+def parse_air(str_line,airF):
+
+    ### With --dedup most unchanged repeats are dropped before parsing
+    if isinstance(airF,DedupAirWriter) and airF.drop_unchanged(str_line):
+        return
+    
+    msgtime,aid,tmaid,dap,apt,values=extract_air(str_line)
+
+    ### Write the elements to CSV file, one row at a time into the
+    ### AirRowWriter buffer which hands large blocks to gzip
+    airF.write_row(msgtime,aid,tmaid,dap,apt,values)
+
+##############################
+###
+###  Batches flattened air rows before they reach the compressor. Writing
+###  each field separately meant dozens of small GzipFile.write() calls
+###  per message. Rows are collected as text in a reused list and
+###  encoded and written as one block once flush_bytes is reached.
+###  trailing_comma keeps the original row layout (every value followed
+###  by a comma, one more column than the header). Without it rows have
+###  exactly the header's 56 columns.
+#############################
+class AirRowWriter:
+    def __init__(self,outF,trailing_comma=True,flush_bytes=AIR_FLUSH_BYTES):
+        self.outF=outF
+        self.flush_bytes=flush_bytes
+        if trailing_comma:
+            self.row_end=",\n"
+        else:
+            self.row_end="\n"
+        self.rows=[]
+        self.size=0
+
+    def write_row(self,msgtime,aid,tmaid,dap,apt,values):
+        row=msgtime+","+aid+","+tmaid+","+dap+","+apt+","+ \
+            ",".join(values)+self.row_end
+        self.rows.append(row)
+        self.size+=len(row)
+        if self.size >= self.flush_bytes:
+            self.flush()
+
+    ## Raw bytes (header, pipeline chunks) go out after any pending rows
+    def write(self,data):
+        self.flush()
+        self.outF.write(data)
+
+    def flush(self):
+        if self.rows:
+            self.outF.write("".join(self.rows).encode())
+            self.rows.clear()
+            self.size=0
+
+    def close(self):
+        self.flush()
+        self.outF.close()
+
+##############################
+###
+###  Flattens the con, adp or oth messages written to it into table rows
+###  (see extract_other), one row per element value, for --parse-other.
+###  Takes the raw message like the plain gzip output it replaces. A
+###  message without any values still gets one row with an empty path.
+#############################
+class OtherMessageParser:
+    def __init__(self,rowsF,msg_type):
+        self.rowsF=rowsF
+        self.msg_type=msg_type
+        self.seq=0
+
+    def write(self,data):
+        if isinstance(data,bytes):
+            data=data.decode()
+        msgtime,envname,elements=extract_other(data,self.msg_type)
+        self.seq+=1
+        if not elements:
+            self.rowsF.write_row(msgtime,envname,self.seq,"","")
+        for path,value in elements:
+            self.rowsF.write_row(msgtime,envname,self.seq,path,value)
+
+    def close(self):
+        self.rowsF.close()
+
+### Gzip CSV rows of a con/adp/oth table, batched like AirRowWriter
+class OtherRowWriter(AirRowWriter):
+    def __init__(self,outF,flush_bytes=AIR_FLUSH_BYTES):
+        AirRowWriter.__init__(self,outF,False,flush_bytes)
+
+    def write_row(self,msgtime,envname,seq,path,value):
+        row=msgtime+","+envname+","+str(seq)+","+path+","+ \
+            csv_value(value)+"\n"
+        self.rows.append(row)
+        self.size+=len(row)
+        if self.size >= self.flush_bytes:
+            self.flush()
+
+## Free text values may hold commas or quotes, quote those the CSV way
+def csv_value(value):
+    if "," in value or '"' in value or "\n" in value or "\r" in value:
+        return '"'+value.replace('"','""')+'"'
+    return value
+
+
+def build_parms(args):
+    """Helper function to parse command line arguments into dictionary
+        input: ArgumentParser class object
+        output: dictionary of expected parameters
+    """
+    readDir=args.dir
+    outdir=args.outdir  
+    workers=args.workers
+    parms = {"readDir":readDir,
+             "outdir":outdir,
+             "workers":workers,
+             "binary":args.binary,
+             "trailing_comma":not args.no_trailing_comma,
+             "format":args.format,
+             "indexed":args.indexed,
+             "parse_other":args.parse_other,
+             "dedup":args.dedup,
+             "partition_by":args.partition_by,
+             "incremental":args.incremental,
+             "pipeline":args.pipeline,
+             "parse_threads":args.parse_threads,
+             "compresslevel":args.compresslevel,
+             "metrics":args.metrics,
+             "profile":args.profile,
+             "profile_interval":args.profile_interval}
+    
+    return(parms)
+     
+if __name__ == "__main__":
+    
+    parser = argparse.ArgumentParser(description = \
+                 "Step1 Parsing of TBFM SWIM.")
+    parser.add_argument("dir", 
+                        help = "Directory to obtain raw compressed TBFM SWIM.")
+    parser.add_argument("--outdir", default = "./")
+    parser.add_argument("--workers", type=int, default = 1,
+                        help = "Number of files to process in parallel.")
+    parser.add_argument("--incremental", action="store_true",
+                        help = "Skip inputs that are unchanged since the "+
+                        "last run, as recorded in the output manifest.")
+    parser.add_argument("--format", choices=["csv","parquet","delta"],
+                        default="csv",
+                        help = "Air output as gzip CSV, typed Parquet "+
+                        "(needs pyarrow) or per-flight changes (delta).")
+    parser.add_argument("--no-trailing-comma", action="store_true",
+                        help = "Write air rows with the same 56 columns as "+
+                        "the header instead of the legacy trailing comma.")
+    parser.add_argument("--indexed", action="store_true",
+                        help = "Write the air CSV as block gzip members "+
+                        "with a per-flight index (see tbfm_index.py).")
+    parser.add_argument("--parse-other", action="store_true",
+                        help = "Flatten con/adp/oth messages into tables "+
+                        "(csv.gz or parquet, like air) instead of raw XML.")
+    parser.add_argument("--dedup", action="store_true",
+                        help = "Drop air messages that repeat the flight's "+
+                        "last written fields (see tbfm_dedup.py).")
+    parser.add_argument("--partition-by", choices=PARTITION_COLUMNS,
+                        help = "Write the air rows into one directory per "+
+                        "value, e.g. apt=ATL/ (see tbfm_partition.py). A "+
+                        "summary of the whole directory has the national "+
+                        "rows, but with the flights grouped by partition.")
+    parser.add_argument("--binary", action="store_true",
+                        help = "Read the decompressed stream as bytes and "+
+                        "pass con/adp/oth through without decoding.")
+    parser.add_argument("--pipeline", action="store_true",
+                        help = "Overlap decompress, parse and compress "+
+                        "stages with threads inside each file.")
+    parser.add_argument("--parse-threads", type=int, default = 2,
+                        help = "Parse threads per file in --pipeline mode.")
+    parser.add_argument("--compresslevel", type=int, default = 9,
+                        choices=range(0,10), metavar="0-9",
+                        help = "gzip level of the outputs, lower is faster.")
+    add_metrics_arguments(parser)
+    args=parser.parse_args()
+    ## The index is built from rows, pipeline batches arrive preformatted
+    if args.indexed and (args.pipeline or args.format != "csv"):
+        parser.error("--indexed works with the csv format without "+
+                     "--pipeline")
+    ## Pipeline parse threads would each restart the message numbering
+    if args.parse_other and args.pipeline:
+        parser.error("--parse-other does not work with --pipeline")
+    ## The fingerprints of a file would be split across parse threads
+    if args.dedup and args.pipeline:
+        parser.error("--dedup does not work with --pipeline")
+    ## Partitions are opened as rows arrive, pipeline batches are text
+    if args.partition_by and (args.pipeline or args.indexed):
+        parser.error("--partition-by does not work with --pipeline or "+
+                     "--indexed")
+    ## A flight's deltas would be split across parse threads
+    if args.format == "delta" and args.pipeline:
+        parser.error("--format delta does not work with --pipeline")
+    parms = build_parms(args)
+    main()
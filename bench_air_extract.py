@@ -0,0 +1,95 @@
+##@Copyright 2020. Ulrich Linder, Al Capps
+##@Organization - aviationdatascience.org non-profit, through release from Penn State
+##@License - This work is licensed under MIT license - https://opensource.org/licenses/MIT
+## This permissive license lets you do basically whatever you want.
+## Per the details of the MIT license, the software is provided "as is".
+## Have fun!
+
+## Benchmark of the air message extraction used by TBFM_XML_flatten_to_CSV.
+## Reads the air messages from one raw TBFM SWIM file, runs both the original
+## BeautifulSoup path and the fast scanner over them, checks the flattened
+## CSV rows are identical and reports messages/sec for each.
+import gzip
+import argparse
+import time
+from tbfm_extract import extract_air
+from tbfm_extract import extract_air_bs4
+from tbfm_extract import _extract_air_fast
+from tbfm_extract import FallbackNeeded
+
+def main():
+
+    air_lines=read_air_lines(parms["readFile"],parms["limit"])
+    num_msgs=len(air_lines)
+    print("Read "+str(num_msgs)+" air messages from "+parms["readFile"],flush=True)
+    if num_msgs == 0:
+        return
+
+    ## Count how many messages the fast scanner hands back to bs4
+    fallbacks=0
+    for str_line in air_lines:
+        try:
+            _extract_air_fast(str_line)
+        except FallbackNeeded:
+            fallbacks=fallbacks+1
+
+    bs4_rows,bs4_secs=time_extractor(extract_air_bs4,air_lines)
+    fast_rows,fast_secs=time_extractor(extract_air,air_lines)
+
+    mismatches=0
+    for bs4_row,fast_row in zip(bs4_rows,fast_rows):
+        if to_csv_row(bs4_row) != to_csv_row(fast_row):
+            mismatches=mismatches+1
+
+    print("bs4 path:  "+str(round(num_msgs/bs4_secs,1))+" messages/sec")
+    print("fast path: "+str(round(num_msgs/fast_secs,1))+" messages/sec")
+    print("speedup:   "+str(round(bs4_secs/fast_secs,1))+"x")
+    print("fallbacks to bs4: "+str(fallbacks))
+    print("mismatched rows:  "+str(mismatches),flush=True)
+
+### Collects the air lines exactly the way the flattener classifies them
+def read_air_lines(full_path,limit):
+    air_lines=[]
+    with gzip.open(full_path,'rt') as f:
+        for line in f:
+            str_line=str(line)
+            if "capture-timestamp" in str_line:
+                continue
+            str_line=str_line.split("b'")[1]
+            if "airType=" in str_line:
+                air_lines.append(str_line)
+                if limit and len(air_lines) >= limit:
+                    break
+    return air_lines
+
+def time_extractor(extractor,air_lines):
+    start=time.perf_counter()
+    rows=[extractor(str_line) for str_line in air_lines]
+    stop=time.perf_counter()
+    return rows,stop-start
+
+### Same byte layout parse_air writes for a row
+def to_csv_row(row):
+    msgtime,aid,tmaid,dap,apt,values=row
+    key=msgtime+","+aid+","+tmaid+","+dap+","+apt+","
+    return (key+"".join(value+"," for value in values)+"\n").encode()
+
+def build_parms(args):
+    """Helper function to parse command line arguments into dictionary
+        input: ArgumentParser class object
+        output: dictionary of expected parameters
+    """
+    parms = {"readFile":args.file,
+             "limit":args.limit}
+    return(parms)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = \
+                 "Benchmark air message extraction.")
+    parser.add_argument("file",
+                        help = "Raw compressed TBFM SWIM file (.xml.gz).")
+    parser.add_argument("--limit", type=int, default=0,
+                        help = "Only use the first N air messages.")
+    parms = build_parms(parser.parse_args())
+    main()
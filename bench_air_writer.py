@@ -0,0 +1,94 @@
+##@Copyright 2020. Ulrich Linder, Al Capps
+##@Organization - aviationdatascience.org non-profit, through release from Penn State
+##@License - This work is licensed under MIT license - https://opensource.org/licenses/MIT
+## This permissive license lets you do basically whatever you want.
+## Per the details of the MIT license, the software is provided "as is".
+## Have fun!
+
+## Before/after benchmark of writing flattened air rows to gzip.
+## The air messages of one raw TBFM SWIM hour file are extracted once,
+## then written with the original one-write-per-field loop and with the
+## batched AirRowWriter. Reports the time of each and checks that the
+## decompressed outputs are identical.
+import gzip
+import io
+import argparse
+import time
+from bench_air_extract import read_air_lines
+from tbfm_extract import extract_air
+from TBFM_XML_flatten_to_CSV import AirRowWriter
+from TBFM_XML_flatten_to_CSV import write_air_header
+
+comma_enc=",".encode()
+newl_enc="\n".encode()
+
+def main():
+
+    air_lines=read_air_lines(parms["readFile"],parms["limit"])
+    rows=[extract_air(str_line) for str_line in air_lines]
+    num_rows=len(rows)
+    print("Extracted "+str(num_rows)+" air rows from "+parms["readFile"],
+          flush=True)
+    if num_rows == 0:
+        return
+
+    before_out,before_secs=time_writer(write_rows_per_field,rows)
+    after_out,after_secs=time_writer(write_rows_batched,rows)
+
+    print("per-field writes: "+str(round(before_secs,3))+" secs, "+
+          str(round(num_rows/before_secs,1))+" rows/sec")
+    print("AirRowWriter:     "+str(round(after_secs,3))+" secs, "+
+          str(round(num_rows/after_secs,1))+" rows/sec")
+    print("speedup:          "+str(round(before_secs/after_secs,1))+"x")
+    same=gzip.decompress(before_out) == gzip.decompress(after_out)
+    print("identical output: "+str(same),flush=True)
+
+### Writes into an in-memory gzip so disk speed does not hide the cost
+def time_writer(writer,rows):
+    buf=io.BytesIO()
+    airF=gzip.GzipFile(fileobj=buf,mode="wb",
+                       compresslevel=parms["compresslevel"])
+    start=time.perf_counter()
+    writer(airF,rows)
+    airF.close()
+    stop=time.perf_counter()
+    return buf.getvalue(),stop-start
+
+### The original parse_air write loop
+def write_rows_per_field(airF,rows):
+    write_air_header(airF)
+    for msgtime,aid,tmaid,dap,apt,values in rows:
+        key=msgtime+","+aid+","+tmaid+","+dap+","+apt+","
+        airF.write(key.encode())
+        for value in values:
+            airF.write(value.encode()+comma_enc)
+        airF.write(newl_enc)
+
+def write_rows_batched(airF,rows):
+    writer=AirRowWriter(airF)
+    write_air_header(writer)
+    for row in rows:
+        writer.write_row(*row)
+    writer.flush()
+
+def build_parms(args):
+    """Helper function to parse command line arguments into dictionary
+        input: ArgumentParser class object
+        output: dictionary of expected parameters
+    """
+    parms = {"readFile":args.file,
+             "limit":args.limit,
+             "compresslevel":args.compresslevel}
+    return(parms)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = \
+                 "Benchmark writing air rows to gzip.")
+    parser.add_argument("file",
+                        help = "Raw compressed TBFM SWIM hour file (.xml.gz).")
+    parser.add_argument("--limit", type=int, default=0,
+                        help = "Only use the first N air messages.")
+    parser.add_argument("--compresslevel", type=int, default=9)
+    parms = build_parms(parser.parse_args())
+    main()
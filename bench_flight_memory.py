@@ -0,0 +1,148 @@
+##@Copyright 2020. Ulrich Linder, Al Capps
+##@Organization - aviationdatascience.org non-profit, through release from Penn State
+##@License - This work is licensed under MIT license - https://opensource.org/licenses/MIT
+## This permissive license lets you do basically whatever you want.
+## Per the details of the MIT license, the software is provided "as is".
+## Have fun!
+
+## Memory benchmark of the per-flight state of create_daily_TBFM_summary.
+## Loads the rows of one or more flattened air CSV files, builds the flight
+## table with the original list-of-dicts state (TflightListDict, kept here
+## for comparison) and with the current TflightState, and reports the
+## bytes per flight of each (tracemalloc) and whether the summary rows
+## come out identical.
+import argparse
+import gc
+import tracemalloc
+import create_daily_TBFM_summary as summary
+
+def main():
+
+    ## Lines are kept joined and split again while building, so the
+    ## strings a flight keeps are allocated (and counted) like in the summary
+    rows=[]
+    for full_path in parms["files"]:
+        for result in summary.read_air_rows(full_path,"csv"):
+            if "msgtime" in result[0]:
+                columnames=result
+                continue
+            rows.append(",".join(result))
+    print("Read "+str(len(rows))+" air rows",flush=True)
+
+    before_flights,before_bytes=measure(build_legacy,rows,columnames)
+    after_flights,after_bytes=measure(build_compact,rows,columnames)
+    num_flights=len(after_flights)
+    if num_flights == 0:
+        return
+
+    before_rows=[legacy_flight_row(value) for value in before_flights.values()]
+    after_rows=[summary.flight_row(value) for value in after_flights.values()]
+
+    print("flights: "+str(num_flights))
+    print("TflightListDict: "+str(round(before_bytes/num_flights))+
+          " bytes/flight")
+    print("TflightState:    "+str(round(after_bytes/num_flights))+
+          " bytes/flight")
+    print("reduction:       "+str(round(before_bytes/after_bytes,1))+"x")
+    print("identical summary rows: "+str(before_rows == after_rows),
+          flush=True)
+
+### Net bytes still allocated once the flight table is built
+def measure(builder,rows,columnames):
+    gc.collect()
+    tracemalloc.start()
+    base=tracemalloc.get_traced_memory()[0]
+    flights=builder(rows,columnames)
+    gc.collect()
+    used=tracemalloc.get_traced_memory()[0]-base
+    tracemalloc.stop()
+    return flights,used
+
+def build_compact(rows,columnames):
+    tbfmFlights={}
+    for line in rows:
+        summary.update_flight(tbfmFlights,line.split(","))
+    return tbfmFlights
+
+##############################
+###
+###  The original state and update loop, for comparison only
+#############################
+LEGACY_KEYS=summary.AIR_COLUMNS+('firstmtime','laststdtime','firststdtime',
+                                 'stdminusnowtime','numstdupdates')
+
+class TflightListDict:
+    def __init__(self, gufi):
+        self.dictlist = [{name:""} for name in LEGACY_KEYS[:-2]]
+        self.dictlist.append({'stdminusnowtime':-999})
+        self.dictlist.append({'numstdupdates':0})
+
+def build_legacy(rows,columnames):
+    tbfmFlights={}
+    for line in rows:
+        result=line.split(",")
+        msgtime=result[0]
+        aid=result[1]
+        tmaId=result[2]
+        dap=result[3]
+        apt=result[4]
+        if not (aid and tmaId and dap and apt):
+            continue
+        key="aid=" + aid +",tmaId=" +tmaId + ",dap=" + dap + ",apt=" + apt
+        if not key in tbfmFlights:
+            value=TflightListDict(key)
+            for entry in range(len(result)):
+                if not result[entry] in (None,""):
+                    value.dictlist[entry]={columnames[entry] : result[entry] }
+                value.dictlist[56]={'firstmtime' : msgtime }
+                if (entry == 38):
+                    thisSTD=result[entry]
+                    if (len(thisSTD) > 0):
+                        legacy_update_std(value,thisSTD,'new',msgtime)
+                tbfmFlights.update({key : value})
+        else:
+            value= tbfmFlights.get(key)
+            for entry in range(len(result)):
+                if not result[entry] in (None,""):
+                    if (columnames[entry] == 'std'):
+                        thisSTD=result[entry]
+                        if (len(thisSTD) > 0):
+                            legacy_update_std(value,thisSTD,'update',msgtime)
+                    value.dictlist[entry]={columnames[entry] : result[entry] }
+    return tbfmFlights
+
+def legacy_update_std(value,thisSTD,status,msgtime):
+    diff=summary.compute_time_diff_secs
+    if status == "new" or len(value.dictlist[38].get('std',"")) == 0:
+        value.dictlist[58]={'firststdtime':msgtime}
+        value.dictlist[57]={'laststdtime':msgtime}
+        value.dictlist[59]={'stdminusnowtime':diff(thisSTD,msgtime)}
+    elif value.dictlist[38].get('std',"") != thisSTD:
+        value.dictlist[57]={'laststdtime':msgtime}
+        value.dictlist[59]={'stdminusnowtime':diff(thisSTD,msgtime)}
+        num_updates=value.dictlist[60].get('numstdupdates',"")+1
+        value.dictlist[60]={'numstdupdates':num_updates}
+
+def legacy_flight_row(value):
+    row=[value.dictlist[entry].get(name,"")
+         for entry,name in enumerate(LEGACY_KEYS[:-2])]
+    row.append(str(value.dictlist[59].get('stdminusnowtime',-999)))
+    row.append(str(value.dictlist[60].get('numstdupdates',0)))
+    return row
+
+def build_parms(args):
+    """Helper function to parse command line arguments into dictionary
+        input: ArgumentParser class object
+        output: dictionary of expected parameters
+    """
+    parms = {"files":args.files}
+    return(parms)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = \
+                 "Benchmark memory of the daily summary flight state.")
+    parser.add_argument("files", nargs="+",
+                        help = "Flattened air CSV files (_air.csv.gz).")
+    parms = build_parms(parser.parse_args())
+    main()
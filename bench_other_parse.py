@@ -0,0 +1,132 @@
+##@Copyright 2020. Ulrich Linder, Al Capps
+##@Organization - aviationdatascience.org non-profit, through release from Penn State
+##@License - This work is licensed under MIT license - https://opensource.org/licenses/MIT
+## This permissive license lets you do basically whatever you want.
+## Per the details of the MIT license, the software is provided "as is".
+## Have fun!
+
+## Benchmark of --parse-other. Reads the con, adp and oth messages from one
+## raw TBFM SWIM file and writes them twice into in-memory gzip outputs:
+## raw, the way the flattener stores them by default, and flattened into
+## table rows by OtherMessageParser. Reports messages/sec of both and the
+## time parsing adds per message. Also checks the fast scanner against the
+## BeautifulSoup reference and counts the messages it hands back to bs4.
+import gzip
+import argparse
+import io
+import time
+from tbfm_extract import OTHER_TYPES
+from tbfm_extract import extract_other_bs4
+from tbfm_extract import _extract_other_fast
+from tbfm_extract import FallbackNeeded
+from TBFM_XML_flatten_to_CSV import OtherMessageParser
+from TBFM_XML_flatten_to_CSV import OtherRowWriter
+
+def main():
+
+    messages=read_other_lines(parms["readFile"],parms["limit"])
+    num_msgs=len(messages)
+    print("Read "+str(num_msgs)+" con/adp/oth messages from "+
+          parms["readFile"],flush=True)
+    if num_msgs == 0:
+        return
+
+    fallbacks=0
+    mismatches=0
+    for msg_type,str_line in messages:
+        try:
+            fast=_extract_other_fast(str_line,msg_type)
+        except FallbackNeeded:
+            fallbacks=fallbacks+1
+            continue
+        if fast != extract_other_bs4(str_line,msg_type):
+            mismatches=mismatches+1
+
+    raw_secs,raw_bytes=time_raw(messages,parms["compresslevel"])
+    table_secs,table_bytes=time_table(messages,parms["compresslevel"])
+
+    print("raw passthrough: "+str(round(num_msgs/raw_secs,1))+
+          " messages/sec, "+str(raw_bytes)+" bytes")
+    print("parsed tables:   "+str(round(num_msgs/table_secs,1))+
+          " messages/sec, "+str(table_bytes)+" bytes")
+    print("added cost:      "+
+          str(round((table_secs-raw_secs)/num_msgs*1e6,1))+
+          " microseconds/message")
+    print("fallbacks to bs4: "+str(fallbacks))
+    print("mismatched messages: "+str(mismatches),flush=True)
+
+### Collects (type, payload) the way split_messages classifies the lines
+def read_other_lines(full_path,limit):
+    messages=[]
+    with gzip.open(full_path,'rt') as f:
+        for line in f:
+            str_line=str(line)
+            if "capture-timestamp" in str_line:
+                continue
+            str_line=str_line.split("b'")[1]
+            if "airType=" in str_line:
+                continue
+            for msg_type in OTHER_TYPES:
+                if "<"+msg_type+">" in str_line:
+                    messages.append((msg_type,str_line))
+                    break
+            if limit and len(messages) >= limit:
+                break
+    return messages
+
+### In-memory gzip output per message type, and the buffers behind them
+def open_outputs(compresslevel):
+    buffers={msg_type:io.BytesIO() for msg_type in OTHER_TYPES}
+    outputs={msg_type:gzip.GzipFile(fileobj=buffers[msg_type],mode="wb",
+                                    compresslevel=compresslevel)
+             for msg_type in OTHER_TYPES}
+    return buffers,outputs
+
+def output_bytes(buffers):
+    return sum(len(buf.getvalue()) for buf in buffers.values())
+
+def time_raw(messages,compresslevel):
+    buffers,outputs=open_outputs(compresslevel)
+    start=time.perf_counter()
+    for msg_type,str_line in messages:
+        outputs[msg_type].write(str_line.encode())
+    for outF in outputs.values():
+        outF.close()
+    stop=time.perf_counter()
+    return stop-start,output_bytes(buffers)
+
+def time_table(messages,compresslevel):
+    buffers,outputs=open_outputs(compresslevel)
+    parsers={msg_type:OtherMessageParser(OtherRowWriter(outputs[msg_type]),
+                                         msg_type)
+             for msg_type in OTHER_TYPES}
+    start=time.perf_counter()
+    for msg_type,str_line in messages:
+        parsers[msg_type].write(str_line.encode())
+    for parser in parsers.values():
+        parser.close()
+    stop=time.perf_counter()
+    return stop-start,output_bytes(buffers)
+
+def build_parms(args):
+    """Helper function to parse command line arguments into dictionary
+        input: ArgumentParser class object
+        output: dictionary of expected parameters
+    """
+    parms = {"readFile":args.file,
+             "limit":args.limit,
+             "compresslevel":args.compresslevel}
+    return(parms)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = \
+                 "Benchmark parsing con/adp/oth messages into tables.")
+    parser.add_argument("file",
+                        help = "Raw compressed TBFM SWIM file (.xml.gz).")
+    parser.add_argument("--limit", type=int, default=0,
+                        help = "Only use the first N con/adp/oth messages.")
+    parser.add_argument("--compresslevel", type=int, default = 9,
+                        choices=range(0,10), metavar="0-9")
+    parms = build_parms(parser.parse_args())
+    main()
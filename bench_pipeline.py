@@ -0,0 +1,171 @@
+##@Copyright 2020. Ulrich Linder, Al Capps
+##@Organization - aviationdatascience.org non-profit, through release from Penn State
+##@License - This work is licensed under MIT license - https://opensource.org/licenses/MIT
+## This permissive license lets you do basically whatever you want.
+## Per the details of the MIT license, the software is provided "as is".
+## Have fun!
+
+## End-to-end benchmark of the three processing steps on synthetic data.
+## For every scale (messages per hour) a day of raw files is generated
+## with tbfm_synth, then the flattener, the daily summary and the dataset
+## step are run as separate processes, each timed on its own. Reports
+## wall time, messages/sec, peak RSS and output size per stage, and can
+## save the table as CSV. The same seed and scales give the same inputs,
+## so runs before and after a change can be compared offline.
+import argparse
+import gzip
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from tbfm_synth import generate_day
+
+###The following can be treated as static and immutable.
+STAGES=("flatten","summary","dataset")
+
+RESULT_COLUMNS=("scale","stage","messages","secs","msgs_per_sec",
+                "peak_rss_mb","output_mb")
+
+def main():
+
+    here=os.path.dirname(os.path.abspath(__file__))
+    work_dir=parms["workdir"] or tempfile.mkdtemp(prefix="tbfm_bench_")
+    results=[]
+    try:
+        for scale in parms["scales"]:
+            results.extend(run_scale(here,work_dir,scale))
+    finally:
+        if not parms["keep"] and not parms["workdir"]:
+            shutil.rmtree(work_dir,ignore_errors=True)
+
+    print(",".join(RESULT_COLUMNS))
+    for result in results:
+        print(",".join(str(result[name]) for name in RESULT_COLUMNS))
+    if parms["out"]:
+        with open(parms["out"],"w") as outF:
+            outF.write(",".join(RESULT_COLUMNS)+"\n")
+            for result in results:
+                outF.write(",".join(str(result[name])
+                                    for name in RESULT_COLUMNS)+"\n")
+    sys.stdout.flush()
+
+##############################
+###
+###  Generates one scale and runs the stages on it in order, each stage
+###  reading the previous one's output directory.
+#############################
+def run_scale(here,work_dir,scale):
+    target_date=parms["target_date"]
+    scale_dir=os.path.join(work_dir,str(scale))
+    raw_dir=os.path.join(scale_dir,"raw")
+    dirs={stage:os.path.join(scale_dir,stage) for stage in STAGES}
+    for stage_dir in dirs.values():
+        shutil.rmtree(stage_dir,ignore_errors=True)
+        os.makedirs(stage_dir)
+
+    if not os.path.isdir(raw_dir):
+        os.makedirs(raw_dir)
+        print("Generating "+str(scale)+" messages/hour in "+raw_dir,
+              flush=True)
+        synth_parms={"msgs_per_hour":scale,"update_secs":12.0,
+                     "std_churn":0.02,"escape_share":0.001,
+                     "shares":{"air":0.85,"con":0.05,"adp":0.05,
+                               "oth":0.05},
+                     "seed":parms["seed"],"compresslevel":6}
+        generate_day(raw_dir,target_date,synth_parms)
+    num_msgs=count_messages(raw_dir)
+
+    summary_name=os.path.join(dirs["summary"],target_date+
+                              "_tbfm_swim_flightsummary_AIR_out.csv")
+    commands={
+        "flatten":[os.path.join(here,"TBFM_XML_flatten_to_CSV.py"),raw_dir,
+                   "--outdir",dirs["flatten"]]+parms["flatten_args"],
+        "summary":[os.path.join(here,"create_daily_TBFM_summary.py"),
+                   dirs["flatten"],target_date,
+                   "--outdir",dirs["summary"]]+parms["summary_args"],
+        "dataset":[os.path.join(here,"create_tbfm_dataset_from_summary.py"),
+                   summary_name,"--outdir",dirs["dataset"]]+
+                  parms["dataset_args"]}
+    results=[]
+    for stage in STAGES:
+        secs,peak_kb=run_stage([sys.executable]+commands[stage],
+                               os.path.join(scale_dir,stage+".log"))
+        results.append({"scale":scale,"stage":stage,"messages":num_msgs,
+                        "secs":round(secs,3),
+                        "msgs_per_sec":round(num_msgs/secs,1),
+                        "peak_rss_mb":round(peak_kb/1024.0,1),
+                        "output_mb":round(dir_bytes(dirs[stage])/1e6,3)})
+        print(str(scale)+" "+stage+": "+str(round(secs,2))+" secs",
+              flush=True)
+    return results
+
+### Runs one stage, its output goes to a log. Returns (secs, peak RSS KB)
+### The RSS is the stage process's own, pool workers it starts are not in it
+def run_stage(command,log_name):
+    with open(log_name,"w") as log:
+        start=time.perf_counter()
+        proc=subprocess.Popen(command,stdout=log,stderr=subprocess.STDOUT)
+        ## wait4 gives the resource usage of this child alone
+        pid,status,usage=os.wait4(proc.pid,0)
+        stop=time.perf_counter()
+    if os.waitstatus_to_exitcode(status) != 0:
+        raise RuntimeError(" ".join(shlex.quote(part) for part in command)+
+                           " failed, see "+log_name)
+    return stop-start,usage.ru_maxrss
+
+### Raw messages are the capture-timestamp lines
+def count_messages(raw_dir):
+    num_msgs=0
+    for filename in os.listdir(raw_dir):
+        with gzip.open(os.path.join(raw_dir,filename),"rb") as f:
+            for line in f:
+                if line.startswith(b"capture-timestamp"):
+                    num_msgs=num_msgs+1
+    return num_msgs
+
+def dir_bytes(read_dir):
+    return sum(os.path.getsize(os.path.join(read_dir,filename))
+               for filename in os.listdir(read_dir))
+
+def build_parms(args):
+    """Helper function to parse command line arguments into dictionary
+        input: ArgumentParser class object
+        output: dictionary of expected parameters
+    """
+    parms = {"scales":[int(scale) for scale in args.scales.split(",")],
+             "target_date":args.target_date,
+             "seed":args.seed,
+             "workdir":args.workdir,
+             "keep":args.keep,
+             "out":args.out,
+             "flatten_args":shlex.split(args.flatten_args),
+             "summary_args":shlex.split(args.summary_args),
+             "dataset_args":shlex.split(args.dataset_args)}
+    return(parms)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = \
+                 "Benchmark flatten, summary and dataset on synthetic data.")
+    parser.add_argument("--scales", default="2000,10000,40000",
+                        help = "Comma separated messages per hour to test.")
+    parser.add_argument("--target-date", default="20191101")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--workdir",
+                        help = "Keep generated data here and reuse it on "+
+                        "later runs (default: a temporary directory).")
+    parser.add_argument("--keep", action="store_true",
+                        help = "Do not delete the temporary directory.")
+    parser.add_argument("--out", help = "Also write the results as CSV.")
+    parser.add_argument("--flatten-args", default="",
+                        help = "Extra flattener options, e.g. "+
+                        "\"--workers 4 --binary\".")
+    parser.add_argument("--summary-args", default="",
+                        help = "Extra summary options.")
+    parser.add_argument("--dataset-args", default="",
+                        help = "Extra dataset options.")
+    parms = build_parms(parser.parse_args())
+    main()
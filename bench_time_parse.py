@@ -0,0 +1,173 @@
+##@Copyright 2020. Ulrich Linder, Al Capps
+##@Organization - aviationdatascience.org non-profit, through release from Penn State
+##@License - This work is licensed under MIT license - https://opensource.org/licenses/MIT
+## This permissive license lets you do basically whatever you want.
+## Per the details of the MIT license, the software is provided "as is".
+## Have fun!
+
+## Benchmark and correctness check of the Zulu time parsing in tbfm_time.
+## Times the original strptime/mktime difference against the cached
+## parser on the (msgtime, std) pairs of flattened air CSV files, or on
+## generated pairs when no file is given. Then checks, with the local
+## timezone set to one with DST, that differences across the spring and
+## fall transitions come out right and that the column parser agrees
+## with the scalar one.
+import argparse
+import calendar
+import gzip
+import os
+import time
+from datetime import datetime
+from datetime import timedelta
+from tbfm_time import parse_zulu
+from tbfm_time import parse_zulu_column
+from tbfm_time import zulu_diff_secs
+
+## US DST change days of the TBFM sample years at the 02:00 wall clock
+## time. mktime read the Zulu strings as local time, so pairs around these
+## were off by an hour.
+DST_CHECK_TIMES=["2019-03-10T02:00:00Z","2019-11-03T02:00:00Z",
+                 "2020-03-08T02:00:00Z","2020-11-01T02:00:00Z"]
+
+def main():
+
+    pairs=read_time_pairs(parms["files"],parms["limit"])
+    print("Timing "+str(len(pairs))+" (std, msgtime) pairs, "+
+          str(len(set(pairs)))+" distinct",flush=True)
+
+    before,before_secs=time_diff(mktime_diff_secs,pairs)
+    parse_zulu.cache_clear()
+    after,after_secs=time_diff(zulu_diff_secs,pairs)
+    print("strptime/mktime: "+str(round(len(pairs)/before_secs,1))+
+          " diffs/sec")
+    print("parse_zulu:      "+str(round(len(pairs)/after_secs,1))+
+          " diffs/sec")
+    print("speedup:         "+str(round(before_secs/after_secs,1))+"x")
+    print("memo: "+str(parse_zulu.cache_info()))
+    ## Same result as long as the local zone has no DST (e.g. UTC)
+    print("same as mktime in "+os.environ.get("TZ","local")+" time: "+
+          str(before == after),flush=True)
+
+    failures=check_dst(parms["dst_tz"])+check_column(pairs)
+    print("correctness failures: "+str(failures),flush=True)
+
+### (std, msgtime) pairs of the air rows that carry an std
+def read_time_pairs(files,limit):
+    pairs=[]
+    for full_path in files:
+        with gzip.open(full_path,'rt') as f:
+            header=f.readline().rstrip().split(",")
+            std_entry=header.index("std")
+            for line in f:
+                result=line.rstrip().split(",")
+                if result[std_entry] != "":
+                    pairs.append((result[std_entry],result[0]))
+                    if limit and len(pairs) >= limit:
+                        return pairs
+    if not pairs:
+        pairs=generate_time_pairs(limit or 200000)
+    return pairs
+
+### Flights re-sending a handful of STDs once a second or so
+def generate_time_pairs(num_pairs):
+    start=datetime(2019,11,1,7)
+    pairs=[]
+    for num in range(num_pairs):
+        msgtime=start+timedelta(milliseconds=num*700)
+        std=msgtime.replace(microsecond=0)+ \
+            timedelta(minutes=20+(num//50)%7)
+        std=std.replace(second=0)
+        pairs.append((std.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                      msgtime.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3]+"Z"))
+    return pairs
+
+### The original compute_time_diff_secs
+def mktime_diff_secs(firsttime,secondtime):
+    firsttime_obj=datetime.strptime(firsttime,'%Y-%m-%dT%H:%M:%SZ')
+    secondtime_obj=datetime.strptime(secondtime,'%Y-%m-%dT%H:%M:%S.%fZ')
+    d1_ts = time.mktime(firsttime_obj.timetuple())
+    d2_ts = time.mktime(secondtime_obj.timetuple())
+    return int(d1_ts-d2_ts)
+
+def time_diff(diff,pairs):
+    start=time.perf_counter()
+    result=[diff(std,msgtime) for std,msgtime in pairs]
+    stop=time.perf_counter()
+    return result,stop-start
+
+##############################
+###
+###  Pairs straddling each DST change, two hours apart in UTC. With the
+###  local zone set to dst_tz the mktime version can be an hour off,
+###  the Zulu parser must always see exactly 7200 seconds.
+#############################
+def check_dst(dst_tz):
+    if not hasattr(time,"tzset"):
+        print("DST check skipped, time.tzset is not available")
+        return 0
+    old_tz=os.environ.get("TZ")
+    os.environ["TZ"]=dst_tz
+    time.tzset()
+    failures=0
+    try:
+        for change in DST_CHECK_TIMES:
+            change_dt=datetime.strptime(change,'%Y-%m-%dT%H:%M:%SZ')
+            before=change_dt-timedelta(hours=1)
+            after=change_dt+timedelta(hours=1)
+            std=after.strftime('%Y-%m-%dT%H:%M:%SZ')
+            msgtime=before.strftime('%Y-%m-%dT%H:%M:%S')+".250Z"
+            expected=calendar.timegm(after.timetuple())- \
+                calendar.timegm(before.timetuple())
+            new=zulu_diff_secs(std,msgtime)
+            old=mktime_diff_secs(std,msgtime)
+            print(change+" in "+dst_tz+": expected "+str(expected)+
+                  ", parse_zulu "+str(new)+", mktime "+str(old))
+            if new != expected:
+                failures=failures+1
+    finally:
+        if old_tz is None:
+            del os.environ["TZ"]
+        else:
+            os.environ["TZ"]=old_tz
+        time.tzset()
+    return failures
+
+### The column parser must agree with the scalar one, NaN for bad values
+def check_column(pairs):
+    values=[msgtime for std,msgtime in pairs[:10000]]+["","not a time",None]
+    column=parse_zulu_column(values)
+    failures=0
+    for value,secs in zip(values,column):
+        try:
+            expected=parse_zulu(value)
+        except (TypeError,ValueError):
+            if secs == secs:
+                failures=failures+1
+            continue
+        if abs(secs-expected) > 1e-6:
+            failures=failures+1
+    return failures
+
+def build_parms(args):
+    """Helper function to parse command line arguments into dictionary
+        input: ArgumentParser class object
+        output: dictionary of expected parameters
+    """
+    parms = {"files":args.files,
+             "limit":args.limit,
+             "dst_tz":args.dst_tz}
+    return(parms)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = \
+                 "Benchmark and check Zulu time parsing.")
+    parser.add_argument("files", nargs="*",
+                        help = "Flattened air CSV files (_air.csv.gz), "+
+                        "synthetic times are used when none are given.")
+    parser.add_argument("--limit", type=int, default=0,
+                        help = "Only use the first N time pairs.")
+    parser.add_argument("--dst-tz", default="America/New_York",
+                        help = "Local timezone with DST for the checks.")
+    parms = build_parms(parser.parse_args())
+    main()
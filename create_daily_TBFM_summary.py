@@ -1,404 +1,991 @@
-##@Copyright 2020. Ulrich Linder, Al Capps
-##@Organization - aviationdatascience.org non-profit through release from Penn State
-##@License - This work is licensed under MIT license - https://opensource.org/licenses/MIT
-## This permissive license lets you do basically whatever you want.
-## Per the details of the MIT license, the software is provided "as is".
-## Have fun!
-
-## In support of Penn State Data Science, this is the 2nd step in data parsing 
-##of publicly available TBFM SWIM data
-## This program beings with the flattened output of earlier "air" messages in CSV 
-## format and stores the latest information in a single record that is
-## output to a CSV file. This output becomes an easy way to look up
-## all the flights that TBFM thinks flew a particular day as well as its
-## unique identifiers. This output is often then used as a starting point
-## when iterating back through all flattened CSV TBFM messages for that day.
-
-import gzip
-import os
-import re
-import argparse
-import os.path
-import time
-import pandas as pd
-from datetime import datetime
-from datetime import timedelta 
-
-
-## Main loop###
-## searches the directory given, processes each TBFM AIR CSV file
-## stores the data in a python dictionary (with inner class) 
-## then once complete with the last file, reconstructs a record of
-## each flight with as complete a dataset as possible
-## for each snapshot of specified duration. Note: originally this was done
-## in a pandas dataframe but the processing was slow so this approach was taken 
-def main():
- 
-    start = time.time()
-    tbfmFlights={}   
-    ldir=os.listdir(parms["readDir"])
-    path=os.getcwd() + "\\" + parms["readDir"]
-
-    out_dir=parms["outdir"]
-
-    
-    #20191102 format as string
-    ###For this analysis, the local day starts at 0700 and
-    ### and ends the next zulu date with teh end of the 0600 file
-    ### One major reason for this is that end users generally like to see
-    ### the results in local time. Another reason is this split leads to the
-    ### fewest missing messages between days (given lowest demand)
-    target_date=parms["target_date"]
-    dt_target = datetime.strptime(target_date, "%Y%m%d")
-    dt_nextday = dt_target + timedelta(days=1)
-    string_nextday=dt_nextday.strftime("%Y%m%d") 
-    files_to_process=create_filelist(ldir,target_date,string_nextday)
-
-
-    for filename in files_to_process:
-        ## Only process files that are  AIR CSV files
-        if not filename.endswith("air.csv.gz"):
-            continue
-        
-        full_path=path + "\\" + filename
-        print("Processing "+full_path,flush=True)
-        
-        ## iterate through all messages
-        ## match on aid, tmaId, dap, apt and update internal info 
-        ## to keep the latest info on each flight
-        with gzip.open(full_path,'rt') as f:
-         for line in f:   
-            str_line=str(line).rstrip()
-            #print(str_line)
-            result=re.split(',',str_line)
-            
-            ### Use the header to create our column key-value names
-            if "msgtime" in result[0]:
-                columnames=result
-                continue
-            msgtime=result[0]
-            aid=result[1]
-            tmaId=result[2]
-            dap=result[3]
-            apt=result[4]
-            
-            if aid and tmaId and dap and apt:
-                pass
-            else:
-                #The elements for a key do not exist. Skipping.
-                continue
-            
-            key="aid=" + aid +",tmaId=" +tmaId + ",dap=" + dap + ",apt=" + apt
-
-            ##Add or retrieve unique flight, update relevant items
-            ## Each populated item is updated as a key/value pair that 
-            ## is stored in an instantiated innner class. This adds
-            ##complexity but was done primarily for high efficiency.
-            if not key in tbfmFlights:
-              ##Create a blank TflightListDict class to store key specific info
-              value=TflightListDict(key)
-              for entry in range(len(result)):
-                  if not result[entry] in (None,""):
-                      #Always update with the latest
-                      value.dictlist[entry]={columnames[entry] : result[entry] }
-                  
-                  #Given this is the first message for this flight, denote it
-                  value.dictlist[56]={'firstmtime' : msgtime }
-                  
-                  ##Unfortunately hard coded, entry 38 is 'std' element
-                  if (entry == 38):
-                      thisSTD=result[entry]
-                      if (len(thisSTD) > 0):
-                          value=update_std_elements(value,key,thisSTD,'new',msgtime)                       
-                      
-                  tbfmFlights.update({key : value})
-            else:
-               ##We already have an entry for this flight. Update it.
-               value= tbfmFlights.get(key)
-               for entry in range(len(result)):
-                  if not result[entry] in (None,""):                    
-                      ##If we have an STD/APREQ, special logic to add other elements
-                      if (columnames[entry] == 'std'):
-                          thisSTD=result[entry]
-                          if (len(thisSTD) > 0):
-                            value=update_std_elements(value,key,thisSTD,'update',msgtime)
-                          
-                      #Always update with the latest
-                      value.dictlist[entry]={columnames[entry] : result[entry] }
-                                           
-    outname=out_dir + "/"+target_date+"_tbfm_swim_flightsummary_AIR_out.csv"                            
-    printFlights(tbfmFlights,outname,columnames)
-            
-    stop = time.time()
-    duration = (stop - start)/60
-    print("Processing took "+ str(duration) + " minutes",flush=True)
-
-##A helper method to reduce the complexity of the main processing loop
-def update_std_elements(value,key,thisSTD,status,msgtime):
-            
-    if(status == "new"):
-        #This is a new flight being added, set orig/latest APREQ time
-        #print("first std when creating:"+key +":"+thisSTD)
-        value.dictlist[58]={'firststdtime':msgtime}
-        value.dictlist[57]={'laststdtime':msgtime}
-        diff = compute_time_diff_secs(thisSTD,msgtime)
-        value.dictlist[59]={'stdminusnowtime':diff}
-        
-    elif (status =="update"):
-        ##We have a flight but don't know at this point
-        ##if this is really an update to std, new add, or duplicate
-        ##First, we get the currently stored value for 'std' for this flight
-        current_std=value.dictlist[38].get('std',"")
-                        
-        if (len(current_std) ==0):
-            ##We do not currently have an 'std' so we add it
-            value.dictlist[58]={'firststdtime':msgtime}
-            value.dictlist[57]={'laststdtime':msgtime}
-            diff = compute_time_diff_secs(thisSTD,msgtime)
-            value.dictlist[59]={'stdminusnowtime':diff}
-            #print("This is the first std when updating flight:"+key)
-        else:
-            ##We have an 'std' already. Is it really new or duplicate?
-            if (current_std == thisSTD):
-                #duplicate STD, do nothing
-                pass
-            else:
-                #print("updated STD from "+current_std +" to "+thisSTD)
-                value.dictlist[57]={'laststdtime':msgtime}
-                diff = compute_time_diff_secs(thisSTD,msgtime)
-                value.dictlist[59]={'stdminusnowtime':diff}
-                num_updates=value.dictlist[60].get('numstdupdates',"")
-                num_updates = num_updates +1
-                value.dictlist[60]={'numstdupdates':num_updates}
-
-    return value
-    
-##Method to return the difference between two times, in seconds
-##Inputs: two strings that have format like 2019-11-01T07:50:52.794Z
-def compute_time_diff_secs(firsttime,secondtime):           
-            if(pd.isna(firsttime)):
-                return
-
-            if(pd.isna(secondtime)):
-                return
-            
-            firsttime_obj=datetime.strptime(firsttime,'%Y-%m-%dT%H:%M:%SZ')
-            secondtime_obj=datetime.strptime(secondtime,'%Y-%m-%dT%H:%M:%S.%fZ')
-            # Convert to Unix timestamp
-            d1_ts = time.mktime(firsttime_obj.timetuple())
-            d2_ts = time.mktime(secondtime_obj.timetuple())
-
-            secs_diff = int(d1_ts-d2_ts) 
-            return (secs_diff) 
-        
-def create_filelist(ldir,target_date,string_nextday):
-    filelist=[]
-
-    ## Look for files from target date first    
-    for hour in range(7,24):
-        hour_str=str('{:02d}'.format(hour))
-        file=target_date+"_"+hour_str+"00"
-        #print(file)
-        for filename in ldir:
-            if (file in  filename) and (filename.endswith("air.csv.gz")):
-                #print(filename)
-                filelist.append(filename)
-    ## Now same thing for 6 files from next day
-    for hour in range(0,7):
-        hour_str=str('{:02d}'.format(hour))
-        file=string_nextday+"_"+hour_str+"00"
-        #print(file)
-        for filename in ldir:
-            if (file in  filename) and (filename.endswith("air.csv.gz")):
-                #print(filename)
-                filelist.append(filename)
-    
-    list_len=len(filelist)
-    if (list_len < 23):
-        print("Missing a file.")
-        print(filelist)
-        exit()
-
-    return filelist
-        
-### Iterates through each flight in the dictionary and prints the 
-### information in a very specific manner. Storing is in generic key/value
-### pairs but printing is hard coded. There is probably a more elegant way
-### to do this but this worked nicely for this team's needs
-def printFlights(tbfmFlights,outfile,columnames):
-
-        outF = open(outfile, "w")
-        outF.write("lastmsgtime,aid,tmaId,"+
-        "dap,apt,mfx,cat,gat,bcn,rwy,scn,fps,"+
-        "acs,typ,eng,spd,trw,sfz,rfz,eta_rwy,eta_mfx,"+
-        "eta_oma,eta_sfx,eta_dfx,eta_o4a,eta_o3a,"+
-        "eta_ooa,sta_o4a,sta_o3a,sta_ooa,sta_oma,"+
-        "sta_dfx,sta_sfx,ara,tds,cfx,ctm,etd,std,"+
-        "etm,est,a10,tcr,dfx,sfx,oma,ooa,o3a,o4a,"+
-        "ina,sus,man,sta_rwy,sta_mfx,cfg,tra,firstmsgtime,laststdtime,"+
-        "firststdtime,stdminusnowtime,numstdupdates\n")
-        
-        for key, value in tbfmFlights.items():
-            num_apreqs=str(value.dictlist[60].get('numstdupdates',0))
-            stdvsnow=str(value.dictlist[59].get('stdminusnowtime',-999))
-            
-            outF.write(value.dictlist[0].get('msgtime',"")+","+
-            value.dictlist[1].get('aid',"")+","+
-            value.dictlist[2].get('tmaId',"")+","+
-            value.dictlist[3].get('dap',"")+","+
-            value.dictlist[4].get('apt',"")+","+
-            value.dictlist[5].get('mfx',"")+","+
-            value.dictlist[6].get('cat',"")+","+
-            value.dictlist[7].get('gat',"")+","+
-            value.dictlist[8].get('bcn',"")+","+
-            value.dictlist[9].get('rwy',"")+","+
-            value.dictlist[10].get('scn',"")+","+
-            value.dictlist[11].get('fps',"")+","+
-            value.dictlist[12].get('acs',"")+","+
-            value.dictlist[13].get('typ',"")+","+
-            value.dictlist[14].get('eng',"")+","+
-            value.dictlist[15].get('spd',"")+","+
-            value.dictlist[16].get('trw',"")+","+
-            value.dictlist[17].get('sfz',"")+","+
-            value.dictlist[18].get('rfz',"")+","+
-            value.dictlist[19].get('eta_rwy',"")+","+	
-            value.dictlist[20].get('eta_mfx',"")+","+
-            value.dictlist[21].get('eta_oma',"")+","+
-            value.dictlist[22].get('eta_sfx',"")+","+
-            value.dictlist[23].get('eta_dfx',"")+","+
-            value.dictlist[24].get('eta_o4a',"")+","+
-            value.dictlist[25].get('eta_o3a',"")+","+
-            value.dictlist[26].get('eta_ooa',"")+","+
-            value.dictlist[27].get('sta_o4a',"")+","+
-            value.dictlist[28].get('sta_o3a',"")+","+
-            value.dictlist[29].get('sta_ooa',"")+","+
-            value.dictlist[30].get('sta_oma',"")+","+
-            value.dictlist[31].get('sta_dfx',"")+","+
-            value.dictlist[32].get('sta_sfx',"")+","+
-            value.dictlist[33].get('ara',"")+","+
-            value.dictlist[34].get('tds',"")+","+
-            value.dictlist[35].get('cfx',"")+","+
-            value.dictlist[36].get('ctm',"")+","+
-            value.dictlist[37].get('etd',"")+","+
-            value.dictlist[38].get('std',"")+","+
-            value.dictlist[39].get('etm',"")+","+
-            value.dictlist[40].get('est',"")+","+
-            value.dictlist[41].get('a10',"")+","+
-            value.dictlist[42].get('tcr',"")+","+
-            value.dictlist[43].get('dfx',"")+","+
-            value.dictlist[44].get('sfx',"")+","+
-            value.dictlist[45].get('oma',"")+","+
-            value.dictlist[46].get('ooa',"")+","+
-            value.dictlist[47].get('o3a',"")+","+
-            value.dictlist[48].get('o4a',"")+","+
-            value.dictlist[49].get('ina',"")+","+
-            value.dictlist[50].get('sus',"")+","+
-            value.dictlist[51].get('man',"")+","+
-            value.dictlist[52].get('sta_rwy',"")+","+
-            value.dictlist[53].get('sta_mfx',"")+","+
-            value.dictlist[54].get('cfg',"")+","+
-            value.dictlist[55].get('tra',"")+","+
-            value.dictlist[56].get('firstmtime',"")+","+
-            value.dictlist[57].get('laststdtime',"")+","+
-            value.dictlist[58].get('firststdtime',"")+","+
-            stdvsnow+","+
-            num_apreqs+"\n"
-            )
-            
-        outF.close()
-
-## Class used to allow updating of name value pairs as individual entries
-## are updated. This structure can be expanded to include derived elements
-## that would be part of the daily summary (e.g. - first frozen, time of APREQ)
-class TflightListDict:
-    def __init__(self, gufi):
-        self.dictlist = [       
-        {'msgtime' : ""}, 
-        {'aid' : ""},
-        {'tmaId' :""},
-        {'dap':""},
-        {'apt':""},
-        {'mfx':""},
-        {'cat':""},
-        {'gat':""},
-        {'bcn':""},
-        {'rwy':""},
-        {'scn':""},
-        {'fps':""},
-        {'acs':""},
-        {'typ':""},
-        {'eng':""},
-        {'spd':""},
-        {'trw':""},
-        {'sfz':""},
-        {'rfz':""},
-        {'eta_rwy':""},	
-        {'eta_mfx':""},
-        {'eta_oma':""},
-        {'eta_sfx':""},
-        {'eta_dfx':""},
-        {'eta_o4a':""},
-        {'eta_o3a':""},
-        {'eta_ooa':""},
-        {'sta_o4a':""},
-        {'sta_o3a':""},
-        {'sta_ooa':""},
-        {'sta_oma':""},
-        {'sta_dfx':""},
-        {'sta_sfx':""},
-        {'ara':""},
-        {'tds':""},
-        {'cfx':""},
-        {'ctm':""},
-        {'etd':""},
-        {'std':""},
-        {'etm':""},
-        {'est':""},
-        {'a10':""},
-        {'tcr':""},
-        {'dfx':""},
-        {'sfx':""},
-        {'oma':""},
-        {'ooa':""},
-        {'o3a':""},
-        {'o4a':""},
-        {'ina':""},
-        {'sus':""},
-        {'man':""},
-        {'sta_rwy':""}, 
-        {'sta_mfx':""},
-        {'cfg':""},
-        {'tra':""},
-        {'firstmtime':""},
-        {'laststdtime':""},
-        {'firststdtime':""},
-        {'stdminusnowtime':-999},
-        {'numstdupdates':0}
-        ]
- 
-def build_parms(args):
-    """Helper function to parse command line arguments into dictionary
-        input: ArgumentParser class object
-        output: dictionary of expected parameters
-    """
-    readDir=args.dir
-    #target_date=args.target_date
-    target_date=args.target_date
-    outdir=args.outdir  
-    parms = {"readDir":readDir,
-             "target_date":target_date,
-             "outdir":outdir}
-    
-    return(parms)
-     
-if __name__ == "__main__":
-    
-    parser = argparse.ArgumentParser(description = \
-                 "Daily report.")
-    parser.add_argument("dir", 
-                        help = "Directory to obtain raw compressed TBFM SWIM.")
-    parser.add_argument("target_date", 
-                        help = "Local Day to Focus on.")
-    parser.add_argument("--outdir", default = "./")
-    parms = build_parms(parser.parse_args())
+##@Copyright 2020. Ulrich Linder, Al Capps
+##@Organization - aviationdatascience.org non-profit through release from Penn State
+##@License - This work is licensed under MIT license - https://opensource.org/licenses/MIT
+## This permissive license lets you do basically whatever you want.
+## Per the details of the MIT license, the software is provided "as is".
+## Have fun!
+
+## In support of Penn State Data Science, this is the 2nd step in data parsing 
+##of publicly available TBFM SWIM data
+## This program beings with the flattened output of earlier "air" messages in CSV 
+## format and stores the latest information in a single record that is
+## output to a CSV file. This output becomes an easy way to look up
+## all the flights that TBFM thinks flew a particular day as well as its
+## unique identifiers. This output is often then used as a starting point
+## when iterating back through all flattened CSV TBFM messages for that day.
+
+import gzip
+import os
+import re
+import sys
+import csv
+import argparse
+import os.path
+import time
+import multiprocessing
+import functools
+from datetime import datetime
+from datetime import timedelta 
+from tbfm_columnar import AIR_COLUMNS
+from tbfm_columnar import SUMMARY_COLUMNS
+from tbfm_columnar import CATEGORY_COLUMNS
+from tbfm_columnar import read_air_parquet_rows
+from tbfm_columnar import read_air_parquet_frame
+from tbfm_columnar import write_summary_parquet
+from tbfm_time import zulu_diff_secs
+from tbfm_time import parse_zulu_column
+from tbfm_time import parse_zulu
+from tbfm_snapshots import SnapshotWriter
+from tbfm_snapshots import SNAPSHOT_SUFFIX
+from tbfm_flightstore import FlightStore
+from tbfm_delta import iter_sparse_rows
+from tbfm_partition import PARTITION_SUFFIX
+from tbfm_partition import PARTITION_COLUMNS
+from tbfm_partition import partition_dir
+from tbfm_partition import parse_airports
+from tbfm_partition import partition_files
+from tbfm_partition import write_partition_list
+from tbfm_partition import load_partition_manifest
+from TBFM_XML_flatten_to_CSV import iter_air_rows
+from tbfm_metrics import RunMetrics
+from tbfm_metrics import new_stats
+from tbfm_metrics import start_profiler
+from tbfm_metrics import finish_run
+from tbfm_metrics import add_metrics_arguments
+
+## Flattened air file suffix for each --format, raw is the unflattened
+## TBFM SWIM itself (fused mode)
+AIR_SUFFIXES={"csv":"air.csv.gz","parquet":"air.parquet",
+              "delta":"air.delta.csv.gz","raw":".xml.gz"}
+
+## Flattener outputs that also end in .xml.gz but are not raw SWIM files
+FLAT_OUTPUT_SUFFIXES=("_con.xml.gz","_adp.xml.gz","_oth.xml.gz")
+
+## gzip level of the flattened outputs written in fused mode, same default
+## as TBFM_XML_flatten_to_CSV
+FLATTEN_COMPRESSLEVEL=9
+
+## Hour stamp in the flattened file names, like 20191101_0700
+HOUR_STAMP_RE=re.compile(r"\d{8}_\d{2}00")
+
+## Columns that identify a flight
+FLIGHT_KEY_COLUMNS=('aid','tmaId','dap','apt')
+
+## Position of 'std' in a split air CSV line
+STD_ENTRY=AIR_COLUMNS.index('std')
+
+## Values of these columns repeat across flights, they are interned
+INTERN_FLAGS=tuple(name in CATEGORY_COLUMNS or name in ('aid','tmaId')
+                   for name in AIR_COLUMNS)
+
+## Air rows read in this process, for the run metrics
+READ_STATS={"rows":0}
+
+
+## Main loop###
+## searches the directory given, processes each TBFM AIR CSV file
+## stores the data in a python dictionary (with inner class) 
+## then once complete with the last file, reconstructs a record of
+## each flight with as complete a dataset as possible
+## for each snapshot of specified duration. Note: originally this was done
+## in a pandas dataframe but the processing was slow so this approach was taken 
+def main():
+ 
+    start = time.time()
+    metrics=RunMetrics("create_daily_TBFM_summary")
+    profiler=start_profiler(parms["profile"],parms["profile_interval"])
+    ldir,input_hours=list_air_inputs(parms["readDir"],parms["airports"])
+    path=os.path.join(os.getcwd(),parms["readDir"])
+
+    if parms["start"]:
+        summarize_date_range(ldir,path,metrics,input_hours)
+        stop = time.time()
+        duration = (stop - start)/60
+        print("Processing took "+ str(duration) + " minutes",flush=True)
+        finish_run(metrics,parms["metrics"],profiler)
+        return
+
+    #20191102 format as string
+    ###For this analysis, the local day starts at 0700 and
+    ### and ends the next zulu date with teh end of the 0600 file
+    ### One major reason for this is that end users generally like to see
+    ### the results in local time. Another reason is this split leads to the
+    ### fewest missing messages between days (given lowest demand)
+    target_date=parms["target_date"]
+    dt_target = datetime.strptime(target_date, "%Y%m%d")
+    dt_nextday = dt_target + timedelta(days=1)
+    string_nextday=dt_nextday.strftime("%Y%m%d") 
+    air_suffix=AIR_SUFFIXES[parms["format"]]
+    files_to_process=create_filelist(ldir,target_date,string_nextday,
+                                     air_suffix,input_hours)
+
+    full_paths=[]
+    for filename in files_to_process:
+        ## Only process files that are  AIR CSV (or Parquet) files
+        if not is_air_file(filename,air_suffix):
+            continue
+        full_paths.append(os.path.join(path,filename))
+
+    day_parms=build_day_parms(parms)
+    day_parms["workers"]=parms["workers"]
+    target_date,num_flights,stats=summarize_job((target_date,full_paths,
+                                                 day_parms))
+    metrics.merge(stats)
+            
+    stop = time.time()
+    duration = (stop - start)/60
+    print("Processing took "+ str(duration) + " minutes",flush=True)
+    finish_run(metrics,parms["metrics"],profiler)
+
+## The output options of one day, passed explicitly so days can run in
+## worker processes where the module-global parms is not set
+def build_day_parms(parms):
+    return {name:parms[name] for name in ("outdir","format","summary_format",
+                                          "engine","verify","flatten_dir",
+                                          "snapshot_interval","flight_budget",
+                                          "flight_ttl","spill_dir",
+                                          "partition_by")}
+
+##############################
+###
+###  The files to look for air files in, relative to read_dir, and the
+###  hours of the raw inputs they came from. A directory flattened with
+###  --partition-by lists its partitions in tbfm_partitions.json: only the
+###  partitions of the given airports (all without) are read, and an hour
+###  without traffic at those airports still counts as present. Partition
+###  by partition: read whole, the summary has the national rows with the
+###  flights grouped by airport, not in order of first appearance.
+#############################
+def list_air_inputs(read_dir,airports):
+    manifest=load_partition_manifest(read_dir)
+    if manifest is None:
+        if airports:
+            print("--airport needs a directory flattened with "+
+                  "--partition-by",flush=True)
+            exit(1)
+        return os.listdir(read_dir),()
+    files,missing=partition_files(manifest,airports)
+    if missing:
+        print("No partitions for "+", ".join(missing),flush=True)
+    hours=[match.group(0) for match in map(HOUR_STAMP_RE.search,
+                                           manifest["inputs"]) if match]
+    return files,hours
+
+##############################
+###
+###  Summarizes the air files of one local day and writes the summary.
+###  Returns (target_date, number of flights, stats for the run metrics).
+#############################
+def summarize_job(job):
+    target_date,full_paths,day_parms=job
+    stats=new_stats("summarize","verify","write")
+    rows_read=READ_STATS["rows"]
+    summarize_start=time.perf_counter()
+    rows=summarize_rows(full_paths,target_date,day_parms)
+    ## Spilled rows can only be read once
+    if not isinstance(rows,list) and (day_parms["verify"] or
+                                      day_parms["summary_format"] ==
+                                      "parquet"):
+        rows=list(rows)
+    verify_start=time.perf_counter()
+    stats["summarize_secs"]=verify_start-summarize_start
+    stats["rows"]=READ_STATS["rows"]-rows_read
+
+    ## Optionally run the other engine too and compare the summaries
+    if day_parms["verify"]:
+        other="pandas" if day_parms["engine"] == "loop" else "loop"
+        other_rows=summary_engines(day_parms)[other](full_paths,
+                                                     day_parms["format"])
+        report_engine_diff(rows,other_rows,day_parms["engine"],other)
+    write_start=time.perf_counter()
+    stats["verify_secs"]=write_start-verify_start
+                                           
+    outname=day_parms["outdir"] + "/"+target_date+ \
+        "_tbfm_swim_flightsummary_AIR_out"
+    if day_parms["partition_by"]:
+        bytes_out=write_summary_partitions(rows,outname,
+                                           day_parms["summary_format"],
+                                           day_parms["partition_by"])
+    elif day_parms["summary_format"] == "parquet":
+        outname=outname+".parquet"
+        write_summary_parquet(rows,outname)
+        bytes_out=os.path.getsize(outname)
+    else:
+        outname=outname+".csv"
+        write_summary_csv(rows,outname)
+        bytes_out=os.path.getsize(outname)
+    stats["write_secs"]=time.perf_counter()-write_start
+    stats["days"]=1
+    stats["files"]=len(full_paths)
+    stats["flights"]=len(rows)
+    stats["bytes_in"]=sum(os.path.getsize(full_path)
+                          for full_path in full_paths)
+    stats["bytes_out"]=bytes_out
+    return target_date,len(rows),stats
+
+##############################
+###
+###  The summary rows of the air files of one day, by the engine and memory
+###  options of day_parms (outdir is only used for the snapshots). With
+###  --flight-budget or --flight-ttl the rows can be a one-pass iterable
+###  (see summarize_bounded).
+#############################
+def summarize_rows(full_paths,target_date,day_parms):
+    if day_parms["snapshot_interval"]:
+        return summarize_snapshots(full_paths,day_parms["format"],
+                                   day_parms["flatten_dir"],target_date,
+                                   day_parms["snapshot_interval"],
+                                   day_parms["outdir"]+"/"+target_date+
+                                   SNAPSHOT_SUFFIX)
+    if day_parms["flight_budget"] or day_parms["flight_ttl"]:
+        return summarize_bounded(full_paths,day_parms["format"],
+                                 day_parms["flatten_dir"],day_parms)
+    engines=summary_engines(day_parms)
+    return engines[day_parms["engine"]](full_paths,day_parms["format"],
+                                        day_parms["flatten_dir"])
+
+## The summary function of each --engine, the loop one spread over
+## day_parms["workers"] processes when there are more than one
+def summary_engines(day_parms):
+    engines={"loop":summarize_loop,"pandas":summarize_vectorized}
+    if day_parms.get("workers",1) > 1:
+        engines["loop"]=functools.partial(summarize_parallel,
+                                          workers=day_parms["workers"])
+    return engines
+
+##############################
+###
+###  Batch mode for --start/--end. The directory is indexed once into a
+###  catalog of YYYYMMDD_HH00 hours, each local day (0700 through 0600 of
+###  the next zulu date) looks its files up there and the days are spread
+###  across a pool of --workers processes. A day with missing hours is
+###  reported; it is still summarized unless more than one hour is missing,
+###  the same limit create_filelist applies to a single day.
+#############################
+def summarize_date_range(ldir,path,metrics,input_hours=()):
+    air_suffix=AIR_SUFFIXES[parms["format"]]
+    catalog=build_catalog(ldir,air_suffix,input_hours)
+    day_parms=build_day_parms(parms)
+
+    jobs=[]
+    skipped=[]
+    dt_day=datetime.strptime(parms["start"],"%Y%m%d")
+    dt_end=datetime.strptime(parms["end"],"%Y%m%d")
+    while dt_day <= dt_end:
+        target_date=dt_day.strftime("%Y%m%d")
+        dt_day=dt_day + timedelta(days=1)
+        filelist,missing=day_files(catalog,target_date)
+        if missing:
+            print(target_date+": missing hours "+", ".join(missing),
+                  flush=True)
+        if len(missing) > 1:
+            skipped.append(target_date)
+            continue
+        full_paths=[os.path.join(path,filename) for filename in filelist]
+        jobs.append((target_date,full_paths,day_parms))
+
+    ## Days run serially inside each worker, a pool cannot nest
+    if parms["workers"] > 1:
+        with multiprocessing.Pool(parms["workers"]) as pool:
+            for target_date,num_flights,stats in \
+                    pool.imap_unordered(summarize_job,jobs):
+                print(target_date+": "+str(num_flights)+" flights",
+                      flush=True)
+                metrics.merge(stats)
+    else:
+        for job in jobs:
+            target_date,num_flights,stats=summarize_job(job)
+            print(target_date+": "+str(num_flights)+" flights",flush=True)
+            metrics.merge(stats)
+    metrics.count("days_skipped",len(skipped))
+
+    print("Summarized "+str(len(jobs))+" days, skipped "+str(len(skipped))+
+          " with too many missing hours",flush=True)
+    if skipped:
+        print("Skipped: "+" ".join(skipped),flush=True)
+
+## Maps each YYYYMMDD_HH00 hour to the air files of that hour, in
+## directory order, so a day is a few dictionary lookups. The given
+## input hours are present even when none of their files are read.
+def build_catalog(ldir,air_suffix,input_hours=()):
+    catalog={hour_stamp:[] for hour_stamp in input_hours}
+    for filename in ldir:
+        if not is_air_file(filename,air_suffix):
+            continue
+        match=HOUR_STAMP_RE.search(filename)
+        if match:
+            catalog.setdefault(match.group(0),[]).append(filename)
+    return catalog
+
+def is_air_file(filename,air_suffix):
+    return filename.endswith(air_suffix) and \
+        not filename.endswith(FLAT_OUTPUT_SUFFIXES)
+
+## The files of one local day from the catalog plus its missing hours
+def day_files(catalog,target_date):
+    filelist=[]
+    missing=[]
+    for hour_stamp in day_hour_stamps(target_date):
+        filenames=catalog.get(hour_stamp)
+        if filenames is None:
+            missing.append(hour_stamp)
+        else:
+            filelist.extend(filenames)
+    return filelist,missing
+
+## 0700 through 2300 of the target date, then 0000 through 0600 of the next
+def day_hour_stamps(target_date):
+    dt_target = datetime.strptime(target_date, "%Y%m%d")
+    string_nextday=(dt_target + timedelta(days=1)).strftime("%Y%m%d")
+    return [target_date+"_"+'{:02d}'.format(hour)+"00"
+            for hour in range(7,24)]+ \
+        [string_nextday+"_"+'{:02d}'.format(hour)+"00"
+         for hour in range(0,7)]
+
+## The original engine: iterate through all messages in Python keeping
+## the latest info on each flight. Returns the summary rows.
+def summarize_loop(full_paths,file_format,flatten_dir=None):
+    tbfmFlights={}
+    for full_path in full_paths:
+        print("Processing "+full_path,flush=True)
+        
+        ## iterate through all messages
+        ## match on aid, tmaId, dap, apt and update internal info 
+        ## to keep the latest info on each flight
+        for result in read_air_rows(full_path,file_format,flatten_dir):
+            
+            ### Skip the header, the columns are AIR_COLUMNS
+            if "msgtime" in result[0]:
+                continue
+            update_flight(tbfmFlights,result)
+
+    return [flight_row(value) for value in tbfmFlights.values()]
+
+##############################
+###
+###  The loop engine with --flight-budget and/or --flight-ttl. Flights are
+###  kept in a FlightStore that spills idle, landed and least recently
+###  updated flights to disk (see tbfm_flightstore.py), so memory stays
+###  about the same however many flights the window has. The rows are the
+###  ones summarize_loop gives, but may come back as a one-pass iterable.
+#############################
+def summarize_bounded(full_paths,file_format,flatten_dir,day_parms):
+    tbfmFlights=FlightStore(merge_partial,flight_row,
+                            day_parms["flight_budget"],
+                            day_parms["flight_ttl"]*60,
+                            day_parms["spill_dir"])
+    for full_path in full_paths:
+        print("Processing "+full_path,flush=True)
+        for result in read_air_rows(full_path,file_format,flatten_dir):
+            if "msgtime" in result[0]:
+                continue
+            update_flight(tbfmFlights,result)
+            tbfmFlights.add_row(result)
+    print("Spilled "+str(tbfmFlights.num_spilled)+" flight states in "+
+          str(len(tbfmFlights.runs))+" runs",flush=True)
+    return tbfmFlights.summary_rows()
+
+##############################
+###
+###  The loop engine with --snapshot-interval MINUTES. Ticks fall every
+###  interval from 0700Z of the local day. When a message is at or past
+###  the next tick, the flights changed since the previous tick are
+###  written as that tick's delta (see tbfm_snapshots.py), so any tick can
+###  be rebuilt without rerunning the summary for it. Returns the summary
+###  rows of the whole day like summarize_loop.
+#############################
+def summarize_snapshots(full_paths,file_format,flatten_dir,target_date,
+                        interval,outname):
+    tbfmFlights={}
+    changed={}
+    step=interval*60
+    next_tick=parse_zulu(target_date[0:4]+"-"+target_date[4:6]+"-"+
+                         target_date[6:8]+"T07:00:00Z")+step
+    snapshots=SnapshotWriter(outname)
+    for full_path in full_paths:
+        print("Processing "+full_path,flush=True)
+        for result in read_air_rows(full_path,file_format,flatten_dir):
+            if "msgtime" in result[0]:
+                continue
+            if result[0] and parse_zulu(result[0]) >= next_tick:
+                write_snapshot(snapshots,tbfmFlights,changed,next_tick)
+                ## Ticks without any message in them have no delta
+                while parse_zulu(result[0]) >= next_tick:
+                    next_tick+=step
+            update_flight(tbfmFlights,result)
+            key=tuple(result[1:5])
+            if key in tbfmFlights:
+                changed[key]=None
+    write_snapshot(snapshots,tbfmFlights,changed,next_tick)
+    snapshots.close()
+    return [flight_row(value) for value in tbfmFlights.values()]
+
+def write_snapshot(snapshots,tbfmFlights,changed,tick):
+    if changed:
+        tick_str=time.strftime("%Y-%m-%dT%H:%M:%SZ",time.gmtime(tick))
+        snapshots.write_tick(tick_str,[flight_row(tbfmFlights[key])
+                                       for key in changed])
+        changed.clear()
+
+##############################
+###
+###  Map-reduce form of the loop engine, used with --workers N. Each worker
+###  runs the loop over one hour file into its own partial flight table and
+###  the partials are merged in hour order as they come back, so the result
+###  is the same as one pass over all hours.
+#############################
+def summarize_parallel(full_paths,file_format,flatten_dir=None,workers=None):
+    tbfmFlights={}
+    jobs=[(full_path,file_format,flatten_dir) for full_path in full_paths]
+    with multiprocessing.Pool(workers) as pool:
+        ## imap hands the partials back in hour order
+        for partial in pool.imap(summarize_hour_job,jobs):
+            merge_partial(tbfmFlights,partial[:2])
+            READ_STATS["rows"]+=partial[2]
+    return [flight_row(value) for value in tbfmFlights.values()]
+
+## Pool friendly wrapper, reduces one hour file to a partial flight table.
+## Also keeps the first std each flight had in the hour, the merge needs
+## it to tell whether the hour started with an STD change.
+def summarize_hour_job(job):
+    full_path,file_format,flatten_dir=job
+    print("Processing "+full_path,flush=True)
+    rows_read=READ_STATS["rows"]
+    tbfmFlights={}
+    first_stds={}
+    for result in read_air_rows(full_path,file_format,flatten_dir):
+        if "msgtime" in result[0]:
+            continue
+        update_flight(tbfmFlights,result)
+        if len(result) > STD_ENTRY and result[STD_ENTRY] != "":
+            key=tuple(result[1:5])
+            if key in tbfmFlights and key not in first_stds:
+                first_stds[key]=result[STD_ENTRY]
+    return tbfmFlights,first_stds,READ_STATS["rows"]-rows_read
+
+##############################
+###
+###  Merges the partial table of a later hour into the flights so far.
+###  Latest non-empty values win and the first message time stays. For the
+###  STD/APREQ tracking the later hour's first std is compared with the last
+###  std known so far: a differing one is one more update, made at the
+###  hour's firststdtime, on top of the updates counted within the hour.
+#############################
+def merge_partial(tbfmFlights,partial):
+    hourFlights,first_stds=partial
+    intern_flags=INTERN_FLAGS
+    for key,later in hourFlights.items():
+        ## Strings come back from the worker unshared, intern them again
+        later_values=later.values
+        for entry in range(len(later_values)):
+            if intern_flags[entry] and later_values[entry] != "":
+                later_values[entry]=sys.intern(later_values[entry])
+
+        value=tbfmFlights.get(key)
+        if value is None:
+            tbfmFlights[key]=later
+            continue
+
+        current_std=value.values[STD_ENTRY]
+        first_std=first_stds.get(key)
+        if first_std is not None:
+            if len(current_std) == 0:
+                value.firststdtime=later.firststdtime
+                value.laststdtime=later.laststdtime
+                value.stdminusnowtime=later.stdminusnowtime
+                value.numstdupdates=later.numstdupdates
+            elif first_std != current_std:
+                value.laststdtime=later.laststdtime
+                value.stdminusnowtime=later.stdminusnowtime
+                value.numstdupdates+=1+later.numstdupdates
+            elif later.numstdupdates > 0:
+                value.laststdtime=later.laststdtime
+                value.stdminusnowtime=later.stdminusnowtime
+                value.numstdupdates+=later.numstdupdates
+
+        values=value.values
+        for entry in range(len(later_values)):
+            if later_values[entry] != "":
+                values[entry]=later_values[entry]
+
+##############################
+###
+###  Adds or updates the flight of one split air CSV line.
+###  match on aid, tmaId, dap, apt and update internal info 
+###  to keep the latest info on each flight
+#############################
+def update_flight(tbfmFlights,result):
+    msgtime=result[0]
+    aid=result[1]
+    tmaId=result[2]
+    dap=result[3]
+    apt=result[4]
+    
+    if aid and tmaId and dap and apt:
+        pass
+    else:
+        #The elements for a key do not exist. Skipping.
+        return
+    
+    key=(aid,tmaId,dap,apt)
+    intern_flags=INTERN_FLAGS
+
+    ##Add or retrieve unique flight, update relevant items
+    value=tbfmFlights.get(key)
+    if value is None:
+        ##Create a blank TflightState to store key specific info
+        value=TflightState()
+        values=value.values
+        for entry in range(len(result)):
+            item=result[entry]
+            if item != "":
+                #Always update with the latest
+                if intern_flags[entry]:
+                    item=sys.intern(item)
+                values[entry]=item
+            
+        #Given this is the first message for this flight, denote it
+        value.firstmtime=msgtime
+        
+        if len(result) > STD_ENTRY:
+            thisSTD=result[STD_ENTRY]
+            if (len(thisSTD) > 0):
+                update_std_elements(value,key,thisSTD,'new',msgtime)
+                
+        tbfmFlights[key]=value
+    else:
+        ##We already have an entry for this flight. Update it.
+        values=value.values
+        for entry in range(len(result)):
+            item=result[entry]
+            if item != "":
+                ##If we have an STD/APREQ, special logic to add other elements
+                if (entry == STD_ENTRY):
+                    update_std_elements(value,key,item,'update',msgtime)
+                    
+                #Always update with the latest
+                if intern_flags[entry]:
+                    item=sys.intern(item)
+                values[entry]=item
+
+##A helper method to reduce the complexity of the main processing loop
+def update_std_elements(value,key,thisSTD,status,msgtime):
+            
+    if(status == "new"):
+        #This is a new flight being added, set orig/latest APREQ time
+        #print("first std when creating:"+str(key) +":"+thisSTD)
+        value.firststdtime=msgtime
+        value.laststdtime=msgtime
+        value.stdminusnowtime=compute_time_diff_secs(thisSTD,msgtime)
+        
+    elif (status =="update"):
+        ##We have a flight but don't know at this point
+        ##if this is really an update to std, new add, or duplicate
+        ##First, we get the currently stored value for 'std' for this flight
+        current_std=value.values[STD_ENTRY]
+                        
+        if (len(current_std) ==0):
+            ##We do not currently have an 'std' so we add it
+            value.firststdtime=msgtime
+            value.laststdtime=msgtime
+            value.stdminusnowtime=compute_time_diff_secs(thisSTD,msgtime)
+            #print("This is the first std when updating flight:"+str(key))
+        else:
+            ##We have an 'std' already. Is it really new or duplicate?
+            if (current_std == thisSTD):
+                #duplicate STD, do nothing
+                pass
+            else:
+                #print("updated STD from "+current_std +" to "+thisSTD)
+                value.laststdtime=msgtime
+                value.stdminusnowtime=compute_time_diff_secs(thisSTD,msgtime)
+                value.numstdupdates+=1
+
+    return value
+    
+##Method to return the difference between two times, in seconds
+##Inputs: two strings that have format like 2019-11-01T07:50:52.794Z
+##Both are Zulu, they are parsed as UTC (cached, see tbfm_time.py)
+##rather than through local time, which was off by an hour across DST
+def compute_time_diff_secs(firsttime,secondtime):           
+            if not isinstance(firsttime,str):
+                return
+
+            if not isinstance(secondtime,str):
+                return
+            
+            return zulu_diff_secs(firsttime,secondtime)
+        
+## Yields each line of a flattened air file split into its columns, header
+## first. Parquet files are read column-wise and laid out the same way,
+## raw SWIM files are parsed on the fly (see read_raw_air_rows) and delta
+## files give their changes only, unchanged values empty.
+def read_air_rows(full_path,file_format,flatten_dir=None):
+    if file_format == "parquet":
+        rows=read_air_parquet_rows(full_path)
+    elif file_format == "delta":
+        rows=iter_sparse_rows(full_path)
+    elif file_format == "raw":
+        rows=read_raw_air_rows(full_path,flatten_dir)
+    else:
+        rows=read_csv_air_rows(full_path)
+    num_rows=-1
+    for result in rows:
+        num_rows+=1
+        yield result
+    READ_STATS["rows"]+=max(num_rows,0)
+
+def read_csv_air_rows(full_path):
+    with gzip.open(full_path,'rt') as f:
+        for line in f:   
+            str_line=str(line).rstrip()
+            #print(str_line)
+            yield re.split(',',str_line)
+
+##############################
+###
+###  Fused mode (--format raw): the air messages of a raw TBFM SWIM file
+###  go from parse_air straight into the flight state, skipping the write,
+###  compress, decompress and split of the flattened CSV. With flatten_dir
+###  the flattened outputs are still written there as a by-product.
+###  A value holding a comma would have shifted the CSV columns, the row
+###  is split the same way here so both routes give the same summary.
+#############################
+def read_raw_air_rows(full_path,flatten_dir=None):
+    path,filename=os.path.split(full_path)
+    file_parms=None
+    if flatten_dir is not None:
+        file_parms={"compresslevel":FLATTEN_COMPRESSLEVEL,
+                    "trailing_comma":True,"format":"csv"}
+    yield list(AIR_COLUMNS)
+    for rows in iter_air_rows(path,filename,flatten_dir,file_parms):
+        for row in rows:
+            line=",".join(row)
+            if line.count(",") != len(row)-1:
+                row=line.split(",")
+            yield row
+
+##############################
+###
+###  Vectorized engine. Each hour file is loaded as columns of strings and
+###  reduced with pandas group-bys on the (aid, tmaId, dap, apt) key:
+###   - last non-empty value of every column (a group-wise forward fill
+###     read at the last row), merged across hours in hour order
+###   - msgtime of the first row -> firstmsgtime
+###   - the rows that carry an std: an std differing from the previous one
+###     of the same flight (group-wise shift) is a change. The first one
+###     gives firststdtime, the last one laststdtime and stdminusnowtime,
+###     and the number of changes after the first is numstdupdates.
+###  Flights keep their order of first appearance like the loop engine.
+#############################
+def summarize_vectorized(full_paths,file_format,flatten_dir=None):
+    import numpy as np
+    import pandas as pd
+    keys=list(FLIGHT_KEY_COLUMNS)
+    hour_lasts=[]
+    hour_firsts=[]
+    hour_stds=[]
+    for full_path in full_paths:
+        print("Processing "+full_path,flush=True)
+        frame=read_air_frame(full_path,file_format,flatten_dir)
+        READ_STATS["rows"]+=len(frame)
+        frame=frame[frame[keys].notna().all(axis=1)]
+        ## msgtime of the first row, even when that row has none
+        hour_firsts.append(frame.drop_duplicates(keys)
+                           .set_index(keys)["msgtime"].fillna(""))
+        hour_stds.append(frame.loc[frame["std"].notna(),
+                                   keys+["std","msgtime"]])
+        hour_lasts.append(frame.groupby(keys,sort=False).last())
+
+    if not hour_lasts:
+        return []
+    lasts=pd.concat(hour_lasts).groupby(level=keys,sort=False).last()
+    firsts=pd.concat(hour_firsts).groupby(level=keys,sort=False).first()
+
+    stds=pd.concat(hour_stds,ignore_index=True)
+    previous=stds.groupby(keys,sort=False)["std"].shift()
+    changes=stds[stds["std"] != previous]
+    grouped=changes.groupby(keys,sort=False)
+    first_change=grouped.first()
+    last_change=grouped.last()
+    num_changes=grouped.size()
+
+    summary=lasts.reindex(columns=[name for name in AIR_COLUMNS
+                                   if name not in keys])
+    summary=summary.astype(object).where(summary.notna(),"")
+    summary["firstmsgtime"]=firsts
+    summary["laststdtime"]=last_change["msgtime"]
+    summary["firststdtime"]=first_change["msgtime"]
+    ## Whole seconds like compute_time_diff_secs, fractions dropped
+    std_secs=parse_zulu_column(last_change["std"])
+    msg_secs=parse_zulu_column(last_change["msgtime"])
+    summary["stdminusnowtime"]=pd.Series(
+        np.floor(std_secs)-np.floor(msg_secs),
+        index=last_change.index).astype("Int64")
+    summary["numstdupdates"]=num_changes-1
+    summary[["laststdtime","firststdtime"]]= \
+        summary[["laststdtime","firststdtime"]].fillna("")
+    summary["stdminusnowtime"]=summary["stdminusnowtime"].where(
+        summary["stdminusnowtime"].notna(),-999)
+    summary["numstdupdates"]=summary["numstdupdates"].fillna(0).astype(int)
+
+    summary=summary.reset_index()
+    columns=[summary[name].tolist() for name in AIR_COLUMNS]
+    columns.append(summary["firstmsgtime"].tolist())
+    columns.append(summary["laststdtime"].tolist())
+    columns.append(summary["firststdtime"].tolist())
+    columns.append([str(diff) for diff in summary["stdminusnowtime"]])
+    columns.append([str(num) for num in summary["numstdupdates"]])
+    return [list(row) for row in zip(*columns)]
+
+## Loads one flattened air file as a DataFrame of strings, NaN when empty
+def read_air_frame(full_path,file_format,flatten_dir=None):
+    import pandas as pd
+    if file_format == "parquet":
+        return read_air_parquet_frame(full_path)
+    if file_format in ("raw","delta"):
+        if file_format == "raw":
+            rows=read_raw_air_rows(full_path,flatten_dir)
+        else:
+            rows=iter_sparse_rows(full_path)
+        columns=next(rows)
+        frame=pd.DataFrame([row[:len(columns)] for row in rows],
+                           columns=columns,dtype=object)
+        return frame.where(frame != "")
+    return pd.read_csv(full_path,names=list(AIR_COLUMNS)+["_trailing"],
+                       header=0,usecols=list(AIR_COLUMNS),dtype=object,
+                       keep_default_na=False,na_values=[""],
+                       quoting=csv.QUOTE_NONE)
+
+### Prints where two engines' summaries differ
+def report_engine_diff(rows,other_rows,engine,other):
+    if rows == other_rows:
+        print("Verified: "+engine+" and "+other+" engines match on "+
+              str(len(rows))+" flights",flush=True)
+        return
+    print("MISMATCH between "+engine+" ("+str(len(rows))+" flights) and "+
+          other+" ("+str(len(other_rows))+" flights)",flush=True)
+    for row,other_row in zip(rows,other_rows):
+        if row != other_row:
+            print(engine+": "+",".join(row))
+            print(other+": "+",".join(other_row),flush=True)
+            break
+
+def create_filelist(ldir,target_date,string_nextday,air_suffix="air.csv.gz",
+                    input_hours=()):
+
+    ## Look for files from target date first (0700-2300), then the
+    ## 7 files from next day, through the catalog of the directory
+    catalog=build_catalog(ldir,air_suffix,input_hours)
+    filelist,missing=day_files(catalog,target_date)
+    
+    ## At most one hour may be missing
+    if (len(missing) > 1):
+        print("Missing a file.")
+        print(filelist)
+        exit()
+
+    return filelist
+        
+### Iterates through each flight in the dictionary and prints the 
+### information in a very specific manner. Storing is in generic key/value
+### pairs but printing is hard coded. There is probably a more elegant way
+### to do this but this worked nicely for this team's needs
+def printFlights(tbfmFlights,outfile):
+        write_summary_csv([flight_row(value)
+                           for value in tbfmFlights.values()],outfile)
+
+### Writes summary rows (lists of strings) with the summary CSV header
+def write_summary_csv(rows,outfile):
+
+        outF = open(outfile, "w")
+        outF.write(",".join(SUMMARY_COLUMNS)+"\n")
+        
+        for row in rows:
+            outF.write(",".join(row)+"\n")
+            
+        outF.close()
+
+##############################
+###
+### Writes the summary rows into one file per value of column, under
+### apt=ATL/ and so on next to outname, and the day's partition list
+### outname.partitions.json (see tbfm_partition.py). CSV rows are written
+### as they come, so spilled rows are never all in memory. Returns the
+### bytes written.
+#############################
+def write_summary_partitions(rows,outname,summary_format,column):
+    out_dir,stem=os.path.split(outname)
+    suffix=".parquet" if summary_format == "parquet" else ".csv"
+    entry=SUMMARY_COLUMNS.index(column)
+    def partition_path(value):
+        part_dir=os.path.join(out_dir,partition_dir(column,value))
+        os.makedirs(part_dir,exist_ok=True)
+        return os.path.join(part_dir,stem+suffix)
+    counts={}
+    if summary_format == "parquet":
+        groups={}
+        for row in rows:
+            groups.setdefault(row[entry],[]).append(row)
+        for value,group in groups.items():
+            write_summary_parquet(group,partition_path(value))
+            counts[value]=len(group)
+    else:
+        outFs={}
+        for row in rows:
+            value=row[entry]
+            outF=outFs.get(value)
+            if outF is None:
+                outF=open(partition_path(value),"w")
+                outF.write(",".join(SUMMARY_COLUMNS)+"\n")
+                outFs[value]=outF
+                counts[value]=0
+            outF.write(",".join(row)+"\n")
+            counts[value]+=1
+        for outF in outFs.values():
+            outF.close()
+    partitions={}
+    for value in counts:
+        path=partition_path(value)
+        partitions[value]={"path":os.path.relpath(path,out_dir),
+                           "rows":counts[value],
+                           "bytes":os.path.getsize(path)}
+    write_partition_list(outname+PARTITION_SUFFIX,column,partitions)
+    return sum(partition["bytes"] for partition in partitions.values())+ \
+        os.path.getsize(outname+PARTITION_SUFFIX)
+
+### The printed summary values of one flight, in SUMMARY_COLUMNS order
+def flight_row(value):
+    row=list(value.values)
+    row.append(value.firstmtime)
+    row.append(value.laststdtime)
+    row.append(value.firststdtime)
+    row.append(str(value.stdminusnowtime))
+    row.append(str(value.numstdupdates))
+    return row
+
+##############################
+###
+### Compact state of one flight. The latest value of every flattened air
+### column is kept in a single fixed-width list (AIR_COLUMNS order) and the
+### derived elements (first message, STD/APREQ tracking) are slots, the
+### counters stored as ints. This replaced a list of 61 single entry dicts
+### that was rebuilt field by field, see bench_flight_memory.py.
+### Low cardinality values are interned so flights share the strings.
+#############################
+class TflightState:
+    __slots__=('values','firstmtime','laststdtime','firststdtime',
+               'stdminusnowtime','numstdupdates')
+
+    def __init__(self):
+        self.values=[""]*len(AIR_COLUMNS)
+        self.firstmtime=""
+        self.laststdtime=""
+        self.firststdtime=""
+        self.stdminusnowtime=-999
+        self.numstdupdates=0
+ 
+def build_parms(args):
+    """Helper function to parse command line arguments into dictionary
+        input: ArgumentParser class object
+        output: dictionary of expected parameters
+    """
+    readDir=args.dir
+    #target_date=args.target_date
+    target_date=args.target_date
+    outdir=args.outdir  
+    parms = {"readDir":readDir,
+             "target_date":target_date,
+             "start":args.start,
+             "end":args.end or args.start,
+             "outdir":outdir,
+             "format":args.format,
+             "summary_format":args.summary_format,
+             "engine":args.engine,
+             "verify":args.verify,
+             "workers":args.workers,
+             "flatten_dir":args.flatten_dir,
+             "snapshot_interval":args.snapshot_interval,
+             "flight_budget":args.flight_budget,
+             "flight_ttl":args.flight_ttl,
+             "spill_dir":args.spill_dir,
+             "partition_by":args.partition_by,
+             "airports":parse_airports(args.airport),
+             "metrics":args.metrics,
+             "profile":args.profile,
+             "profile_interval":args.profile_interval}
+    
+    return(parms)
+     
+if __name__ == "__main__":
+    
+    parser = argparse.ArgumentParser(description = \
+                 "Daily report.")
+    parser.add_argument("dir", 
+                        help = "Directory to obtain raw compressed TBFM SWIM.")
+    parser.add_argument("target_date", nargs="?",
+                        help = "Local Day to Focus on.")
+    parser.add_argument("--start",
+                        help = "First local day (YYYYMMDD) of a batch, "+
+                        "instead of target_date.")
+    parser.add_argument("--end",
+                        help = "Last local day of the batch (inclusive), "+
+                        "defaults to --start.")
+    parser.add_argument("--outdir", default = "./")
+    parser.add_argument("--format", choices=["csv","parquet","delta","raw"],
+                        default="csv",
+                        help = "Format of the flattened air files to read, "+
+                        "raw reads the TBFM SWIM .xml.gz files directly.")
+    parser.add_argument("--flatten-dir",
+                        help = "With --format raw, also write the flattened "+
+                        "outputs to this directory.")
+    parser.add_argument("--engine", choices=["loop","pandas"], default="loop",
+                        help = "Per-line Python loop or vectorized pandas "+
+                        "group-bys.")
+    parser.add_argument("--workers", type=int, default=1,
+                        help = "Hour files to reduce in parallel (loop "+
+                        "engine), merged in hour order. With --start, "+
+                        "days to summarize in parallel.")
+    parser.add_argument("--snapshot-interval", type=int, default=0,
+                        metavar="MINUTES",
+                        help = "Also write the flights changed in every "+
+                        "interval as delta snapshots (loop engine).")
+    parser.add_argument("--flight-budget", type=int, default=0,
+                        metavar="FLIGHTS",
+                        help = "Keep at most this many flights in memory, "+
+                        "spill the rest to disk (loop engine).")
+    parser.add_argument("--flight-ttl", type=float, default=0,
+                        metavar="MINUTES",
+                        help = "Spill flights without a message for this "+
+                        "long (loop engine).")
+    parser.add_argument("--spill-dir",
+                        help = "Directory for spilled flights (default: "+
+                        "the system temporary directory).")
+    parser.add_argument("--partition-by", choices=PARTITION_COLUMNS,
+                        help = "Write the summary as one file per value, "+
+                        "e.g. apt=ATL/, with a partition list. Read whole, "+
+                        "it has the rows grouped by partition.")
+    parser.add_argument("--airport", action="append",
+                        help = "Only read these airports' partitions of a "+
+                        "directory flattened with --partition-by "+
+                        "(repeatable or comma separated).")
+    parser.add_argument("--verify", action="store_true",
+                        help = "Also run the other engine and compare.")
+    parser.add_argument("--summary-format", choices=["csv","parquet"],
+                        default="csv",
+                        help = "Format of the daily summary output.")
+    add_metrics_arguments(parser)
+    args=parser.parse_args()
+    if not args.target_date and not args.start:
+        parser.error("give a target_date or --start")
+    ## Snapshots need the messages in order, in one pass
+    if args.snapshot_interval and (args.engine != "loop" or
+                                   (args.workers > 1 and not args.start)):
+        parser.error("--snapshot-interval runs the serial loop engine")
+    if (args.flight_budget or args.flight_ttl) and \
+       (args.engine != "loop" or args.snapshot_interval or
+        (args.workers > 1 and not args.start)):
+        parser.error("--flight-budget and --flight-ttl run the serial loop "+
+                     "engine without snapshots")
+    parms = build_parms(args)
     main()
\ No newline at end of file
@@ -1,91 +1,289 @@
-##@Copyright 2020. Ulrich Linder, Al Capps
-##@Organization - aviationdatascience.org non-profit, through release from Penn State
-##@License - This work is licensed under MIT license - https://opensource.org/licenses/MIT
-## This permissive license lets you do basically whatever you want.
-## Per the details of the MIT license, the software is provided "as is".
-## Have fun!
-
-## In support of Penn State Data Science, this is the last step in data parsing 
-##of publicly available TBFM SWIM data
-## This program starts with the daily TBFM summary and then
-## winnows down the data into a dataset that was used for machine learning studies
-### This is provided primarily as an example to make it easier for folks to 
-##  create their own sub-sets for studies
-import pandas as pd
-import os
-import argparse
-import os.path
-import time
-import numpy as np
-
-nat = np.datetime64('NaT')
-
-## Main loop###
-def main():
- 
-    out_dir=parms["outdir"]
-    full_path=parms["readFile"]
-    print("Processing "+full_path,flush=True)
-    start = time.time()
-
-    messages_pd = pd.read_csv(full_path)
-
-    ##Get all the APREQs and print
-    tbfm_apreqs=messages_pd[pd.notnull(messages_pd['std'])]
-    
-    filename=os.path.basename(full_path)
-    nameparts=filename.split("_")
-    outfile=out_dir + "/" + nameparts[0] + "_all_tbfm_apreqs.csv"
-    tbfm_apreqs.to_csv(outfile,index=False)
-    
-    ## Get rid of overflights. Useful if studying meter point demand
-    ## but not arrival metering or EDC delay passback to a flight
-    messages_pd=messages_pd[(messages_pd.cat != "OVERFLIGHT")]
-
-    ## (Likely) Arrivals with at least one ETA to runway
-    ## This may be over-simplifyng the search for arrival TBFM flights,
-    ## but seems to do a pretty good job and includes departures
-    ## that are scheduled into arrival metering
-   
-    tbfm_arrs =messages_pd[pd.notnull(messages_pd.eta_rwy)]
-           
-    ## For the purposes of a cleaner look at flights that TBFM
-    ## thinks completed their arrival (and landed), the list is
-    ## further winnowed down. Others may not want this.
-    ## Also ensuring we have the TBFM runway.
-    ## Note: on check was missing about 5% of runways for arrivals 
-    tbfm_arrs =tbfm_arrs[(tbfm_arrs.acs == "LANDED") &
-                         pd.notnull(tbfm_arrs.rwy)]      
-    
-    outfile=out_dir + "/" + nameparts[0] + "_all_tbfm_arrivals.csv"
-    tbfm_arrs.to_csv(outfile,index=False)
-
-    ### Filter on a single airport here - if needed ####
-    
-    stop = time.time()
-    duration = (stop - start)/60
-    print("Processing took "+ str(duration) + " minutes",flush=True)
-        
-        
-        
-def build_parms(args):
-    """Helper function to parse command line arguments into dictionary
-        input: ArgumentParser class object
-        output: dictionary of expected parameters
-    """
-    readFile=args.file
-    outdir=args.outdir         
-    parms = {"readFile":readFile,
-             "outdir":outdir}                   
-    return(parms)
-        
-
-if __name__ == "__main__":
-    
-    parser = argparse.ArgumentParser(description = \
-                 "Create Dataset.")
-    parser.add_argument("file", 
-                        help = "Script to help create TBFM dataset.")
-    parser.add_argument("--outdir", default = "./")
-    parms = build_parms(parser.parse_args())
-    main()
+##@Copyright 2020. Ulrich Linder, Al Capps
+##@Organization - aviationdatascience.org non-profit, through release from Penn State
+##@License - This work is licensed under MIT license - https://opensource.org/licenses/MIT
+## This permissive license lets you do basically whatever you want.
+## Per the details of the MIT license, the software is provided "as is".
+## Have fun!
+
+## In support of Penn State Data Science, this is the last step in data parsing 
+##of publicly available TBFM SWIM data
+## This program starts with the daily TBFM summary and then
+## winnows down the data into a dataset that was used for machine learning studies
+### This is provided primarily as an example to make it easier for folks to 
+##  create their own sub-sets for studies
+import os
+import argparse
+import os.path
+import time
+from tbfm_metrics import RunMetrics
+from tbfm_metrics import start_profiler
+from tbfm_metrics import finish_run
+from tbfm_metrics import add_metrics_arguments
+from tbfm_columnar import SUMMARY_COLUMNS
+from tbfm_columnar import SUMMARY_TIME_COLUMNS
+from tbfm_columnar import SUMMARY_INT_COLUMNS
+from tbfm_columnar import CATEGORY_COLUMNS
+from tbfm_columnar import MSGTIME_COLUMNS
+from tbfm_columnar import import_pyarrow
+from tbfm_time import to_zulu_times
+from tbfm_time import format_zulu_times
+from tbfm_partition import PARTITION_SUFFIX
+from tbfm_partition import parse_airports
+from tbfm_partition import partition_files
+from tbfm_partition import load_partition_list
+
+## Columns the filters look at, loaded whatever --columns says
+FILTER_COLUMNS=('std','cat','eta_rwy','acs','rwy')
+
+## Main loop###
+## The summary is read in chunks of --chunksize rows (whole files without)
+## and every chunk is filtered and appended to the outputs, so only one
+## chunk is in memory however long the summary is. Columns are typed
+## while reading and only the ones needed are parsed at all.
+def main():
+ 
+    out_dir=parms["outdir"]
+    full_path=parms["readFile"]
+    print("Processing "+full_path,flush=True)
+    start = time.time()
+    metrics=RunMetrics("create_tbfm_dataset_from_summary")
+    profiler=start_profiler(parms["profile"],parms["profile_interval"])
+    airports=parms["airports"]
+    columns=parms["columns"] or list(SUMMARY_COLUMNS)
+
+    filename=os.path.basename(full_path)
+    nameparts=filename.split("_")
+    ## Named after the airports when filtered, all of them otherwise
+    if airports:
+        prefix=nameparts[0] + "_" + "_".join(airports)
+    else:
+        prefix=nameparts[0] + "_all"
+    apreqF=DatasetWriter(out_dir + "/" + prefix + "_tbfm_apreqs.csv",columns)
+    arrivalF=DatasetWriter(out_dir + "/" + prefix + "_tbfm_arrivals.csv",
+                           columns)
+
+    chunks=iter_summary_chunks(full_path,airports,
+                               load_columns(columns,airports),
+                               parms["chunksize"],metrics)
+    while True:
+        with metrics.timed("read"):
+            messages_pd=next(chunks,None)
+        if messages_pd is None:
+            break
+        metrics.count("rows_in",len(messages_pd))
+
+        with metrics.timed("filter"):
+            tbfm_apreqs,tbfm_arrs=select_flights(messages_pd)
+        metrics.count("apreqs",len(tbfm_apreqs))
+        metrics.count("arrivals",len(tbfm_arrs))
+
+        with metrics.timed("write"):
+            apreqF.write(tbfm_apreqs)
+            arrivalF.write(tbfm_arrs)
+
+    with metrics.timed("write"):
+        apreqF.close()
+        arrivalF.close()
+    metrics.count("bytes_out",os.path.getsize(apreqF.outname))
+    metrics.count("bytes_out",os.path.getsize(arrivalF.outname))
+    
+    stop = time.time()
+    duration = (stop - start)/60
+    print("Processing took "+ str(duration) + " minutes",flush=True)
+    finish_run(metrics,parms["metrics"],profiler)
+
+##############################
+###
+### The APREQs (flights with an STD) and the landed arrivals of a summary
+### DataFrame, or of any chunk of one since every test looks at one row.
+#############################
+def select_flights(messages_pd):
+    import pandas as pd
+
+    ##Get all the APREQs
+    tbfm_apreqs=messages_pd[pd.notnull(messages_pd['std'])]
+    
+    ## Get rid of overflights. Useful if studying meter point demand
+    ## but not arrival metering or EDC delay passback to a flight
+    messages_pd=messages_pd[(messages_pd.cat != "OVERFLIGHT")]
+
+    ## (Likely) Arrivals with at least one ETA to runway
+    ## This may be over-simplifyng the search for arrival TBFM flights,
+    ## but seems to do a pretty good job and includes departures
+    ## that are scheduled into arrival metering
+   
+    tbfm_arrs =messages_pd[pd.notnull(messages_pd.eta_rwy)]
+           
+    ## For the purposes of a cleaner look at flights that TBFM
+    ## thinks completed their arrival (and landed), the list is
+    ## further winnowed down. Others may not want this.
+    ## Also ensuring we have the TBFM runway.
+    ## Note: on check was missing about 5% of runways for arrivals 
+    tbfm_arrs =tbfm_arrs[(tbfm_arrs.acs == "LANDED") &
+                         pd.notnull(tbfm_arrs.rwy)]      
+    return tbfm_apreqs,tbfm_arrs
+
+### The columns to read: the ones written plus the ones filtered on, in
+### summary order
+def load_columns(columns,airports):
+    needed=set(columns)|set(FILTER_COLUMNS)
+    if airports:
+        needed.add('apt')
+    return [name for name in SUMMARY_COLUMNS if name in needed]
+
+### pandas types of summary CSV columns. Times are read as text and
+### parsed afterwards (see type_summary_frame), the other text columns
+### stay text instead of being guessed into floats.
+def summary_dtypes(columns):
+    dtypes={}
+    for name in columns:
+        if name in SUMMARY_INT_COLUMNS:
+            dtypes[name]="Int64"
+        elif name in CATEGORY_COLUMNS:
+            dtypes[name]="category"
+        else:
+            dtypes[name]=str
+    return dtypes
+
+def type_summary_frame(frame):
+    for name in frame.columns:
+        if name in SUMMARY_TIME_COLUMNS:
+            frame[name]=to_zulu_times(frame[name])
+    return frame
+
+### Summary rows as create_daily_TBFM_summary makes them (lists of strings
+### in SUMMARY_COLUMNS order) typed like a summary CSV read from disk
+def summary_frame(rows):
+    import pandas as pd
+    frame=pd.DataFrame(list(rows),columns=list(SUMMARY_COLUMNS),dtype=object)
+    frame=frame.where(frame != "")
+    for name,dtype in summary_dtypes(SUMMARY_COLUMNS).items():
+        ## Text stays object, astype(str) would turn NaN into "nan"
+        if dtype == "Int64":
+            frame[name]=pd.to_numeric(frame[name]).astype(dtype)
+        elif dtype == "category":
+            frame[name]=frame[name].astype(dtype)
+    return type_summary_frame(frame)
+
+##############################
+###
+### Yields the daily summary as typed DataFrames of at most chunksize rows
+### (one per file without). full_path is a CSV or Parquet summary or the
+### partition list (.partitions.json) of a summary written with
+### --partition-by. With airports only their flights are kept: from a
+### partition list only the matching partition files are opened, a single
+### file is filtered on apt.
+#############################
+def iter_summary_chunks(full_path,airports,columns,chunksize,metrics):
+    if not full_path.endswith(PARTITION_SUFFIX):
+        metrics.count("bytes_in",os.path.getsize(full_path))
+        for chunk in read_summary_file(full_path,columns,chunksize):
+            if airports:
+                chunk=chunk[chunk.apt.isin(airports)]
+            yield chunk
+        return
+
+    files,missing=partition_files(load_partition_list(full_path),airports)
+    if missing:
+        print("No partitions for "+", ".join(missing),flush=True)
+    for filename in files:
+        part_path=os.path.join(os.path.dirname(full_path),filename)
+        print("Reading "+part_path,flush=True)
+        metrics.count("bytes_in",os.path.getsize(part_path))
+        yield from read_summary_file(part_path,columns,chunksize)
+
+## A Parquet summary already carries typed timestamps and categoricals
+def read_summary_file(full_path,columns,chunksize):
+    import pandas as pd
+    if full_path.endswith(".parquet"):
+        if not chunksize:
+            yield pd.read_parquet(full_path,columns=columns)
+            return
+        pa=import_pyarrow()
+        parquet_file=pa.parquet.ParquetFile(full_path)
+        for batch in parquet_file.iter_batches(batch_size=chunksize,
+                                               columns=columns):
+            yield batch.to_pandas()
+        return
+    frames=pd.read_csv(full_path,usecols=columns,
+                       dtype=summary_dtypes(columns),
+                       chunksize=chunksize or None)
+    if not chunksize:
+        frames=[frames]
+    for frame in frames:
+        yield type_summary_frame(frame)
+
+##############################
+###
+### Appends DataFrames to one output CSV, header first, with the times
+### written back as TBFM text (msgtime-like columns with milliseconds)
+### whatever they were read from. Without any rows it is only the header.
+#############################
+class DatasetWriter:
+    def __init__(self,outname,columns):
+        self.outname=outname
+        self.columns=columns
+        self.outF=open(outname,"w",newline="")
+        self.header=True
+
+    def write(self,frame):
+        if frame.empty:
+            return
+        frame=frame[self.columns].copy()
+        for name in self.columns:
+            if name in SUMMARY_TIME_COLUMNS:
+                frame[name]=format_zulu_times(frame[name],
+                                              name in MSGTIME_COLUMNS)
+        frame.to_csv(self.outF,index=False,header=self.header)
+        self.header=False
+
+    def close(self):
+        if self.header:
+            self.outF.write(",".join(self.columns)+"\n")
+        self.outF.close()
+
+def build_parms(args):
+    """Helper function to parse command line arguments into dictionary
+        input: ArgumentParser class object
+        output: dictionary of expected parameters
+    """
+    readFile=args.file
+    outdir=args.outdir         
+    parms = {"readFile":readFile,
+             "outdir":outdir,
+             "airports":parse_airports(args.airport),
+             "columns":args.columns,
+             "chunksize":args.chunksize,
+             "metrics":args.metrics,
+             "profile":args.profile,
+             "profile_interval":args.profile_interval}                   
+    return(parms)
+        
+
+if __name__ == "__main__":
+    
+    parser = argparse.ArgumentParser(description = \
+                 "Create Dataset.")
+    parser.add_argument("file", 
+                        help = "Script to help create TBFM dataset.")
+    parser.add_argument("--outdir", default = "./")
+    parser.add_argument("--airport", action="append",
+                        help = "Only these airports' flights (repeatable "+
+                        "or comma separated). Given the partition list of "+
+                        "a partitioned summary, only their partitions are "+
+                        "read.")
+    parser.add_argument("--columns", type=lambda value: value.split(","),
+                        help = "Comma separated summary columns to write "+
+                        "(default: all). Only these and the ones filtered "+
+                        "on are read.")
+    parser.add_argument("--chunksize", type=int, default=0,
+                        help = "Rows to read, filter and write at a time, "+
+                        "0 reads each file whole.")
+    add_metrics_arguments(parser)
+    args=parser.parse_args()
+    if args.columns:
+        unknown=[name for name in args.columns if name not in SUMMARY_COLUMNS]
+        if unknown:
+            parser.error("unknown summary columns: "+",".join(unknown))
+    parms = build_parms(args)
+    main()
@@ -0,0 +1,118 @@
+##@Copyright 2020. Ulrich Linder, Al Capps
+##@Organization - aviationdatascience.org non-profit, through release from Penn State
+##@License - This work is licensed under MIT license - https://opensource.org/licenses/MIT
+## This permissive license lets you do basically whatever you want.
+## Per the details of the MIT license, the software is provided "as is".
+## Have fun!
+
+## The three processing steps as functions, for running many small jobs
+## from one Python process instead of starting a script for each. The
+## scripts take their options from a module-global parms set up in
+## __main__; these calls take them as arguments. Importing this module is
+## cheap: the scripts are imported on first use, pandas only by the calls
+## that work on DataFrames, and BeautifulSoup/lxml only once a raw message
+## falls back to them.
+##
+##   ## the 24 hourly air files of a local day, 0700Z through 0600Z
+##   rows=summarize_day(air_files)
+##   apreqs,arrivals=build_dataset(summary_frame(rows))
+from tbfm_columnar import AIR_COLUMNS
+from tbfm_columnar import SUMMARY_COLUMNS
+
+###The following can be treated as static and immutable.
+## Formats in the order their air file suffixes are tried
+AIR_FORMATS=("delta","csv","parquet","raw")
+
+### The --format of an air file, told by its name
+def air_file_format(path):
+    from create_daily_TBFM_summary import AIR_SUFFIXES
+    from create_daily_TBFM_summary import is_air_file
+    for file_format in AIR_FORMATS:
+        if is_air_file(path,AIR_SUFFIXES[file_format]):
+            return file_format
+    raise ValueError("Not an air file: "+path)
+
+##############################
+###
+###  Yields the air messages of one file as lists of strings in AIR_COLUMNS
+###  order: a raw TBFM SWIM file (.xml.gz) is parsed on the fly, flattened
+###  CSV, Parquet and delta air files are read back. The trailing comma of
+###  the flattener's CSV rows is left off; a value holding a comma still
+###  gives a longer row, as it does for the summary.
+#############################
+def iter_air_messages(path,file_format=None):
+    if file_format is None:
+        file_format=air_file_format(path)
+    if file_format == "delta":
+        from tbfm_delta import iter_full_rows
+        rows=iter_full_rows(path)
+    else:
+        from create_daily_TBFM_summary import read_air_rows
+        rows=read_air_rows(path,file_format)
+    width=len(AIR_COLUMNS)
+    ## The header
+    next(rows)
+    for row in rows:
+        ## Raw files give tuples
+        row=list(row)
+        if len(row) == width+1 and row[width] == "":
+            del row[width]
+        yield row
+
+##############################
+###
+###  The summary rows of one day's air files (lists of strings in
+###  SUMMARY_COLUMNS order, flights in order of first appearance), what
+###  create_daily_TBFM_summary writes for the day. files are summarized in
+###  the order given, all of one format (told by their names by default).
+###  The options are those of the script; with flight_budget or flight_ttl
+###  the rows can be a one-pass iterable. Nothing is written unless
+###  flatten_dir is given for raw files.
+#############################
+def summarize_day(files,engine="loop",workers=1,flight_budget=0,
+                  flight_ttl=0,spill_dir=None,flatten_dir=None,
+                  file_format=None):
+    from create_daily_TBFM_summary import summarize_rows
+    files=list(files)
+    if file_format is None:
+        formats=set(air_file_format(path) for path in files)
+        if len(formats) > 1:
+            raise ValueError("Air files of more than one format: "+
+                             ", ".join(sorted(formats)))
+        file_format=formats.pop() if formats else "csv"
+    day_parms={"format":file_format,
+               "engine":engine,
+               "workers":workers,
+               "flatten_dir":flatten_dir,
+               "snapshot_interval":0,
+               "flight_budget":flight_budget,
+               "flight_ttl":flight_ttl,
+               "spill_dir":spill_dir}
+    return summarize_rows(files,None,day_parms)
+
+### Summary rows (from summarize_day) as the typed DataFrame that
+### build_dataset takes, the same as read from a summary file
+def summary_frame(rows):
+    from create_tbfm_dataset_from_summary import summary_frame as to_frame
+    return to_frame(rows)
+
+##############################
+###
+###  Yields a summary file (CSV, Parquet or the .partitions.json list of a
+###  partitioned one) as typed DataFrames of at most chunksize rows, one
+###  per file with 0. airports and columns work like the dataset step's
+###  --airport and --columns, columns defaulting to all of them.
+#############################
+def iter_summary(path,airports=None,columns=None,chunksize=0):
+    from create_tbfm_dataset_from_summary import iter_summary_chunks
+    from create_tbfm_dataset_from_summary import load_columns
+    from tbfm_metrics import RunMetrics
+    columns=load_columns(columns or SUMMARY_COLUMNS,airports)
+    return iter_summary_chunks(path,airports,columns,chunksize,
+                               RunMetrics("tbfm_api"))
+
+### The APREQs and the landed arrivals of a summary DataFrame (or a chunk
+### of one), the two datasets create_tbfm_dataset_from_summary writes
+def build_dataset(df):
+    from create_tbfm_dataset_from_summary import select_flights
+    return select_flights(df)
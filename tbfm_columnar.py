@@ -0,0 +1,326 @@
+##@Copyright 2020. Ulrich Linder, Al Capps
+##@Organization - aviationdatascience.org non-profit, through release from Penn State
+##@License - This work is licensed under MIT license - https://opensource.org/licenses/MIT
+## This permissive license lets you do basically whatever you want.
+## Per the details of the MIT license, the software is provided "as is".
+## Have fun!
+
+## Columnar (Parquet) storage for the flattened air messages and the daily
+## flight summary, and for the con/adp/oth tables (see extract_other).
+## The gzip CSVs hold every value as text, so every later
+## step reparses all of it. Here time columns are stored as UTC timestamps,
+## low cardinality columns are dictionary encoded (pandas categoricals) and
+## empty values are nulls. pyarrow is only needed when this format is used.
+## A time that a timestamp cannot give back exactly as written (not a
+## time, or a fraction that is not milliseconds) is stored as null and its
+## text kept in the time_text column, so the readers give back the CSV.
+import json
+from tbfm_extract import AIR_FIELDS
+
+###The following can be treated as static and immutable.
+## Column order of the flattened air output, same as the CSV header
+AIR_COLUMNS=('msgtime','aid','tmaId','dap','apt')+AIR_FIELDS
+
+## Column order of the daily flight summary, same as its CSV header
+SUMMARY_COLUMNS=('lastmsgtime',)+AIR_COLUMNS[1:]+ \
+    ('firstmsgtime','laststdtime','firststdtime','stdminusnowtime',
+     'numstdupdates')
+
+## Times that are stored as timestamps instead of text
+AIR_TIME_COLUMNS=frozenset(['msgtime','std']+
+                           [name for name in AIR_FIELDS
+                            if name.startswith(('eta_','sta_'))])
+SUMMARY_TIME_COLUMNS=(AIR_TIME_COLUMNS-{'msgtime'})| \
+    {'lastmsgtime','firstmsgtime','laststdtime','firststdtime'}
+SUMMARY_INT_COLUMNS=frozenset(['stdminusnowtime','numstdupdates'])
+
+## Column order of the con, adp and oth tables. seq numbers the messages
+## of one input file so the rows of a message can be put back together.
+OTHER_COLUMNS=('msgtime','envName','seq','path','value')
+OTHER_TIME_COLUMNS=frozenset(['msgtime'])
+OTHER_INT_COLUMNS=frozenset(['seq'])
+
+## Columns with few distinct values, stored dictionary encoded
+CATEGORY_COLUMNS=frozenset(['dap','apt','mfx','cat','gat','rwy','acs',
+                            'typ','eng','cfx','dfx','sfx','oma','ooa',
+                            'o3a','o4a','cfg','tra','envName','path'])
+
+## Flattened air rows per Parquet row group
+ROW_GROUP_ROWS=100000
+
+## msgtime always carries milliseconds, the other times only when non zero
+MSGTIME_COLUMNS=frozenset(['msgtime','lastmsgtime','firstmsgtime',
+                           'laststdtime','firststdtime'])
+
+## String column with the text of such times as JSON {column: text},
+## null in rows where every time fits. Tables with time columns have it last.
+TIME_TEXT_COLUMN='time_text'
+
+## Times kept as text in this process, for the run metrics
+COLUMNAR_STATS={"time_fallbacks":0}
+
+## Times kept as text that are printed, the rest are only counted
+TIME_FALLBACK_WARNINGS=10
+
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("The parquet format needs pyarrow "+
+                          "(pip install pyarrow)")
+    return pyarrow
+
+### Arrow schema for a list of columns
+def build_schema(columns,time_columns,int_columns=frozenset()):
+    pa=import_pyarrow()
+    schema_fields=[]
+    for name in columns:
+        if name in time_columns:
+            col_type=pa.timestamp('ms',tz='UTC')
+        elif name in int_columns:
+            col_type=pa.int64()
+        elif name in CATEGORY_COLUMNS:
+            col_type=pa.dictionary(pa.int32(),pa.string())
+        else:
+            col_type=pa.string()
+        schema_fields.append(pa.field(name,col_type))
+    if time_columns:
+        schema_fields.append(pa.field(TIME_TEXT_COLUMN,pa.string()))
+    return pa.schema(schema_fields)
+
+### Builds one typed Arrow array from a column of strings ("" is null).
+### The text of times that do not fit goes into time_texts, a dict per row.
+def to_arrow_column(values,field,time_texts=None):
+    pa=import_pyarrow()
+    strings=pa.array([value if value != "" else None for value in values],
+                     pa.string())
+    if pa.types.is_timestamp(field.type):
+        try:
+            times=strings.cast(field.type)
+        except pa.ArrowInvalid:
+            ## Keep the good values, the others are kept as text below
+            times=pa.array([cast_one_time(value,field.type)
+                            for value in strings.to_pylist()],field.type)
+        lost=keep_time_text(strings,times,field.name,time_texts)
+        if lost is not None:
+            ## Null rather than the cast's approximation of the time
+            times=pa.compute.if_else(lost,pa.scalar(None,field.type),times)
+        return times
+    if pa.types.is_integer(field.type):
+        return pa.array([int(value) if value not in (None,"None") else None
+                         for value in strings.to_pylist()],field.type)
+    if pa.types.is_dictionary(field.type):
+        return strings.dictionary_encode().cast(field.type)
+    return strings
+
+def cast_one_time(value,col_type):
+    pa=import_pyarrow()
+    if value is None:
+        return None
+    try:
+        return pa.array([value]).cast(col_type)[0].as_py()
+    except pa.ArrowInvalid:
+        return None
+
+### Records the times of a column that do not format back to their text
+### and returns where they are (None when there are none)
+def keep_time_text(strings,times,name,time_texts):
+    pa=import_pyarrow()
+    pc=pa.compute
+    same=pc.equal(format_time_column(times,name),strings)
+    lost=pc.and_(pc.is_valid(strings),pc.invert(pc.fill_null(same,False)))
+    if not pc.any(lost).as_py():
+        return None
+    for row,(value,is_lost) in enumerate(zip(strings.to_pylist(),
+                                             lost.to_pylist())):
+        if not is_lost:
+            continue
+        if COLUMNAR_STATS["time_fallbacks"] < TIME_FALLBACK_WARNINGS:
+            print("Keeping "+name+" value "+repr(value)+" as text, it is "+
+                  "not a time a timestamp gives back exactly",flush=True)
+        COLUMNAR_STATS["time_fallbacks"]+=1
+        time_texts[row][name]=value
+    return lost
+
+### Builds a table from row tuples of strings
+def rows_to_table(rows,schema):
+    pa=import_pyarrow()
+    fields=[field for field in schema if field.name != TIME_TEXT_COLUMN]
+    if rows:
+        columns=list(zip(*rows))
+    else:
+        columns=[()]*len(fields)
+    time_texts=[{} for row in rows]
+    arrays=[to_arrow_column(column,field,time_texts)
+            for column,field in zip(columns,fields)]
+    if len(fields) < len(schema):
+        arrays.append(pa.array([json.dumps(texts,sort_keys=True)
+                                if texts else None for texts in time_texts],
+                               pa.string()))
+    return pa.Table.from_arrays(arrays,schema=schema)
+
+##############################
+###
+###  Drop-in replacement for AirRowWriter when the flattener is run with
+###  --format parquet. Rows are collected and written as one Parquet row
+###  group every ROW_GROUP_ROWS rows.
+#############################
+class ParquetAirWriter:
+    def __init__(self,outname,compression="snappy",
+                 row_group_rows=ROW_GROUP_ROWS):
+        pa=import_pyarrow()
+        self.schema=build_schema(AIR_COLUMNS,AIR_TIME_COLUMNS)
+        self.writer=pa.parquet.ParquetWriter(outname,self.schema,
+                                             compression=compression)
+        self.row_group_rows=row_group_rows
+        self.rows=[]
+
+    def write_row(self,msgtime,aid,tmaid,dap,apt,values):
+        self.rows.append((msgtime,aid,tmaid,dap,apt,*values))
+        if len(self.rows) >= self.row_group_rows:
+            self.flush()
+
+    ## Takes a list of rows as collected by AirRowBatch
+    def write(self,rows):
+        self.rows.extend(rows)
+        if len(self.rows) >= self.row_group_rows:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            self.writer.write_table(rows_to_table(self.rows,self.schema))
+            self.rows=[]
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+### Parquet counterpart of OtherRowWriter for the con/adp/oth tables
+class ParquetOtherWriter:
+    def __init__(self,outname,compression="snappy",
+                 row_group_rows=ROW_GROUP_ROWS):
+        pa=import_pyarrow()
+        self.schema=build_schema(OTHER_COLUMNS,OTHER_TIME_COLUMNS,
+                                 OTHER_INT_COLUMNS)
+        self.writer=pa.parquet.ParquetWriter(outname,self.schema,
+                                             compression=compression)
+        self.row_group_rows=row_group_rows
+        self.rows=[]
+
+    def write_row(self,msgtime,envname,seq,path,value):
+        self.rows.append((msgtime,envname,str(seq),path,value))
+        if len(self.rows) >= self.row_group_rows:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            self.writer.write_table(rows_to_table(self.rows,self.schema))
+            self.rows=[]
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+### Collects the air rows of one pipeline batch for a ParquetAirWriter
+class AirRowBatch:
+    def __init__(self):
+        self.rows=[]
+
+    def write_row(self,msgtime,aid,tmaid,dap,apt,values):
+        self.rows.append((msgtime,aid,tmaid,dap,apt,*values))
+
+### Formats a timestamp column back into the TBFM text layout
+def format_time_column(column,name):
+    pa=import_pyarrow()
+    pc=pa.compute
+    with_ms=pc.strftime(column,format="%Y-%m-%dT%H:%M:%SZ")
+    if name in MSGTIME_COLUMNS:
+        return with_ms
+    whole=pc.equal(pc.cast(column,pa.timestamp('s',tz='UTC'),safe=False),
+                   column)
+    no_ms=pc.strftime(pc.cast(column,pa.timestamp('s',tz='UTC'),safe=False),
+                      format="%Y-%m-%dT%H:%M:%SZ")
+    return pc.if_else(whole,no_ms,with_ms)
+
+##############################
+###
+###  Reads a flattened air Parquet file back as lists of strings laid out
+###  exactly like the split CSV lines (header first). Each column is
+###  converted in one go, empty values come back as "".
+#############################
+def read_air_parquet_rows(full_path):
+    pa=import_pyarrow()
+    pc=pa.compute
+    parquet_file=pa.parquet.ParquetFile(full_path)
+    read_columns=air_read_columns(parquet_file.schema_arrow)
+    yield list(AIR_COLUMNS)
+    for group in range(parquet_file.num_row_groups):
+        table=parquet_file.read_row_group(group,columns=read_columns)
+        columns=[]
+        for name in AIR_COLUMNS:
+            column=table.column(name)
+            if name in AIR_TIME_COLUMNS:
+                column=format_time_column(column,name)
+            elif pa.types.is_dictionary(column.type):
+                column=column.cast(pa.string())
+            columns.append(pc.fill_null(column,"").to_pylist())
+        restore_time_texts(table,columns)
+        for row in zip(*columns):
+            yield list(row)
+
+### The air columns plus time_text when the file has it (files written
+### before it was added do not)
+def air_read_columns(schema):
+    if TIME_TEXT_COLUMN in schema.names:
+        return list(AIR_COLUMNS)+[TIME_TEXT_COLUMN]
+    return list(AIR_COLUMNS)
+
+### Puts the text of times kept in time_text back into the columns (lists
+### of values in AIR_COLUMNS order)
+def restore_time_texts(table,columns):
+    for row,texts in iter_time_texts(table):
+        for name,value in texts.items():
+            columns[AIR_COLUMNS.index(name)][row]=value
+
+### (row, {column: text}) of the rows of a table with times kept as text
+def iter_time_texts(table):
+    if TIME_TEXT_COLUMN not in table.column_names:
+        return
+    texts=table.column(TIME_TEXT_COLUMN)
+    if texts.null_count == len(texts):
+        return
+    for row,text in enumerate(texts.to_pylist()):
+        if text is not None:
+            yield row,json.loads(text)
+
+### Same as read_air_parquet_rows but as a pandas DataFrame of strings,
+### empty values are NaN
+def read_air_parquet_frame(full_path):
+    pa=import_pyarrow()
+    parquet_file=pa.parquet.ParquetFile(full_path)
+    table=parquet_file.read(
+        columns=air_read_columns(parquet_file.schema_arrow))
+    columns=[]
+    for name in AIR_COLUMNS:
+        column=table.column(name)
+        if name in AIR_TIME_COLUMNS:
+            column=format_time_column(column,name)
+        elif pa.types.is_dictionary(column.type):
+            column=column.cast(pa.string())
+        columns.append(column)
+    frame=pa.Table.from_arrays(columns,names=list(AIR_COLUMNS)).to_pandas()
+    frame=frame.astype(object)
+    for row,texts in iter_time_texts(table):
+        for name,value in texts.items():
+            frame.iat[row,AIR_COLUMNS.index(name)]=value
+    return frame
+
+### Writes the daily flight summary rows (lists of strings) to Parquet
+def write_summary_parquet(rows,outname,compression="snappy"):
+    pa=import_pyarrow()
+    schema=build_schema(SUMMARY_COLUMNS,SUMMARY_TIME_COLUMNS,
+                        SUMMARY_INT_COLUMNS)
+    pa.parquet.write_table(rows_to_table(rows,schema),outname,
+                           compression=compression)
@@ -0,0 +1,107 @@
+##@Copyright 2020. Ulrich Linder, Al Capps
+##@Organization - aviationdatascience.org non-profit, through release from Penn State
+##@License - This work is licensed under MIT license - https://opensource.org/licenses/MIT
+## This permissive license lets you do basically whatever you want.
+## Per the details of the MIT license, the software is provided "as is".
+## Have fun!
+
+## Drops unchanged air messages while flattening (--dedup). TBFM sends the
+## same flight state again and again; only msgtime differs. Per flight the
+## last written field set is kept, and a message with the same fields is
+## not written. Most repeats are recognized before parsing: the part of
+## the raw message from <air on (everything but the <tma> envelope with
+## the times) is fingerprinted, and a message whose fingerprint is the
+## last written one of some flight is a repeat of that flight.
+## So the last seen time of a flight is not lost, its last dropped repeat
+## is written once at the end of the file if nothing was written for the
+## flight after it. Every summary engine gives the same result as without
+## --dedup: a repeat changes nothing but lastmsgtime, and the one at the
+## end of the file carries the last msgtime of the flight in the file.
+## Only the per-message history within the file gets thinner.
+import hashlib
+import re
+
+###The following can be treated as static and immutable.
+MSGTIME_RE=re.compile(r'msgTime="([^"]*)"')
+
+def body_fingerprint(body):
+    return hashlib.blake2b(body.encode(),digest_size=16).digest()
+
+##############################
+###
+###  Wraps the air writer of one file. write_row drops rows whose fields
+###  equal the flight's last written ones; drop_unchanged does the same
+###  for a raw message before it is parsed. Fingerprints live for one file
+###  only, so files can still be flattened in any order or in parallel.
+#############################
+class DedupAirWriter:
+    def __init__(self,airF):
+        self.airF=airF
+        ## flight key -> last written values, and its body fingerprint
+        self.last_values={}
+        self.last_body={}
+        ## body fingerprint -> flight key, for the last written bodies
+        self.body_keys={}
+        ## flight key -> (msgtime,values) of a dropped repeat not yet
+        ## followed by a written row, in order of the drops
+        self.pending={}
+        self.body=None
+        self.dropped=0
+
+    ## True when str_line repeats the last written message of a flight.
+    ## Otherwise the fingerprint is kept for the write_row that follows.
+    def drop_unchanged(self,str_line):
+        start=str_line.find("<air ")
+        if start == -1:
+            self.body=None
+            return False
+        fingerprint=body_fingerprint(str_line[start:])
+        key=self.body_keys.get(fingerprint)
+        if key is not None:
+            m=MSGTIME_RE.search(str_line,0,start)
+            if m is not None:
+                self.drop(key,m.group(1),self.last_values[key])
+                return True
+        self.body=fingerprint
+        return False
+
+    def write_row(self,msgtime,aid,tmaid,dap,apt,values):
+        key=(aid,tmaid,dap,apt)
+        body=self.body
+        self.body=None
+        if self.last_values.get(key) == values:
+            self.drop(key,msgtime,values)
+            ## Learn this wording of the message too
+            if body is not None:
+                self.set_body(key,body)
+            return
+        self.pending.pop(key,None)
+        self.last_values[key]=values
+        if body is not None:
+            self.set_body(key,body)
+        self.airF.write_row(msgtime,aid,tmaid,dap,apt,values)
+
+    def set_body(self,key,body):
+        old=self.last_body.get(key)
+        if old is not None and self.body_keys.get(old) == key:
+            del self.body_keys[old]
+        self.last_body[key]=body
+        self.body_keys[body]=key
+
+    def drop(self,key,msgtime,values):
+        self.dropped+=1
+        self.pending.pop(key,None)
+        self.pending[key]=(msgtime,values)
+
+    ## Raw data (the header) goes straight through
+    def write(self,data):
+        self.airF.write(data)
+
+    ## The last repeat of each flight that had one after its last row.
+    ## dropped is then the number of messages that were not written.
+    def close(self):
+        for key,(msgtime,values) in self.pending.items():
+            self.airF.write_row(msgtime,*key,values)
+        self.dropped-=len(self.pending)
+        self.pending.clear()
+        self.airF.close()
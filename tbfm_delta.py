@@ -0,0 +1,259 @@
+##@Copyright 2020. Ulrich Linder, Al Capps
+##@Organization - aviationdatascience.org non-profit, through release from Penn State
+##@License - This work is licensed under MIT license - https://opensource.org/licenses/MIT
+## This permissive license lets you do basically whatever you want.
+## Per the details of the MIT license, the software is provided "as is".
+## Have fun!
+
+## Delta encoded air output (--format delta). A flattened air row carries
+## all 56 columns though most are empty or the same as in the flight's
+## previous message. Here every message is one line: msgtime, the (aid,
+## tmaId, dap, apt) flight key, a frame tag with the hex mask of the
+## columns the message has values for, then one field per such column.
+## In a delta (D) the field is empty when the value is the same as the
+## flight's last value of that column; a keyframe (K) has them all. A
+## flight's first message in a file and every KEYFRAME_ROWS-th after it
+## are keyframes and forget the older values, so each file decodes on its
+## own and a reader never has far to go back. Masks repeat from message
+## to message and compress to almost nothing. Rows that a comma in a value
+## made wider than the header are written whole (R). Decoding gives back
+## the air CSV byte for byte.
+## The summary does not need the full rows: it keeps the latest non-empty
+## value of every column, and an unchanged value adds nothing to that.
+## iter_sparse_rows hands it the rows with unchanged values left empty,
+## which needs no per-flight state at all.
+import argparse
+import gzip
+import sys
+from tbfm_columnar import AIR_COLUMNS
+
+###The following can be treated as static and immutable.
+DELTA_HEADER="msgtime,aid,tmaId,dap,apt,frame,values\n"
+KEYFRAME="K"
+DELTA="D"
+WHOLE_ROW="R"
+
+## Messages of a flight from one keyframe to the next
+KEYFRAME_ROWS=32
+
+## Lines are handed to gzip in blocks of about this many characters
+DELTA_FLUSH_BYTES=1<<18
+
+## Number of the first column that is not msgtime or part of the key
+FIRST_VALUE=5
+WIDTH=len(AIR_COLUMNS)
+
+### Column numbers of the set bits of a frame mask, cached per mask
+MASK_ENTRIES={}
+
+def mask_entries(mask):
+    entries=MASK_ENTRIES.get(mask)
+    if entries is None:
+        bits=int(mask,16)
+        entries=[FIRST_VALUE+bit for bit in range(bits.bit_length())
+                 if bits >> bit & 1]
+        MASK_ENTRIES[mask]=entries
+    return entries
+
+### A format string that lays the fields of a line with this mask out as
+### a full CSV row, empty where the mask has no value, cached per mask.
+### Filling it and splitting the result is much faster than placing the
+### values one by one.
+MASK_TEMPLATES={}
+
+def mask_template(mask):
+    template=MASK_TEMPLATES.get(mask)
+    if template is None:
+        entries=set(mask_entries(mask))
+        template=",".join("{}" if entry < FIRST_VALUE or entry in entries
+                          else "" for entry in range(WIDTH))
+        MASK_TEMPLATES[mask]=template
+    return template
+
+##############################
+###
+###  Drop-in replacement for AirRowWriter when flattening with --format
+###  delta. Keeps the last values of every flight of the file to diff the
+###  next message against, and writes the header itself.
+#############################
+class DeltaAirWriter:
+    def __init__(self,outF,keyframe_rows=KEYFRAME_ROWS,
+                 flush_bytes=DELTA_FLUSH_BYTES):
+        self.outF=outF
+        self.keyframe_rows=keyframe_rows
+        self.flush_bytes=flush_bytes
+        ## flight key -> [last values, messages since the keyframe]
+        self.flights={}
+        self.lines=[]
+        self.size=0
+        self.outF.write(DELTA_HEADER.encode())
+
+    def write_row(self,msgtime,aid,tmaid,dap,apt,values):
+        row=[msgtime,aid,tmaid,dap,apt]+values
+        line=",".join(row)
+        ## A value holding a comma is split the way the CSV reader would
+        if line.count(",") != len(row)-1:
+            row=line.split(",")
+        key=",".join(row[1:FIRST_VALUE])
+        if len(row) != WIDTH:
+            self.flights.pop(key,None)
+            self.add_line(",".join(row[:FIRST_VALUE])+","+WHOLE_ROW+","+
+                          ",".join(row[FIRST_VALUE:])+"\n")
+            return
+        mask=0
+        fields=[]
+        flight=self.flights.get(key)
+        if flight is None or flight[1] >= self.keyframe_rows:
+            tag=KEYFRAME
+            self.flights[key]=[row,1]
+            for entry in range(FIRST_VALUE,WIDTH):
+                value=row[entry]
+                if value != "":
+                    mask|=1 << (entry-FIRST_VALUE)
+                    fields.append(value)
+        else:
+            tag=DELTA
+            flight[1]+=1
+            last=flight[0]
+            for entry in range(FIRST_VALUE,WIDTH):
+                value=row[entry]
+                if value != "":
+                    mask|=1 << (entry-FIRST_VALUE)
+                    if value == last[entry]:
+                        fields.append("")
+                    else:
+                        fields.append(value)
+                        last[entry]=value
+        out=",".join(row[:FIRST_VALUE])+","+tag+format(mask,"x")
+        if fields:
+            out=out+","+",".join(fields)
+        self.add_line(out+"\n")
+
+    def add_line(self,out):
+        self.lines.append(out)
+        self.size+=len(out)
+        if self.size >= self.flush_bytes:
+            self.flush()
+
+    def flush(self):
+        if self.lines:
+            self.outF.write("".join(self.lines).encode())
+            self.lines.clear()
+            self.size=0
+
+    def close(self):
+        self.flush()
+        self.outF.close()
+
+### The lines of a delta file split into their fields, without the header
+def read_delta_lines(full_path):
+    with gzip.open(full_path,'rt') as f:
+        header=f.readline()
+        if header != DELTA_HEADER:
+            raise ValueError(full_path+" is not a delta encoded air file")
+        for line in f:
+            yield line.rstrip("\n").split(",")
+
+##############################
+###
+###  Yields the full air rows of a delta file (lists of strings, like the
+###  summary reads the CSV), header first. With flights, an iterable of
+###  (aid, tmaId, dap, apt) tuples, only the rows of those flights.
+#############################
+def iter_full_rows(full_path,flights=None):
+    wanted=None
+    if flights is not None:
+        wanted=set(",".join(flight) for flight in flights)
+    last_values={}
+    yield list(AIR_COLUMNS)
+    for parts in read_delta_lines(full_path):
+        key=",".join(parts[1:FIRST_VALUE])
+        if wanted is not None and key not in wanted:
+            continue
+        frame=parts[FIRST_VALUE]
+        if frame == WHOLE_ROW:
+            last_values.pop(key,None)
+            yield parts[:FIRST_VALUE]+parts[FIRST_VALUE+1:]
+            continue
+        row=parts[:FIRST_VALUE]+[""]*(WIDTH-FIRST_VALUE)
+        if frame[0] == KEYFRAME:
+            last=[""]*WIDTH
+            last_values[key]=last
+        else:
+            last=last_values[key]
+        field=FIRST_VALUE+1
+        for entry in mask_entries(frame[1:]):
+            value=parts[field]
+            field+=1
+            if value == "":
+                value=last[entry]
+            else:
+                last[entry]=value
+            row[entry]=value
+        yield row
+
+##############################
+###
+###  Yields the rows of a delta file for the summary, header first: the
+###  values a message changed, with the unchanged ones left empty.
+###  Folding these into "latest non-empty value wins" gives the same
+###  flights as the full rows.
+#############################
+def iter_sparse_rows(full_path):
+    yield list(AIR_COLUMNS)
+    for parts in read_delta_lines(full_path):
+        frame=parts[FIRST_VALUE]
+        if frame == WHOLE_ROW:
+            yield parts[:FIRST_VALUE]+parts[FIRST_VALUE+1:]
+            continue
+        del parts[FIRST_VALUE]
+        yield mask_template(frame[1:]).format(*parts).split(",")
+
+### Writes the full rows back out in the flattener's air CSV layout
+def main():
+
+    flights=None
+    if parms["flights"]:
+        flights=[tuple(flight.split(",")) for flight in parms["flights"]]
+    if parms["out"]:
+        outF=gzip.open(parms["out"],"wt",compresslevel=parms["compresslevel"])
+    else:
+        outF=sys.stdout
+    row_end=",\n" if parms["trailing_comma"] else "\n"
+    rows=iter_full_rows(parms["file"],flights)
+    outF.write(",".join(next(rows))+"\n")
+    for row in rows:
+        outF.write(",".join(row)+row_end)
+    if parms["out"]:
+        outF.close()
+    else:
+        outF.flush()
+
+def build_parms(args):
+    """Helper function to parse command line arguments into dictionary
+        input: ArgumentParser class object
+        output: dictionary of expected parameters
+    """
+    parms = {"file":args.file,
+             "out":args.out,
+             "flights":args.flight,
+             "trailing_comma":not args.no_trailing_comma,
+             "compresslevel":args.compresslevel}
+    return(parms)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = \
+                 "Decode a delta encoded air file into full air CSV rows.")
+    parser.add_argument("file",
+                        help = "Air file flattened with --format delta.")
+    parser.add_argument("--out",
+                        help = "Gzipped air CSV to write (default: stdout).")
+    parser.add_argument("--flight", action="append",
+                        help = "aid,tmaId,dap,apt of a flight, repeatable.")
+    parser.add_argument("--no-trailing-comma", action="store_true",
+                        help = "End rows without the extra comma.")
+    parser.add_argument("--compresslevel", type=int, default = 9,
+                        choices=range(0,10), metavar="0-9")
+    parms = build_parms(parser.parse_args())
+    main()
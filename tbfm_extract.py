@@ -0,0 +1,345 @@
+##@Copyright 2020. Ulrich Linder, Al Capps
+##@Organization - aviationdatascience.org non-profit, through release from Penn State
+##@License - This work is licensed under MIT license - https://opensource.org/licenses/MIT
+## This permissive license lets you do basically whatever you want.
+## Per the details of the MIT license, the software is provided "as is".
+## Have fun!
+
+## Fast extraction of the flattened "air" message fields from a single
+## TBFM SWIM line. Building a BeautifulSoup tree for every message was by
+## far the largest CPU cost of the flattener, so the common, well formed
+## messages are handled here by a single compiled regular expression scan.
+## Anything the scanner is not sure about (entities, comments, CDATA,
+## mismatched or nested field tags, HTML special tags...) falls back to the
+## original BeautifulSoup path so the CSV output stays byte-identical.
+## The con, adp and oth messages are flattened the same way by
+## extract_other, into (path, value) pairs since their content varies.
+import re
+
+###The following can be treated as static and immutable.
+## Flattened air fields in the order they are written to CSV
+AIR_FIELDS=('mfx','cat','gat','bcn',
+            'rwy','scn','fps','acs',
+            'typ','eng','spd','trw',
+            'sfz','rfz','eta_rwy',
+            'eta_mfx','eta_oma',
+            'eta_sfx','eta_dfx',
+            'eta_o4a','eta_o3a',
+            'eta_ooa','sta_o4a',
+            'sta_o3a','sta_ooa',
+            'sta_oma','sta_dfx',
+            'sta_sfx','ara','tds',
+            'cfx','ctm','etd','std',
+            'etm','est','a10','tcr',
+            'dfx','sfx','oma','ooa',
+            'o3a','o4a','ina','sus',
+            'man','sta_rwy','sta_mfx','cfg',
+            'tra')
+AIR_FIELD_INDEX={name:idx for idx,name in enumerate(AIR_FIELDS)}
+
+## Message types that extract_other flattens
+OTHER_TYPES=('con','adp','oth')
+
+## BeautifulSoup (and lxml under it) are only imported once a message
+## actually falls back to them, most runs never load them
+def bs(markup,features):
+    from bs4 import BeautifulSoup
+    return BeautifulSoup(markup,features)
+
+## Messages handed to BeautifulSoup in this process, for the run metrics
+EXTRACT_STATS={"air_fallbacks":0,"other_fallbacks":0}
+
+## Tags that an HTML parser treats specially (void, raw text, implied end,
+## tables, forms...). If one shows up, let BeautifulSoup decide.
+HTML_SPECIAL_TAGS=frozenset((
+    'html','head','body','title','meta','link','base','script','style',
+    'noscript','template','textarea','xmp','iframe','noembed','noframes',
+    'plaintext','frameset','frame','p','br','hr','img','input','area',
+    'col','colgroup','embed','param','source','track','wbr','keygen',
+    'table','thead','tbody','tfoot','tr','td','th','caption','select',
+    'option','optgroup','li','ul','ol','dl','dt','dd','form','button',
+    'h1','h2','h3','h4','h5','h6','pre','listing','div','address',
+    'article','aside','blockquote','center','details','dialog','dir',
+    'fieldset','figcaption','figure','footer','header','hgroup','main',
+    'menu','nav','section','summary','math','svg','image','a','b','big',
+    'code','em','font','i','nobr','s','small','strike','strong','tt',
+    'u','rb','rp','rt','rtc','ruby','applet','marquee','object','isindex'))
+
+## One match per tag: end marker, name, raw attributes, self-closing marker.
+## Processing instructions (<?xml ... ?>) are matched and skipped.
+TAG_RE=re.compile(r'<(?:(/?)([A-Za-z][^\s/>]*)'
+                  r'((?:\s(?:[^<>"\']|"[^"]*"|\'[^\']*\')*?)?)(/?)>|\?[^<>]*>)')
+ATTR_RE=re.compile(r'\s+([^\s=/>"\']+)(?:\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s"\'=<>`]+)))?')
+ATTR_TAIL_RE=re.compile(r'\s*')
+
+class FallbackNeeded(Exception):
+    pass
+
+### Parses the raw attribute text of a tag into a lower-cased dictionary.
+### Only quoted values are handled, TBFM always quotes its attributes
+def parse_attrs(raw):
+    attrs={}
+    pos=0
+    end=len(raw)
+    while pos < end:
+        m=ATTR_RE.match(raw,pos)
+        if m is None:
+            if ATTR_TAIL_RE.fullmatch(raw,pos):
+                break
+            raise FallbackNeeded()
+        name=m.group(1).lower()
+        if name in attrs:
+            raise FallbackNeeded()
+        if m.group(4) is not None:
+            raise FallbackNeeded()
+        value=m.group(2)
+        if value is None:
+            value=m.group(3)
+        if value is None:
+            value=""
+        attrs[name]=value
+        pos=m.end()
+    return attrs
+
+##############################
+###
+###  Extracts msgtime, the flight key and all flattened fields from one
+###  air message. Returns (msgtime,aid,tmaid,dap,apt,values) where values
+###  follows the AIR_FIELDS order. Values are "" when not populated.
+#############################
+def extract_air(str_line):
+    if "&" in str_line or "<!" in str_line:
+        EXTRACT_STATS["air_fallbacks"]+=1
+        return extract_air_bs4(str_line)
+    try:
+        return _extract_air_fast(str_line)
+    except FallbackNeeded:
+        EXTRACT_STATS["air_fallbacks"]+=1
+        return extract_air_bs4(str_line)
+
+def _extract_air_fast(str_line):
+    values=[""]*len(AIR_FIELDS)
+    field_index=AIR_FIELD_INDEX
+    special=HTML_SPECIAL_TAGS
+    msgtime=None
+    air=None
+    stack=[]
+    ## Index of the field we are currently inside, and where its text starts
+    field=None
+    text_start=0
+    pos=0
+    for m in TAG_RE.finditer(str_line):
+        start=m.start()
+        if str_line.find("<",pos,start) != -1:
+            raise FallbackNeeded()
+        pos=m.end()
+        name=m.group(2)
+        if name is None:
+            ## Processing instruction, only expected before any element
+            if stack:
+                raise FallbackNeeded()
+            continue
+        name=name.lower()
+        if name in special:
+            raise FallbackNeeded()
+        if m.group(1):
+            ## End tag
+            if not stack or stack.pop() != name:
+                raise FallbackNeeded()
+            if field is not None:
+                values[field]=str_line[text_start:start]
+                field=None
+            continue
+        ## Start tag. Fields are plain text only, anything nested goes to bs4
+        if field is not None:
+            raise FallbackNeeded()
+        idx=field_index.get(name)
+        raw_attrs=m.group(3)
+        if raw_attrs:
+            attrs=parse_attrs(raw_attrs)
+        else:
+            attrs={}
+        if name == "tma":
+            msgtime=attrs.get("msgtime")
+            if msgtime is None:
+                raise FallbackNeeded()
+        elif name == "air":
+            air=attrs
+        if m.group(4):
+            ## Self-closing element has no text
+            if idx is not None:
+                values[idx]=""
+            continue
+        stack.append(name)
+        if idx is not None:
+            field=idx
+            text_start=pos
+    if stack or str_line.find("<",pos) != -1:
+        raise FallbackNeeded()
+    if msgtime is None or air is None:
+        raise FallbackNeeded()
+    try:
+        return (msgtime,air['aid'],air['tmaid'],air['dap'],air['apt'],values)
+    except KeyError:
+        raise FallbackNeeded()
+
+##############################
+###
+###  Original BeautifulSoup extraction. Kept as the reference for the
+###  fast scanner above and used for anything it will not handle.
+#############################
+def extract_air_bs4(str_line):
+
+    ## msgd initializes all possible name value pairs with a blank "" value
+    msgd=dict.fromkeys(AIR_FIELDS,"")
+
+    ##Here "bs" is beautiful soup, which is used for many parsing utilities
+    response = bs(str_line,"lxml")
+
+    ### Here we iterate through all (or most) descendants of the XML element
+    ### and assign any populated values to the appropriate
+    ### python dictionary with the same name as the element
+    for child in response.descendants:
+        if (child.name == "tma"):
+            msgtime=child['msgtime']
+            continue
+        elif (child.name == "air"):
+            aid=child['aid']
+            apt=child['apt']
+            dap=child['dap']
+            tmaid=child['tmaid']
+        elif (child.name not in msgd.keys()):
+            continue
+        else:
+            msgd.update({child.name:child.text})
+
+    return (msgtime,aid,tmaid,dap,apt,list(msgd.values()))
+
+##############################
+###
+###  Flattens a con, adp or oth message (msg_type) into
+###  (msgtime,envname,elements). elements lists (path,value) pairs in
+###  document order: the text of every leaf element below the message
+###  element, path being the element names below it joined by "/"
+###  (e.g. "cfg/rwy"), and every attribute as path@name ("@name" for the
+###  message element itself). Repeated elements give repeated pairs.
+#############################
+def extract_other(str_line,msg_type):
+    if "&" in str_line or "<!" in str_line:
+        EXTRACT_STATS["other_fallbacks"]+=1
+        return extract_other_bs4(str_line,msg_type)
+    try:
+        return _extract_other_fast(str_line,msg_type)
+    except FallbackNeeded:
+        EXTRACT_STATS["other_fallbacks"]+=1
+        return extract_other_bs4(str_line,msg_type)
+
+def _extract_other_fast(str_line,msg_type):
+    special=HTML_SPECIAL_TAGS
+    msgtime=None
+    envname=""
+    elements=[]
+    stack=[]
+    ## Stack depth of the open message element, None outside of it
+    root=None
+    path=[]
+    ## Whether the innermost open element has no child elements so far
+    leaf=False
+    text_start=0
+    pos=0
+    for m in TAG_RE.finditer(str_line):
+        start=m.start()
+        if str_line.find("<",pos,start) != -1:
+            raise FallbackNeeded()
+        pos=m.end()
+        name=m.group(2)
+        if name is None:
+            if stack:
+                raise FallbackNeeded()
+            continue
+        name=name.lower()
+        if name in special:
+            raise FallbackNeeded()
+        if m.group(1):
+            ## End tag
+            if not stack or stack.pop() != name:
+                raise FallbackNeeded()
+            if root is not None:
+                if len(stack) == root:
+                    root=None
+                else:
+                    if leaf:
+                        elements.append(("/".join(path),
+                                         str_line[text_start:start]))
+                    path.pop()
+            leaf=False
+            continue
+        raw_attrs=m.group(3)
+        if raw_attrs:
+            attrs=parse_attrs(raw_attrs)
+        else:
+            attrs={}
+        if root is None:
+            if name == "tma":
+                msgtime=attrs.get("msgtime")
+                if msgtime is None:
+                    raise FallbackNeeded()
+                envname=attrs.get("envname","")
+            elif name == msg_type:
+                for attr,value in attrs.items():
+                    elements.append(("@"+attr,value))
+                if not m.group(4):
+                    root=len(stack)
+            if not m.group(4):
+                stack.append(name)
+            leaf=False
+            continue
+        path.append(name)
+        prefix="/".join(path)
+        for attr,value in attrs.items():
+            elements.append((prefix+"@"+attr,value))
+        if m.group(4):
+            ## Self-closing element is a leaf without text
+            elements.append((prefix,""))
+            path.pop()
+            leaf=False
+            continue
+        stack.append(name)
+        leaf=True
+        text_start=pos
+    if stack or str_line.find("<",pos) != -1:
+        raise FallbackNeeded()
+    if msgtime is None:
+        raise FallbackNeeded()
+    return (msgtime,envname,elements)
+
+### BeautifulSoup version of extract_other, the reference for the scanner
+def extract_other_bs4(str_line,msg_type):
+    response = bs(str_line,"lxml")
+    tma=response.find("tma")
+    msgtime=tma['msgtime']
+    envname=tma.get('envname',"")
+    elements=[]
+    for root in response.find_all(msg_type):
+        for attr,value in root.attrs.items():
+            elements.append(("@"+attr,attr_text(value)))
+        for child in root.descendants:
+            if child.name is None:
+                continue
+            names=[child.name]
+            for parent in child.parents:
+                if parent is root:
+                    break
+                names.append(parent.name)
+            prefix="/".join(reversed(names))
+            for attr,value in child.attrs.items():
+                elements.append((prefix+"@"+attr,attr_text(value)))
+            if child.find(True) is None:
+                elements.append((prefix,child.text))
+    return (msgtime,envname,elements)
+
+## The HTML parser splits a few attributes (class, ...) into lists
+def attr_text(value):
+    if isinstance(value,list):
+        return " ".join(value)
+    return value
@@ -0,0 +1,226 @@
+##@Copyright 2020. Ulrich Linder, Al Capps
+##@Organization - aviationdatascience.org non-profit, through release from Penn State
+##@License - This work is licensed under MIT license - https://opensource.org/licenses/MIT
+## This permissive license lets you do basically whatever you want.
+## Per the details of the MIT license, the software is provided "as is".
+## Have fun!
+
+## Memory-bounded flight table for the daily summary. The loop engine kept
+## every flight of the window in one dict until the summary was written.
+## FlightStore is that dict, but flights idle past a TTL are finalized and
+## spilled to disk, and when more than flight_budget flights are held the
+## LANDED ones and then the least recently updated ones follow. Each spill
+## is a run sorted by flight key. A flight that sends again after being
+## spilled starts over as a new partial state, exactly like a flight in
+## the next hour of the parallel engine, and the partials of a flight are
+## put back together with the same merge_partial. At the end the runs are
+## merged by key, the merged flights written to runs sorted by order of
+## first appearance, and those merged again into the summary rows. Only a
+## run's worth of flights is in memory at any point, and the rows come out
+## identical to the in-memory table.
+import heapq
+import os
+import pickle
+import shutil
+import tempfile
+from tbfm_columnar import AIR_COLUMNS
+from tbfm_time import parse_zulu
+
+###The following can be treated as static and immutable.
+MSGTIME_ENTRY=AIR_COLUMNS.index('msgtime')
+ACS_ENTRY=AIR_COLUMNS.index('acs')
+STD_ENTRY=AIR_COLUMNS.index('std')
+
+## Rows between checks of the TTL, the budget is checked on every row
+SWEEP_ROWS=10000
+
+## A sweep over budget evicts down to this share of the budget
+LOW_WATER=0.75
+
+## Merged flights per run of the second (order) pass, without a budget
+ORDER_RUN_FLIGHTS=50000
+
+## Runs read at once by a merge, more are first merged in groups of this
+MERGE_FAN_IN=64
+
+## One pickle per record. A shared Pickler/Unpickler would keep every
+## record of the run alive in its memo.
+def write_run(run_dir,records):
+    fd,run_name=tempfile.mkstemp(dir=run_dir,suffix=".run")
+    with os.fdopen(fd,"wb") as f:
+        for record in records:
+            pickle.dump(record,f,pickle.HIGHEST_PROTOCOL)
+    return run_name
+
+def read_run(run_name):
+    with open(run_name,"rb") as f:
+        while True:
+            try:
+                record=pickle.load(f)
+            except EOFError:
+                break
+            yield record
+    os.remove(run_name)
+
+### Merges runs sorted on sort_key, MERGE_FAN_IN at a time, until at most
+### MERGE_FAN_IN are left so they can all be open together
+def reduce_runs(run_dir,runs,sort_key):
+    while len(runs) > MERGE_FAN_IN:
+        merged=[]
+        for first in range(0,len(runs),MERGE_FAN_IN):
+            group=runs[first:first+MERGE_FAN_IN]
+            if len(group) == 1:
+                merged.extend(group)
+                continue
+            merged.append(write_run(run_dir,heapq.merge(
+                *[read_run(run_name) for run_name in group],key=sort_key)))
+        runs=merged
+    return runs
+
+##############################
+###
+###  Dict of flight key -> TflightState for update_flight, which only
+###  uses get() and item assignment. Call add_row after update_flight with
+###  the same row so the store can track partial states and sweep. merge
+###  and to_row are the summary's merge_partial and flight_row.
+#############################
+class FlightStore(dict):
+    def __init__(self,merge,to_row,flight_budget=0,ttl_secs=0,
+                 spill_dir=None):
+        dict.__init__(self)
+        self.merge=merge
+        self.to_row=to_row
+        self.flight_budget=flight_budget
+        self.ttl_secs=ttl_secs
+        self.spill_dir=spill_dir
+        self.run_dir=None
+        self.runs=[]
+        ## Order of first appearance and first std of each held partial
+        self.orders={}
+        self.first_stds={}
+        self.next_order=0
+        self.rows_since_sweep=0
+        self.last_msgtime=""
+        self.num_spilled=0
+
+    def __setitem__(self,key,value):
+        dict.__setitem__(self,key,value)
+        self.orders[key]=self.next_order
+        self.next_order+=1
+
+    def add_row(self,result):
+        if len(result) > STD_ENTRY and result[STD_ENTRY] != "":
+            key=tuple(result[1:5])
+            if key in self and key not in self.first_stds:
+                self.first_stds[key]=result[STD_ENTRY]
+        if result[MSGTIME_ENTRY] > self.last_msgtime:
+            self.last_msgtime=result[MSGTIME_ENTRY]
+        self.rows_since_sweep+=1
+        if self.rows_since_sweep >= SWEEP_ROWS or \
+           (self.flight_budget and len(self) > self.flight_budget):
+            self.rows_since_sweep=0
+            self.sweep()
+
+    ## Evicts the flights idle past the TTL, then over budget the LANDED
+    ## ones and the least recently updated ones until LOW_WATER is reached
+    def sweep(self):
+        evict=[]
+        if self.ttl_secs and self.last_msgtime:
+            cutoff=parse_zulu(self.last_msgtime)-self.ttl_secs
+            evict=[key for key,value in self.items()
+                   if parse_zulu(value.values[MSGTIME_ENTRY]) < cutoff]
+        if self.flight_budget and len(self)-len(evict) > self.flight_budget:
+            evicting=set(evict)
+            keep=int(self.flight_budget*LOW_WATER)
+            rest=[key for key in self if key not in evicting]
+            rest.sort(key=lambda key:(self[key].values[ACS_ENTRY] != "LANDED",
+                                      self[key].values[MSGTIME_ENTRY]))
+            evict.extend(rest[:len(rest)-keep])
+        if evict:
+            self.spill(evict)
+
+    def spill(self,keys):
+        if self.run_dir is None:
+            self.run_dir=tempfile.mkdtemp(prefix="tbfm_flights_",
+                                          dir=self.spill_dir)
+        records=[]
+        for key in sorted(keys):
+            records.append((key,self.orders.pop(key),
+                            self.first_stds.pop(key,None),
+                            dict.pop(self,key)))
+        self.runs.append(write_run(self.run_dir,records))
+        self.num_spilled+=len(records)
+
+    ## The partials of every flight, merged by key across all runs and the
+    ## flights still held, in key order. Yields (order, merged state)
+    def merged_flights(self):
+        held=[(key,self.orders[key],self.first_stds.get(key),value)
+              for key,value in sorted(self.items())]
+        sort_key=lambda record:(record[0],record[1])
+        self.runs=reduce_runs(self.run_dir,self.runs,sort_key)
+        sources=[read_run(run_name) for run_name in self.runs]+[iter(held)]
+        current_key=None
+        first_order=None
+        flights={}
+        for key,order,first_std,value in heapq.merge(*sources,
+                                                     key=sort_key):
+            if key != current_key:
+                if current_key is not None:
+                    yield first_order,flights[current_key]
+                current_key=key
+                first_order=order
+                flights={key:value}
+                continue
+            first_stds={key:first_std} if first_std is not None else {}
+            self.merge(flights,({key:value},first_stds))
+        if current_key is not None:
+            yield first_order,flights[current_key]
+
+    ##############################
+    ###
+    ###  The summary rows in order of first appearance. Without spills this
+    ###  is the dict itself. Otherwise the merged flights go through runs
+    ###  sorted by order; the result has the number of flights as its len
+    ###  and yields the rows once, removing the runs when done.
+    #############################
+    def summary_rows(self):
+        if not self.runs:
+            return [self.to_row(value) for value in self.values()]
+        run_flights=self.flight_budget or ORDER_RUN_FLIGHTS
+        order_runs=[]
+        batch=[]
+        num_flights=0
+        for order,value in self.merged_flights():
+            batch.append((order,self.to_row(value)))
+            num_flights+=1
+            if len(batch) >= run_flights:
+                batch.sort(key=lambda record:record[0])
+                order_runs.append(write_run(self.run_dir,batch))
+                batch=[]
+        batch.sort(key=lambda record:record[0])
+        self.clear()
+        self.orders.clear()
+        self.first_stds.clear()
+        return SpilledRows(self.run_dir,order_runs,batch,num_flights)
+
+### Rows merged from the order runs, see FlightStore.summary_rows
+class SpilledRows:
+    def __init__(self,run_dir,order_runs,held,num_flights):
+        self.run_dir=run_dir
+        self.order_runs=order_runs
+        self.held=held
+        self.num_flights=num_flights
+
+    def __len__(self):
+        return self.num_flights
+
+    def __iter__(self):
+        try:
+            sort_key=lambda record:record[0]
+            runs=reduce_runs(self.run_dir,self.order_runs,sort_key)
+            sources=[read_run(run_name) for run_name in runs]
+            for order,row in heapq.merge(*sources,iter(self.held),
+                                         key=sort_key):
+                yield row
+        finally:
+            shutil.rmtree(self.run_dir,ignore_errors=True)
@@ -0,0 +1,214 @@
+##@Copyright 2020. Ulrich Linder, Al Capps
+##@Organization - aviationdatascience.org non-profit, through release from Penn State
+##@License - This work is licensed under MIT license - https://opensource.org/licenses/MIT
+## This permissive license lets you do basically whatever you want.
+## Per the details of the MIT license, the software is provided "as is".
+## Have fun!
+
+## Per-flight index of the flattened air CSVs. Studying one flight used to
+## mean decompressing all 24 air files of the day. With --indexed the
+## flattener writes the air CSV as a series of independent gzip members
+## of about INDEX_BLOCK_BYTES of rows each (like BGZF). The file is still
+## an ordinary gzip for zcat and the summary. Next to it, a small index
+## records the offset and length of every member and, for every
+## (aid, tmaId, dap, apt) flight, the members holding its messages. The
+## messages of one flight are read back by decompressing only those.
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+import zlib
+
+###The following can be treated as static and immutable.
+## Uncompressed size at which a gzip member is closed
+INDEX_BLOCK_BYTES=1<<16
+
+INDEX_SUFFIX=".idx.json.gz"
+INDEX_VERSION=1
+
+def index_name(air_path):
+    return air_path + INDEX_SUFFIX
+
+## Flight keys are stored as the 4 CSV values joined by commas
+def flight_key(aid,tmaid,dap,apt):
+    return aid+","+tmaid+","+dap+","+apt
+
+##############################
+###
+###  Drop-in replacement for AirRowWriter when flattening with --indexed.
+###  Rows are formatted the same way, collected into a block and written
+###  as one gzip member when the block is full. The flights seen in a
+###  block are added to the index when it is written. Raw writes (the
+###  header) close the current block and get a member of their own.
+###  With stats the time spent compressing and writing blocks and the
+###  index is added to stats["write_secs"], like the flattener's other
+###  outputs.
+#############################
+class IndexedAirWriter:
+    def __init__(self,outname,indexname,compresslevel=9,trailing_comma=True,
+                 block_bytes=INDEX_BLOCK_BYTES,stats=None):
+        self.outF=open(outname,"wb")
+        self.stats=stats
+        self.indexname=indexname
+        self.compresslevel=compresslevel
+        self.block_bytes=block_bytes
+        if trailing_comma:
+            self.row_end=",\n"
+        else:
+            self.row_end="\n"
+        self.rows=[]
+        self.size=0
+        self.block_keys=set()
+        self.blocks=[]
+        self.flights={}
+
+    def write_row(self,msgtime,aid,tmaid,dap,apt,values):
+        key=aid+","+tmaid+","+dap+","+apt
+        row=msgtime+","+key+","+",".join(values)+self.row_end
+        self.rows.append(row)
+        self.size+=len(row)
+        self.block_keys.add(key)
+        if self.size >= self.block_bytes:
+            self.flush()
+
+    def write(self,data):
+        self.flush()
+        self.write_member(data)
+
+    ## Closes the current block
+    def flush(self):
+        if not self.rows:
+            return
+        block=len(self.blocks)
+        self.write_member("".join(self.rows).encode())
+        for key in self.block_keys:
+            blocks=self.flights.get(key)
+            if blocks is None:
+                self.flights[key]=[block]
+            else:
+                blocks.append(block)
+        self.rows.clear()
+        self.size=0
+        self.block_keys.clear()
+
+    def write_member(self,data):
+        start=time.perf_counter()
+        offset=self.outF.tell()
+        self.outF.write(gzip.compress(data,compresslevel=self.compresslevel,
+                                      mtime=0))
+        self.blocks.append((offset,self.outF.tell()-offset))
+        self.add_write_time(start)
+
+    def close(self):
+        self.flush()
+        start=time.perf_counter()
+        air_bytes=self.outF.tell()
+        self.outF.close()
+        with gzip.open(self.indexname,"wt") as f:
+            json.dump({"version":INDEX_VERSION,"air_bytes":air_bytes,
+                       "blocks":self.blocks,"flights":self.flights},f)
+        self.add_write_time(start)
+
+    def add_write_time(self,start):
+        if self.stats is not None:
+            self.stats["write_secs"]+=time.perf_counter()-start
+
+### Reads the index of an air file. The air file size is checked so an
+### index left over from an earlier run is not used for a rewritten file.
+def load_index(air_path):
+    with gzip.open(index_name(air_path),"rt") as f:
+        index=json.load(f)
+    if index.get("version") != INDEX_VERSION:
+        raise ValueError("Unsupported index version in "+index_name(air_path))
+    if index["air_bytes"] != os.path.getsize(air_path):
+        raise ValueError("Stale index "+index_name(air_path)+
+                         ", flatten the file again with --indexed")
+    return index
+
+##############################
+###
+###  Yields the split air rows (lists of strings, like the summary reads
+###  them) of the given flights from one indexed air file, in file order.
+###  flights is an iterable of (aid, tmaId, dap, apt) tuples. Only the
+###  gzip members that hold one of them are read and decompressed.
+#############################
+def iter_flight_rows(air_path,flights,index=None):
+    if index is None:
+        index=load_index(air_path)
+    wanted=set(flight_key(*flight) for flight in flights)
+    blocks=set()
+    for key in wanted:
+        blocks.update(index["flights"].get(key,()))
+    with open(air_path,"rb") as f:
+        for block in sorted(blocks):
+            offset,length=index["blocks"][block]
+            f.seek(offset)
+            data=zlib.decompress(f.read(length),16+zlib.MAX_WBITS)
+            for line in data.decode().splitlines():
+                result=line.split(",")
+                if ",".join(result[1:5]) in wanted:
+                    yield result
+
+### All messages of the given flights across several air files (e.g. the
+### 24 files of a day), as a dict of flight tuple -> list of split rows
+def flight_messages(air_paths,flights):
+    flights=[tuple(flight) for flight in flights]
+    messages={flight:[] for flight in flights}
+    for air_path in air_paths:
+        for result in iter_flight_rows(air_path,flights):
+            messages[tuple(result[1:5])].append(result)
+    return messages
+
+## Indexed air files of a directory, optionally of one YYYYMMDD date only
+def indexed_air_files(read_dir,date=None):
+    air_paths=[]
+    for filename in sorted(os.listdir(read_dir)):
+        if not filename.endswith("_air.csv.gz"):
+            continue
+        if date and date not in filename:
+            continue
+        air_path=os.path.join(read_dir,filename)
+        if os.path.exists(index_name(air_path)):
+            air_paths.append(air_path)
+    return air_paths
+
+def main():
+
+    air_paths=indexed_air_files(parms["readDir"],parms["date"])
+    flights=[tuple(flight.split(",")) for flight in parms["flights"]]
+    for flight in flights:
+        if len(flight) != 4:
+            raise ValueError("A flight is aid,tmaId,dap,apt, not "+
+                             ",".join(flight))
+    messages=flight_messages(air_paths,flights)
+    outF=sys.stdout
+    for flight in flights:
+        for result in messages[flight]:
+            outF.write(",".join(result)+"\n")
+    outF.flush()
+
+def build_parms(args):
+    """Helper function to parse command line arguments into dictionary
+        input: ArgumentParser class object
+        output: dictionary of expected parameters
+    """
+    parms = {"readDir":args.dir,
+             "flights":args.flight,
+             "date":args.date}
+    return(parms)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = \
+                 "Print the flattened air messages of some flights.")
+    parser.add_argument("dir",
+                        help = "Directory of air files flattened with "+
+                        "--indexed.")
+    parser.add_argument("--flight", action="append", required=True,
+                        help = "aid,tmaId,dap,apt of a flight, repeatable.")
+    parser.add_argument("--date",
+                        help = "Only files with this YYYYMMDD in the name.")
+    parms = build_parms(parser.parse_args())
+    main()
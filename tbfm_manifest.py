@@ -0,0 +1,92 @@
+##@Copyright 2020. Ulrich Linder, Al Capps
+##@Organization - aviationdatascience.org non-profit, through release from Penn State
+##@License - This work is licensed under MIT license - https://opensource.org/licenses/MIT
+## This permissive license lets you do basically whatever you want.
+## Per the details of the MIT license, the software is provided "as is".
+## Have fun!
+
+## Processed-files manifest for incremental flattening. The manifest lives
+## in the output directory and records, for every raw TBFM SWIM file that
+## was flattened completely, its size, mtime, content hash, the output
+## options used and the outputs written. A rerun skips inputs that are
+## unchanged and redoes only new or changed ones. An entry is dropped
+## before its input is reprocessed and only written back once the outputs
+## have been renamed into place, so a crash never leaves an entry that
+## points at partial outputs.
+import hashlib
+import json
+import os
+
+###The following can be treated as static and immutable.
+MANIFEST_NAME="tbfm_flatten_manifest.json"
+MANIFEST_VERSION=1
+
+## Temporary suffix of outputs that are still being written
+TMP_SUFFIX=".tmp"
+
+HASH_CHUNK_BYTES=1<<20
+
+def manifest_path(out_dir):
+    return os.path.join(out_dir,MANIFEST_NAME)
+
+### Reads the manifest, an unreadable or missing one starts empty
+def load_manifest(out_dir):
+    try:
+        with open(manifest_path(out_dir)) as f:
+            manifest=json.load(f)
+    except (OSError,ValueError):
+        return {"version":MANIFEST_VERSION,"files":{}}
+    if manifest.get("version") != MANIFEST_VERSION:
+        return {"version":MANIFEST_VERSION,"files":{}}
+    return manifest
+
+### Atomically replaces the manifest on disk
+def save_manifest(out_dir,manifest):
+    outname=manifest_path(out_dir)
+    with open(outname+TMP_SUFFIX,"w") as f:
+        json.dump(manifest,f,indent=1,sort_keys=True)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(outname+TMP_SUFFIX,outname)
+
+def hash_file(full_path):
+    sha=hashlib.sha256()
+    with open(full_path,"rb") as f:
+        while True:
+            chunk=f.read(HASH_CHUNK_BYTES)
+            if not chunk:
+                break
+            sha.update(chunk)
+    return sha.hexdigest()
+
+##############################
+###
+###  Decides whether one input has to be (re)flattened. Size and mtime
+###  are checked first; only when they differ is the content hashed, so a
+###  touched but identical file is skipped too (its stat is refreshed).
+###  Returns (needed, entry) where entry describes the input as it is now.
+#############################
+def needs_processing(manifest,filename,full_path,options,outputs):
+    stat=os.stat(full_path)
+    ## Outputs are recorded relative to the output directory
+    entry={"size":stat.st_size,"mtime_ns":stat.st_mtime_ns,
+           "options":options,
+           "outputs":[os.path.basename(outname) for outname in outputs]}
+    old=manifest["files"].get(filename)
+    if old is None or old.get("options") != options or \
+       old.get("outputs") != entry["outputs"]:
+        entry["sha256"]=hash_file(full_path)
+        return True,entry
+    if not all(os.path.exists(outname) for outname in outputs):
+        entry["sha256"]=hash_file(full_path)
+        return True,entry
+    if old["size"] == entry["size"] and old["mtime_ns"] == entry["mtime_ns"]:
+        entry["sha256"]=old["sha256"]
+        return False,entry
+    entry["sha256"]=hash_file(full_path)
+    return entry["sha256"] != old["sha256"],entry
+
+### Renames finished temporary outputs to their final names
+def commit_outputs(outputs):
+    for outname in outputs:
+        os.replace(outname+TMP_SUFFIX,outname)
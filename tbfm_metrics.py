@@ -0,0 +1,176 @@
+##@Copyright 2020. Ulrich Linder, Al Capps
+##@Organization - aviationdatascience.org non-profit, through release from Penn State
+##@License - This work is licensed under MIT license - https://opensource.org/licenses/MIT
+## This permissive license lets you do basically whatever you want.
+## Per the details of the MIT license, the software is provided "as is".
+## Have fun!
+
+## Run metrics shared by the flattener, the daily summary and the dataset
+## step. Each run collects counters (lines, messages per type, fallbacks,
+## bytes, flights, ...), seconds per stage (decompress, parse, write, ...)
+## and the peak RSS, and with --metrics writes them to a .json or .csv
+## file so runs can be compared and regressions spotted. --profile starts
+## a small sampling profiler that writes collapsed stacks, the input
+## format of flamegraph.pl and speedscope.
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+try:
+    import resource
+except ImportError:
+    ## Not available on Windows, the peak RSS is left out there
+    resource=None
+
+###The following can be treated as static and immutable.
+METRICS_VERSION=1
+
+## Default time between profiler samples
+PROFILE_INTERVAL_SECS=0.005
+
+##############################
+###
+###  Counters and stage timers of one run. Worker processes fill plain
+###  dicts of the same shape (see new_stats) which are merged in here.
+#############################
+class RunMetrics:
+    def __init__(self,script):
+        self.script=script
+        self.started=time.time()
+        self.counters={}
+        self.timers={}
+
+    def count(self,name,num=1):
+        self.counters[name]=self.counters.get(name,0)+num
+
+    def add_time(self,name,secs):
+        self.timers[name]=self.timers.get(name,0.0)+secs
+
+    @contextlib.contextmanager
+    def timed(self,name):
+        start=time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name,time.perf_counter()-start)
+
+    ## Adds a stats dict, keys ending in _secs are timers
+    def merge(self,stats):
+        for name,value in stats.items():
+            if name.endswith("_secs"):
+                self.add_time(name[:-len("_secs")],value)
+            else:
+                self.count(name,value)
+
+    def as_dict(self):
+        return {"version":METRICS_VERSION,
+                "script":self.script,
+                "started":time.strftime("%Y-%m-%dT%H:%M:%SZ",
+                                        time.gmtime(self.started)),
+                "wall_secs":round(time.time()-self.started,3),
+                "peak_rss_mb":peak_rss_mb(),
+                "counters":dict(sorted(self.counters.items())),
+                "timers_secs":{name:round(secs,3) for name,secs in
+                               sorted(self.timers.items())}}
+
+    ## .csv gives metric,value rows, anything else JSON
+    def write(self,outname):
+        metrics=self.as_dict()
+        with open(outname,"w") as outF:
+            if outname.endswith(".csv"):
+                outF.write("metric,value\n")
+                for name in ("script","started","wall_secs","peak_rss_mb"):
+                    outF.write(name+","+str(metrics[name])+"\n")
+                for name,value in metrics["counters"].items():
+                    outF.write(name+","+str(value)+"\n")
+                for name,secs in metrics["timers_secs"].items():
+                    outF.write(name+"_secs,"+str(secs)+"\n")
+            else:
+                json.dump(metrics,outF,indent=1)
+                outF.write("\n")
+
+### Empty per-file stats for workers, merged later with RunMetrics.merge
+def new_stats(*timers):
+    return {name+"_secs":0.0 for name in timers}
+
+### Peak resident set size in MB of this process and its finished children
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak=max(peak,resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    ## Linux reports KB, macOS bytes
+    if sys.platform == "darwin":
+        return round(peak/1048576.0,1)
+    return round(peak/1024.0,1)
+
+##############################
+###
+###  Sampling profiler hook. A background thread looks at the stacks of
+###  the other threads of this process every interval and counts each
+###  distinct stack. The overhead does not grow with the number of calls
+###  the way cProfile's does, so it can run on production sized inputs.
+###  Pool worker processes are not sampled.
+#############################
+class SamplingProfiler:
+    def __init__(self,outname,interval=PROFILE_INTERVAL_SECS):
+        self.outname=outname
+        self.interval=interval
+        self.stacks={}
+        self.stopping=threading.Event()
+        self.thread=threading.Thread(target=self.run,daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def run(self):
+        own_id=threading.get_ident()
+        while not self.stopping.wait(self.interval):
+            for thread_id,frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack=[]
+                while frame is not None:
+                    code=frame.f_code
+                    stack.append(os.path.basename(code.co_filename)+":"+
+                                 code.co_name)
+                    frame=frame.f_back
+                key=";".join(reversed(stack))
+                self.stacks[key]=self.stacks.get(key,0)+1
+
+    ## Stops sampling and writes one "stack count" line per distinct stack
+    def stop(self):
+        self.stopping.set()
+        self.thread.join()
+        with open(self.outname,"w") as outF:
+            for stack,num in sorted(self.stacks.items(),
+                                    key=lambda item:-item[1]):
+                outF.write(stack+" "+str(num)+"\n")
+
+### Starts the profiler when an output name was given, else returns None
+def start_profiler(outname,interval=PROFILE_INTERVAL_SECS):
+    if not outname:
+        return None
+    return SamplingProfiler(outname,interval).start()
+
+### Stops the profiler and writes the metrics file, whichever are in use
+def finish_run(metrics,metrics_name,profiler):
+    if profiler is not None:
+        profiler.stop()
+    if metrics_name:
+        metrics.write(metrics_name)
+
+### The --metrics and --profile options every entry point takes
+def add_metrics_arguments(parser):
+    parser.add_argument("--metrics",
+                        help = "Write run metrics (counters, stage times, "+
+                        "peak RSS) to this .json or .csv file.")
+    parser.add_argument("--profile",
+                        help = "Sample the stacks of this process and "+
+                        "write collapsed stacks to this file.")
+    parser.add_argument("--profile-interval", type=float,
+                        default=PROFILE_INTERVAL_SECS,
+                        help = "Seconds between profiler samples.")
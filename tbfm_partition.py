@@ -0,0 +1,175 @@
+##@Copyright 2020. Ulrich Linder, Al Capps
+##@Organization - aviationdatascience.org non-profit, through release from Penn State
+##@License - This work is licensed under MIT license - https://opensource.org/licenses/MIT
+## This permissive license lets you do basically whatever you want.
+## Per the details of the MIT license, the software is provided "as is".
+## Have fun!
+
+## Airport partitioned outputs (--partition-by apt). Every study of one
+## airport used to read the whole national day. Partitioned, the rows of
+## each airport go to a directory of their own, apt=ATL/ (the value is
+## %-quoted, an empty one gives apt=/), under the usual file names. Next to
+## the partitions a small partition list records, for every value, the
+## file written, its rows and its bytes:
+##  - the flattener writes one per input (<input>_air.partitions.json) and
+##    at the end of the run gathers them into tbfm_partitions.json,
+##    which also lists the inputs so missing hours can still be told
+##    from hours without traffic at an airport
+##  - the summary writes one per day (<day summary>.partitions.json)
+## A reader picks its airports from the list and opens only those files.
+## The flight key holds apt, so no flight is split across partitions: the
+## summary of one partition is the national summary's rows of that
+## airport, in the same order. Read whole, the partitions give the national
+## rows grouped by airport (in value order), not in the national summary's
+## order of first appearance.
+import json
+import os
+from urllib.parse import quote
+from urllib.parse import unquote
+from tbfm_manifest import TMP_SUFFIX
+
+###The following can be treated as static and immutable.
+PARTITION_SUFFIX=".partitions.json"
+PARTITION_MANIFEST="tbfm_partitions.json"
+PARTITION_VERSION=1
+
+## Columns outputs can be partitioned on
+PARTITION_COLUMNS=("apt",)
+
+def partition_dir(column,value):
+    return column+"="+quote(value,safe="")
+
+def partition_value(dir_name):
+    return unquote(dir_name.split("=",1)[1])
+
+### The airports of an --airport option, given repeatedly or comma separated
+def parse_airports(airports):
+    if not airports:
+        return None
+    return [airport for option in airports for airport in option.split(",")
+            if airport]
+
+##############################
+###
+###  Air writer of one input file that hands every row to the writer of
+###  its partition. open_writer(path) opens the format's writer (header
+###  included) for a new partition file; it is written under a temporary
+###  name and renamed when closed. close() then writes the partition list
+###  of the input to list_name, which the flattener commits with the
+###  other outputs, so the list only exists once all partitions do.
+#############################
+class PartitionedAirWriter:
+    def __init__(self,out_dir,filename,suffix,list_name,open_writer,
+                 column="apt"):
+        self.out_dir=out_dir
+        self.filename=filename
+        self.suffix=suffix
+        self.list_name=list_name
+        self.open_writer=open_writer
+        self.column=column
+        self.writers={}
+        self.rows={}
+
+    def write_row(self,msgtime,aid,tmaid,dap,apt,values):
+        writer=self.writers.get(apt)
+        if writer is None:
+            writer=self.open_partition(apt)
+        writer.write_row(msgtime,aid,tmaid,dap,apt,values)
+        self.rows[apt]+=1
+
+    def open_partition(self,value):
+        part_dir=os.path.join(self.out_dir,partition_dir(self.column,value))
+        os.makedirs(part_dir,exist_ok=True)
+        writer=self.open_writer(self.partition_path(value)+TMP_SUFFIX)
+        self.writers[value]=writer
+        self.rows[value]=0
+        return writer
+
+    def partition_path(self,value):
+        return os.path.join(self.out_dir,partition_dir(self.column,value),
+                            self.filename+self.suffix)
+
+    def close(self):
+        partitions={}
+        for value,writer in self.writers.items():
+            writer.close()
+            path=self.partition_path(value)
+            os.replace(path+TMP_SUFFIX,path)
+            partitions[value]={"path":os.path.relpath(path,self.out_dir),
+                               "rows":self.rows[value],
+                               "bytes":os.path.getsize(path)}
+        write_partition_list(self.list_name,self.column,partitions)
+
+def write_partition_list(list_name,column,partitions):
+    with open(list_name,"w") as f:
+        json.dump({"version":PARTITION_VERSION,"column":column,
+                   "partitions":partitions},f,indent=1,sort_keys=True)
+
+def load_partition_list(list_name):
+    with open(list_name) as f:
+        partition_list=json.load(f)
+    if partition_list.get("version") != PARTITION_VERSION:
+        raise ValueError("Unsupported partition list version in "+list_name)
+    return partition_list
+
+### Bytes of all partition files in a partition list
+def partition_bytes(list_name):
+    partition_list=load_partition_list(list_name)
+    return sum(partition["bytes"]
+               for partition in partition_list["partitions"].values())
+
+##############################
+###
+###  Gathers the partition lists of all inputs flattened into out_dir into
+###  tbfm_partitions.json: the inputs, and per value the files in input
+###  name order with their total rows and bytes. Rebuilt from the per-input
+###  lists after every run, so --incremental runs keep it complete.
+#############################
+def update_partition_manifest(out_dir):
+    inputs=[]
+    column=None
+    partitions={}
+    for list_file in sorted(os.listdir(out_dir)):
+        if not list_file.endswith("_air"+PARTITION_SUFFIX):
+            continue
+        partition_list=load_partition_list(os.path.join(out_dir,list_file))
+        column=partition_list["column"]
+        inputs.append(list_file[:-len("_air"+PARTITION_SUFFIX)])
+        for value,partition in partition_list["partitions"].items():
+            total=partitions.setdefault(value,{"files":[],"rows":0,
+                                               "bytes":0})
+            total["files"].append(partition["path"])
+            total["rows"]+=partition["rows"]
+            total["bytes"]+=partition["bytes"]
+    manifest={"version":PARTITION_VERSION,"column":column,"inputs":inputs,
+              "partitions":partitions}
+    outname=os.path.join(out_dir,PARTITION_MANIFEST)
+    with open(outname+TMP_SUFFIX,"w") as f:
+        json.dump(manifest,f,indent=1,sort_keys=True)
+    os.replace(outname+TMP_SUFFIX,outname)
+    return manifest
+
+### The manifest of a partitioned flatten directory, None when it is not one
+def load_partition_manifest(read_dir):
+    manifest_name=os.path.join(read_dir,PARTITION_MANIFEST)
+    if not os.path.exists(manifest_name):
+        return None
+    return load_partition_list(manifest_name)
+
+### Files of the given partition values (all when values is None),
+### relative to the directory of the list, and the values not found
+def partition_files(partition_list,values=None):
+    partitions=partition_list["partitions"]
+    if values is None:
+        values=sorted(partitions)
+    files=[]
+    missing=[]
+    for value in values:
+        partition=partitions.get(value)
+        if partition is None:
+            missing.append(value)
+        elif "files" in partition:
+            files.extend(partition["files"])
+        else:
+            files.append(partition["path"])
+    return files,missing
@@ -0,0 +1,161 @@
+##@Copyright 2020. Ulrich Linder, Al Capps
+##@Organization - aviationdatascience.org non-profit, through release from Penn State
+##@License - This work is licensed under MIT license - https://opensource.org/licenses/MIT
+## This permissive license lets you do basically whatever you want.
+## Per the details of the MIT license, the software is provided "as is".
+## Have fun!
+
+## Replays recorded raw TBFM SWIM files (.xml.gz) as a live feed for
+## testing tbfm_stream.py. The lines are sent in file name order, each
+## message at the time its capture timestamp says, sped up --speed times
+## (0 sends as fast as the receiver takes them). The feed goes to a TCP
+## (--connect) or Unix (--unix) socket, is appended to a growing file
+## (--append, for --tail) or written to stdout (for --pipe -). Writes wait
+## for the receiver, so when it falls behind the replay does too; how far
+## it fell behind the schedule is reported at the end.
+import argparse
+import asyncio
+import gzip
+import os
+import sys
+import time
+from tbfm_time import parse_zulu
+from tbfm_stream import CAPTURE_PREFIX
+from tbfm_stream import split_address
+
+###The following can be treated as static and immutable.
+## Lines are collected and written together when not waiting for their time
+SEND_BATCH_BYTES=1<<16
+
+## A wait shorter than this is not worth a sleep, the lines go out now
+MIN_SLEEP_SECS=0.005
+
+### Writes to a file or stdout with the same write/drain calls as a socket
+class FileSink:
+    def __init__(self,outF):
+        self.outF=outF
+
+    def write(self,data):
+        self.outF.write(data)
+
+    async def drain(self):
+        self.outF.flush()
+
+    def close(self):
+        if self.outF is not sys.stdout.buffer:
+            self.outF.close()
+
+async def open_sink():
+    if parms["connect"]:
+        host,port=split_address(parms["connect"])
+        reader,writer=await asyncio.open_connection(host,port)
+        return writer
+    if parms["unix"]:
+        reader,writer=await asyncio.open_unix_connection(parms["unix"])
+        return writer
+    if parms["append"]:
+        return FileSink(open(parms["append"],"ab"))
+    return FileSink(sys.stdout.buffer)
+
+### The raw files to replay: the given files, and the .xml.gz files of
+### given directories, in name order
+def replay_files(paths):
+    full_paths=[]
+    for path in paths:
+        if os.path.isdir(path):
+            full_paths.extend(os.path.join(path,filename)
+                              for filename in os.listdir(path)
+                              if filename.endswith(".xml.gz") and
+                              filename.count(".xml.gz") == 1)
+        else:
+            full_paths.append(path)
+    return sorted(full_paths,key=os.path.basename)
+
+##############################
+###
+###  Sends every line at start + (capture time - first capture time) /
+###  speed. Lines that are due are collected into one write, then the
+###  write is drained (this is where a slow receiver holds us up) and the
+###  replay sleeps until the next capture is due.
+#############################
+async def replay(full_paths,sink):
+    speed=parms["speed"]
+    first_capture=None
+    start=time.monotonic()
+    pending=[]
+    pending_bytes=0
+    num_lines=0
+    max_behind=0.0
+    for full_path in full_paths:
+        print("Replaying "+full_path,file=sys.stderr,flush=True)
+        with gzip.open(full_path,"rb") as f:
+            for line in f:
+                if speed > 0 and line.startswith(CAPTURE_PREFIX.encode()):
+                    capture=parse_zulu(line[len(CAPTURE_PREFIX):]
+                                       .strip().decode())
+                    if first_capture is None:
+                        first_capture=capture
+                    due=start+(capture-first_capture)/speed
+                    wait=due-time.monotonic()
+                    if wait > MIN_SLEEP_SECS:
+                        if pending:
+                            sink.write(b"".join(pending))
+                            pending=[]
+                            pending_bytes=0
+                            await sink.drain()
+                        await asyncio.sleep(due-time.monotonic())
+                    else:
+                        max_behind=max(max_behind,-wait)
+                pending.append(line)
+                pending_bytes+=len(line)
+                num_lines+=1
+                if pending_bytes >= SEND_BATCH_BYTES:
+                    sink.write(b"".join(pending))
+                    pending=[]
+                    pending_bytes=0
+                    await sink.drain()
+    if pending:
+        sink.write(b"".join(pending))
+        await sink.drain()
+    sink.close()
+    return num_lines,time.monotonic()-start,max_behind
+
+def main():
+
+    full_paths=replay_files(parms["paths"])
+    async def run():
+        sink=await open_sink()
+        return await replay(full_paths,sink)
+    num_lines,secs,max_behind=asyncio.run(run())
+    print("Sent "+str(num_lines)+" lines in "+str(round(secs,2))+" secs ("+
+          str(round(num_lines/max(secs,1e-9),1))+" lines/sec), at most "+
+          str(round(max_behind,3))+" secs behind schedule",
+          file=sys.stderr,flush=True)
+
+def build_parms(args):
+    """Helper function to parse command line arguments into dictionary
+        input: ArgumentParser class object
+        output: dictionary of expected parameters
+    """
+    parms = {"paths":args.paths,
+             "speed":args.speed,
+             "connect":args.connect,
+             "unix":args.unix,
+             "append":args.append}
+    return(parms)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = \
+                 "Replay recorded raw TBFM SWIM files as a live feed.")
+    parser.add_argument("paths", nargs="+",
+                        help = "Raw .xml.gz files or directories of them.")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help = "Times real time, 0 for as fast as possible.")
+    target=parser.add_mutually_exclusive_group()
+    target.add_argument("--connect", help = "HOST:PORT to send to.")
+    target.add_argument("--unix", help = "Unix socket to send to.")
+    target.add_argument("--append",
+                        help = "File to append to (default: stdout).")
+    parms = build_parms(parser.parse_args())
+    main()
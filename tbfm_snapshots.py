@@ -0,0 +1,98 @@
+##@Copyright 2020. Ulrich Linder, Al Capps
+##@Organization - aviationdatascience.org non-profit, through release from Penn State
+##@License - This work is licensed under MIT license - https://opensource.org/licenses/MIT
+## This permissive license lets you do basically whatever you want.
+## Per the details of the MIT license, the software is provided "as is".
+## Have fun!
+
+## Delta snapshots of the daily flight summary. With --snapshot-interval
+## the summary walks the day's messages once and, at every tick, writes
+## the summary row of each flight that changed since the previous tick.
+## The state of every flight at a tick is the last row written for it at
+## or before that tick, which is what rebuild_snapshot reads back. A tick
+## covers the messages before it, so the 07:15 snapshot is the summary as
+## it would have been made from the messages up to 07:14:59.999.
+import argparse
+import gzip
+import sys
+from tbfm_columnar import SUMMARY_COLUMNS
+
+###The following can be treated as static and immutable.
+SNAPSHOT_SUFFIX="_tbfm_swim_flightsummary_AIR_snapshots.csv.gz"
+
+SNAPSHOT_COLUMNS=('snapshottime',)+SUMMARY_COLUMNS
+
+### Writes the changed flights of each tick, one gzip CSV per day
+class SnapshotWriter:
+    def __init__(self,outname,compresslevel=6):
+        self.outF=gzip.open(outname,"wt",compresslevel=compresslevel)
+        self.outF.write(",".join(SNAPSHOT_COLUMNS)+"\n")
+
+    def write_tick(self,tick,rows):
+        self.outF.write("".join(tick+","+",".join(row)+"\n" for row in rows))
+
+    def close(self):
+        self.outF.close()
+
+### Yields (snapshottime, summary row) of a snapshot file in file order
+def read_snapshot_rows(full_path):
+    with gzip.open(full_path,"rt") as f:
+        f.readline()
+        for line in f:
+            result=line.rstrip("\n").split(",")
+            yield result[0],result[1:]
+
+### The ticks present in a snapshot file, i.e. the ones where a flight changed
+def snapshot_ticks(full_path):
+    ticks=[]
+    for tick,row in read_snapshot_rows(full_path):
+        if not ticks or ticks[-1] != tick:
+            ticks.append(tick)
+    return ticks
+
+##############################
+###
+###  Rebuilds the full flight table at a tick (a Zulu time like
+###  2019-11-01T09:30:00Z) from the deltas: the last row of every flight
+###  written at or before it. Rows come back in the order the summary
+###  lists flights (first appearance). Ticks are compared as text, they
+###  all share one layout.
+#############################
+def rebuild_snapshot(full_path,tick):
+    flights={}
+    for row_tick,row in read_snapshot_rows(full_path):
+        if row_tick > tick:
+            break
+        flights[tuple(row[1:5])]=row
+    return list(flights.values())
+
+def main():
+
+    rows=rebuild_snapshot(parms["readFile"],parms["tick"])
+    outF=sys.stdout
+    outF.write(",".join(SUMMARY_COLUMNS)+"\n")
+    for row in rows:
+        outF.write(",".join(row)+"\n")
+    outF.flush()
+
+def build_parms(args):
+    """Helper function to parse command line arguments into dictionary
+        input: ArgumentParser class object
+        output: dictionary of expected parameters
+    """
+    parms = {"readFile":args.file,
+             "tick":args.tick}
+    return(parms)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = \
+                 "Print the flight summary at one snapshot tick.")
+    parser.add_argument("file",
+                        help = "Snapshot file written with "+
+                        "--snapshot-interval.")
+    parser.add_argument("tick",
+                        help = "Zulu time of the tick, e.g. "+
+                        "2019-11-01T09:30:00Z.")
+    parms = build_parms(parser.parse_args())
+    main()
@@ -0,0 +1,543 @@
+##@Copyright 2020. Ulrich Linder, Al Capps
+##@Organization - aviationdatascience.org non-profit, through release from Penn State
+##@License - This work is licensed under MIT license - https://opensource.org/licenses/MIT
+## This permissive license lets you do basically whatever you want.
+## Per the details of the MIT license, the software is provided "as is".
+## Have fun!
+
+## Streaming version of the daily summary, for a summary during the day
+## instead of after the 0600Z file closes. Raw SWIM lines (the same
+## capture-timestamp / b'...' layout as the recorded files, or bare XML
+## messages) are read as they arrive from a growing file (--tail), a pipe
+## or FIFO (--pipe, "-" is stdin) or local sockets (--listen, --unix).
+## Air messages are parsed with the flattener's extraction and applied to
+## the flight table with the summary's update_flight, so the result is
+## the loop engine's. Every --write-secs the current summary is written
+## (atomically) as the usual <date>_tbfm_swim_flightsummary_AIR_out.csv
+## and, with --serve, handed out over HTTP. A message is in the written
+## summary at most about --write-secs plus its time in the queue after
+## it was read. The local day is taken from the capture timestamps (the
+## msgtime when there are none): at the first message of the next day
+## the finished day is written a last time and a new table is started.
+## Readers stop reading while the bounded queue is full, which pushes
+## back on socket and pipe writers. tbfm_replay.py feeds recorded files.
+## An air message that cannot be parsed is logged with its capture time,
+## counted (parse_failures) and skipped, a capture timestamp that is no
+## Zulu time gives way to the msgtime. Any other error of the consumer or
+## of a write stops the stream and exits non-zero rather than leaving the
+## readers waiting on a queue nobody empties. Summaries are written one at
+## a time (write_lock), each under a temporary name of its own.
+import argparse
+import asyncio
+import functools
+import json
+import os
+import signal
+import sys
+import tempfile
+import time
+from datetime import datetime
+from datetime import timedelta
+from tbfm_extract import extract_air
+from create_daily_TBFM_summary import update_flight
+from create_daily_TBFM_summary import flight_row
+from create_daily_TBFM_summary import write_summary_csv
+from tbfm_columnar import SUMMARY_COLUMNS
+from tbfm_metrics import RunMetrics
+from tbfm_metrics import start_profiler
+from tbfm_metrics import finish_run
+from tbfm_metrics import add_metrics_arguments
+
+###The following can be treated as static and immutable.
+## Bytes read from a source at a time, its lines are queued as one batch
+READ_CHUNK_BYTES=1<<16
+
+## Batches allowed in the queue before the readers have to wait
+QUEUE_BATCHES=64
+
+## The local day starts at 0700Z
+DAY_START_HOURS=7
+
+CAPTURE_PREFIX="capture-timestamp:"
+
+### YYYYMMDD local day of a Zulu time, looked up per hour
+@functools.lru_cache(maxsize=1024)
+def local_day(hour_stamp):
+    hour=datetime.strptime(hour_stamp,"%Y-%m-%dT%H")
+    return (hour-timedelta(hours=DAY_START_HOURS)).strftime("%Y%m%d")
+
+##############################
+###
+###  Cuts the chunks read from one source into lines and pairs each
+###  message line with the capture timestamp line before it. The last,
+###  unfinished line is kept for the next chunk.
+#############################
+class LineSplitter:
+    def __init__(self):
+        self.rest=b""
+        self.capture=None
+
+    def feed(self,data):
+        data=self.rest+data
+        end=data.rfind(b"\n")+1
+        self.rest=data[end:]
+        return self.pair_lines(data[:end])
+
+    ## Whatever is left at the end of the source
+    def finish(self):
+        data=self.rest
+        self.rest=b""
+        return self.pair_lines(data)
+
+    def pair_lines(self,data):
+        messages=[]
+        for line in data.decode(errors="replace").splitlines():
+            if line.startswith(CAPTURE_PREFIX):
+                self.capture=line[len(CAPTURE_PREFIX):].strip()
+            elif line:
+                messages.append((self.capture,line))
+                self.capture=None
+        return messages
+
+##############################
+###
+###  The flight table of the day being streamed. Lines are classified
+###  like split_messages, air messages parsed with extract_air and rows
+###  fed to update_flight like the loop engine reads them. A message that
+###  fails there is skipped, see parse_failed.
+#############################
+class StreamSummary:
+    def __init__(self,out_dir,metrics):
+        self.out_dir=out_dir
+        self.metrics=metrics
+        self.day=None
+        self.flights={}
+        self.changed=False
+        ## Last summary written, for --serve
+        self.csv_data=(",".join(SUMMARY_COLUMNS)+"\n").encode()
+        self.last_write=None
+        ## Days finished by roll_over, (day, rows) waiting for write_finished
+        self.finished=[]
+        self.write_lock=asyncio.Lock()
+
+    def add_lines(self,messages):
+        for capture,line in messages:
+            if line.startswith("b'"):
+                line=line[2:]
+            if "airType=" not in line:
+                continue
+            try:
+                msgtime,aid,tmaid,dap,apt,values=extract_air(line)
+            except Exception as e:
+                self.parse_failed(capture,e)
+                continue
+            self.metrics.count("messages_air")
+            try:
+                day=self.message_day(capture,msgtime)
+            except ValueError as e:
+                self.parse_failed(capture,e)
+                continue
+            if day is None:
+                pass
+            elif self.day is None:
+                self.day=day
+            elif day > self.day:
+                self.roll_over(day)
+            row=(msgtime,aid,tmaid,dap,apt,*values)
+            ## Same columns as the flattened CSV line would give
+            line=",".join(row)
+            if line.count(",") != len(row)-1:
+                row=line.split(",")
+            try:
+                update_flight(self.flights,row)
+            except Exception as e:
+                self.parse_failed(capture or msgtime,e)
+                continue
+            self.changed=True
+
+    ## Local day of the capture timestamp, of the msgtime when there is
+    ## none or it is no Zulu time. None without either (nothing to tell the
+    ## day by), ValueError when the msgtime is no Zulu time either.
+    def message_day(self,capture,msgtime):
+        if capture and len(capture) >= 13:
+            try:
+                return local_day(capture[:13])
+            except ValueError:
+                self.metrics.count("capture_fallbacks")
+        if len(msgtime) >= 13:
+            return local_day(msgtime[:13])
+        return None
+
+    def parse_failed(self,capture,error):
+        self.metrics.count("parse_failures")
+        print("Skipped the air message captured at "+str(capture)+": "+
+              type(error).__name__+": "+str(error),flush=True)
+
+    ## The previous day is complete, keep its rows for write_finished and
+    ## start over
+    def roll_over(self,day):
+        self.finished.append((self.day,self.current_rows()))
+        print("Finished "+self.day+" with "+str(len(self.flights))+
+              " flights",flush=True)
+        self.metrics.count("days")
+        self.day=day
+        self.flights={}
+        self.changed=False
+
+    def current_rows(self):
+        return [flight_row(value) for value in self.flights.values()]
+
+    def summary_name(self,day):
+        return os.path.join(self.out_dir,day+
+                            "_tbfm_swim_flightsummary_AIR_out.csv")
+
+    ## Writes the days roll_over finished. Behind write_lock, a periodic
+    ## write of the same day still running ends first and cannot replace
+    ## the finished day with an older snapshot.
+    async def write_finished(self):
+        while self.finished:
+            day,rows=self.finished.pop(0)
+            async with self.write_lock:
+                await asyncio.to_thread(self.write_rows,day,rows)
+
+    ## Writes the current day (only when it changed with changed_only) off
+    ## the event loop, the rows are built here. Returns whether it wrote.
+    async def write_day(self,changed_only=False):
+        async with self.write_lock:
+            if self.day is None or (changed_only and not self.changed):
+                return False
+            self.changed=False
+            await asyncio.to_thread(self.write_rows,self.day,
+                                    self.current_rows())
+            return True
+
+    ## Writes under a temporary name first so readers never see half a file
+    def write_rows(self,day,rows):
+        start=time.perf_counter()
+        outname=self.summary_name(day)
+        fd,tmpname=tempfile.mkstemp(dir=self.out_dir,suffix=".tmp",
+                                    prefix=os.path.basename(outname)+".")
+        os.close(fd)
+        try:
+            write_summary_csv(rows,tmpname)
+            ## mkstemp makes it readable by its owner only
+            os.chmod(tmpname,0o644)
+            os.replace(tmpname,outname)
+        except Exception:
+            os.remove(tmpname)
+            raise
+        with open(outname,"rb") as f:
+            self.csv_data=f.read()
+        self.last_write=time.time()
+        self.metrics.count("writes")
+        self.metrics.add_time("write",time.perf_counter()-start)
+
+### What the readers, the consumer and the writer share
+class StreamState:
+    def __init__(self,queue_batches):
+        self.queue=asyncio.Queue(maxsize=queue_batches)
+        self.stopping=asyncio.Event()
+        self.last_data=time.monotonic()
+        self.max_delay=0.0
+        self.backpressure_waits=0
+        ## Set when the consumer or the writer ended with an error
+        self.failed=False
+
+    ## Queues one batch of (capture, line) pairs, waits while it is full.
+    ## Once the stream is stopping the batch is dropped instead, nothing
+    ## may be left to empty the queue.
+    async def put(self,messages):
+        if not messages or self.stopping.is_set():
+            return
+        self.last_data=time.monotonic()
+        item=(time.monotonic(),messages)
+        if not self.queue.full():
+            self.queue.put_nowait(item)
+            return
+        self.backpressure_waits+=1
+        put=asyncio.ensure_future(self.queue.put(item))
+        stop=asyncio.ensure_future(self.stopping.wait())
+        await asyncio.wait((put,stop),return_when=asyncio.FIRST_COMPLETED)
+        put.cancel()
+        stop.cancel()
+
+    ## Done-callback of the consumer and writer tasks: an error stops the
+    ## stream
+    def task_done(self,name,task):
+        if task.cancelled() or task.exception() is None:
+            return
+        error=task.exception()
+        print(name+" failed, stopping: "+type(error).__name__+": "+
+              str(error),flush=True)
+        self.failed=True
+        self.stopping.set()
+
+##############################
+###
+###  Sources. Each reads chunks, cuts them into lines and queues them.
+#############################
+async def read_stream(reader,transport,state):
+    lines=LineSplitter()
+    watcher=asyncio.create_task(close_when_stopping(transport,state))
+    try:
+        while True:
+            data=await reader.read(READ_CHUNK_BYTES)
+            if not data:
+                break
+            await state.put(lines.feed(data))
+        await state.put(lines.finish())
+    finally:
+        watcher.cancel()
+
+## Closing the transport ends a read that is waiting for data
+async def close_when_stopping(transport,state):
+    await state.stopping.wait()
+    transport.close()
+
+### A pipe, FIFO or stdin ("-"), read until its writer closes it
+async def pipe_source(path,state):
+    loop=asyncio.get_running_loop()
+    if path == "-":
+        pipe=sys.stdin.buffer
+    else:
+        ## Opening a FIFO waits for a writer
+        pipe=await asyncio.to_thread(open,path,"rb")
+    reader=asyncio.StreamReader(limit=READ_CHUNK_BYTES)
+    transport,protocol=await loop.connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader),pipe)
+    try:
+        await read_stream(reader,transport,state)
+    finally:
+        transport.close()
+    print("End of "+path,flush=True)
+
+### A growing file, followed until the stream stops. A file that is
+### replaced or truncated (rotated) is read again from its start.
+async def tail_source(path,state,poll_secs):
+    f=None
+    lines=LineSplitter()
+    while not state.stopping.is_set():
+        if f is None:
+            try:
+                f=open(path,"rb")
+            except FileNotFoundError:
+                await asyncio.sleep(poll_secs)
+                continue
+            inode=os.fstat(f.fileno()).st_ino
+            lines=LineSplitter()
+        data=f.read(READ_CHUNK_BYTES)
+        if data:
+            await state.put(lines.feed(data))
+            ## Let the consumer run between chunks
+            await asyncio.sleep(0)
+            continue
+        try:
+            stat=os.stat(path)
+            if stat.st_ino != inode or stat.st_size < f.tell():
+                f.close()
+                f=None
+                continue
+        except FileNotFoundError:
+            pass
+        await asyncio.sleep(poll_secs)
+    if f is not None:
+        f.close()
+
+### TCP (HOST:PORT) or Unix socket server, every connection is a source
+async def socket_source(address,state,unix=False):
+    async def handle(reader,writer):
+        try:
+            await read_stream(reader,writer.transport,state)
+        finally:
+            writer.close()
+
+    if unix:
+        server=await asyncio.start_unix_server(handle,address,
+                                               limit=READ_CHUNK_BYTES)
+    else:
+        host,port=split_address(address)
+        server=await asyncio.start_server(handle,host,port,
+                                          limit=READ_CHUNK_BYTES)
+    print("Listening on "+address,flush=True)
+    async with server:
+        await state.stopping.wait()
+
+def split_address(address):
+    host,port=address.rsplit(":",1)
+    return host or "127.0.0.1",int(port)
+
+##############################
+###
+###  Consumer. Applies the queued batches to the flight table. Parsing
+###  runs on the event loop, so it yields after every batch.
+#############################
+async def consume(state,summary,metrics):
+    while True:
+        item=await state.queue.get()
+        if item is None:
+            return
+        received,messages=item
+        start=time.perf_counter()
+        try:
+            summary.add_lines(messages)
+        finally:
+            metrics.add_time("parse",time.perf_counter()-start)
+            await summary.write_finished()
+        metrics.count("lines",len(messages))
+        state.max_delay=max(state.max_delay,time.monotonic()-received)
+        await asyncio.sleep(0)
+
+### Writes the current summary every write_secs, when something changed
+async def write_summaries(state,summary,write_secs,idle_exit):
+    while not state.stopping.is_set():
+        try:
+            await asyncio.wait_for(state.stopping.wait(),write_secs)
+        except asyncio.TimeoutError:
+            pass
+        ## After a consumer error the table may be half updated, the last
+        ## summary written stays as it is
+        if not state.failed and await summary.write_day(changed_only=True):
+            print("Wrote "+str(len(summary.flights))+" flights of "+
+                  summary.day+", queue "+str(state.queue.qsize())+
+                  " batches, max queue delay "+
+                  str(round(state.max_delay,3))+" secs",flush=True)
+            state.max_delay=0.0
+        if idle_exit and time.monotonic()-state.last_data > idle_exit:
+            print("No data for "+str(idle_exit)+" secs, stopping",flush=True)
+            state.stopping.set()
+
+### Minimal HTTP server: / gives the last written summary CSV, /status JSON
+async def serve_summary(address,state,summary):
+    async def handle(reader,writer):
+        try:
+            request=await reader.readline()
+            while (await reader.readline()).strip():
+                pass
+            parts=request.decode(errors="replace").split()
+            if len(parts) > 1 and parts[1] == "/status":
+                body=json.dumps({"day":summary.day,
+                                 "flights":len(summary.flights),
+                                 "parse_failures":summary.metrics.counters
+                                 .get("parse_failures",0),
+                                 "failed":state.failed,
+                                 "last_write":summary.last_write,
+                                 "queue_batches":state.queue.qsize(),
+                                 "backpressure_waits":
+                                 state.backpressure_waits}).encode()
+                content_type="application/json"
+            else:
+                body=summary.csv_data
+                content_type="text/csv"
+            writer.write(("HTTP/1.0 200 OK\r\nContent-Type: "+content_type+
+                          "\r\nContent-Length: "+str(len(body))+
+                          "\r\n\r\n").encode()+body)
+            await writer.drain()
+        finally:
+            writer.close()
+
+    host,port=split_address(address)
+    server=await asyncio.start_server(handle,host,port)
+    print("Serving the summary on "+address,flush=True)
+    async with server:
+        await state.stopping.wait()
+
+async def run_stream(metrics):
+    state=StreamState(parms["queue_batches"])
+    summary=StreamSummary(parms["outdir"],metrics)
+    loop=asyncio.get_running_loop()
+    for signum in (signal.SIGINT,signal.SIGTERM):
+        loop.add_signal_handler(signum,state.stopping.set)
+
+    sources=[pipe_source(path,state) for path in parms["pipes"]]
+    sources+=[tail_source(path,state,parms["poll_secs"])
+              for path in parms["tails"]]
+    sources+=[socket_source(address,state) for address in parms["listen"]]
+    sources+=[socket_source(path,state,unix=True) for path in parms["unix"]]
+    if parms["serve"]:
+        sources.append(serve_summary(parms["serve"],state,summary))
+
+    consumer=asyncio.create_task(consume(state,summary,metrics))
+    consumer.add_done_callback(functools.partial(state.task_done,"Consumer"))
+    writer=asyncio.create_task(write_summaries(state,summary,
+                                               parms["write_secs"],
+                                               parms["idle_exit"]))
+    writer.add_done_callback(functools.partial(state.task_done,"Writer"))
+    ## Pipes end on their own, the other sources run until stopped
+    await asyncio.gather(*sources)
+    state.stopping.set()
+    if not consumer.done():
+        await state.queue.put(None)
+    ## Their errors are reported by task_done
+    await asyncio.wait((consumer,writer))
+    if not state.failed and await summary.write_day():
+        print("Wrote "+str(len(summary.flights))+" flights of "+summary.day,
+              flush=True)
+    metrics.count("flights",len(summary.flights))
+    metrics.count("backpressure_waits",state.backpressure_waits)
+    return state.failed
+
+def main():
+
+    metrics=RunMetrics("tbfm_stream")
+    profiler=start_profiler(parms["profile"],parms["profile_interval"])
+    os.makedirs(parms["outdir"],exist_ok=True)
+    failed=asyncio.run(run_stream(metrics))
+    finish_run(metrics,parms["metrics"],profiler)
+    if failed:
+        sys.exit(1)
+
+def build_parms(args):
+    """Helper function to parse command line arguments into dictionary
+        input: ArgumentParser class object
+        output: dictionary of expected parameters
+    """
+    parms = {"pipes":args.pipe,
+             "tails":args.tail,
+             "listen":args.listen,
+             "unix":args.unix,
+             "serve":args.serve,
+             "outdir":args.outdir,
+             "write_secs":args.write_secs,
+             "poll_secs":args.poll_secs,
+             "idle_exit":args.idle_exit,
+             "queue_batches":args.queue_batches,
+             "metrics":args.metrics,
+             "profile":args.profile,
+             "profile_interval":args.profile_interval}
+    return(parms)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = \
+                 "Keep the daily TBFM summary up to date from a live feed.")
+    parser.add_argument("--pipe", action="append", default=[],
+                        help = "Pipe or FIFO to read, - for stdin. "+
+                        "Repeatable.")
+    parser.add_argument("--tail", action="append", default=[],
+                        help = "Growing raw file to follow. Repeatable.")
+    parser.add_argument("--listen", action="append", default=[],
+                        help = "HOST:PORT to accept feed connections on. "+
+                        "Repeatable.")
+    parser.add_argument("--unix", action="append", default=[],
+                        help = "Unix socket path to accept feed "+
+                        "connections on. Repeatable.")
+    parser.add_argument("--serve",
+                        help = "HOST:PORT to serve the current summary "+
+                        "(CSV at /, JSON at /status) on.")
+    parser.add_argument("--outdir", default = "./")
+    parser.add_argument("--write-secs", type=float, default=30.0,
+                        help = "Seconds between summary writes.")
+    parser.add_argument("--poll-secs", type=float, default=0.5,
+                        help = "How often --tail looks for new data.")
+    parser.add_argument("--idle-exit", type=float, default=0,
+                        help = "Stop after this many seconds without data "+
+                        "(default: run until interrupted).")
+    parser.add_argument("--queue-batches", type=int, default=QUEUE_BATCHES,
+                        help = "Batches of lines read ahead before readers "+
+                        "wait.")
+    add_metrics_arguments(parser)
+    args=parser.parse_args()
+    if not (args.pipe or args.tail or args.listen or args.unix):
+        parser.error("give at least one --pipe, --tail, --listen or --unix")
+    parms = build_parms(args)
+    main()
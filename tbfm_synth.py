@@ -0,0 +1,273 @@
+##@Copyright 2020. Ulrich Linder, Al Capps
+##@Organization - aviationdatascience.org non-profit, through release from Penn State
+##@License - This work is licensed under MIT license - https://opensource.org/licenses/MIT
+## This permissive license lets you do basically whatever you want.
+## Per the details of the MIT license, the software is provided "as is".
+## Have fun!
+
+## Synthetic TBFM SWIM generator. Production captures cannot be shared, so
+## this writes hourly raw files laid out like the real ones: a
+## capture-timestamp line before every message and the message itself
+## wrapped as b'...'. Flights appear at a steady rate, stay active for one
+## to a few hours and send air updates every --update-secs or so. Each
+## update carries the identity fields and a few of the others, ETAs drift
+## and acs goes PROPOSED, ACTIVE, LANDED. Departures get an STD (APREQ)
+## that is re-sent with every update and changed now and then
+## (--std-churn). con, adp and oth messages are mixed in at the given
+## shares. The same seed always gives the same files.
+import argparse
+import gzip
+import heapq
+import os
+import random
+from datetime import datetime
+from datetime import timedelta
+from tbfm_extract import AIR_FIELDS
+
+###The following can be treated as static and immutable.
+AIRPORTS=("ATL","BOS","BWI","CLT","DCA","DEN","DFW","EWR","IAD","JFK",
+          "LGA","MIA","ORD","PHL","PIT","RDU")
+CENTERS=("ZDC","ZNY","ZBW","ZJX","ZOB","ZTL","ZID")
+AIRLINES=("AAL","DAL","UAL","SWA","JBU","RPA","EDV","ASA")
+AIRCRAFT_TYPES=("B738","A320","A321","E75L","CRJ9","B739","A319","B712")
+RUNWAYS=("01L","01R","19L","19R","04","22","15","33")
+CATEGORIES=("ARRIVAL","DEPARTURE","OVERFLIGHT")
+
+## Times among the optional fields
+TIME_FIELDS=tuple(name for name in AIR_FIELDS
+                  if name.startswith(("eta_","sta_")))
+
+## Raw files cover 0700 of the day through 0600 of the next (local day)
+DAY_START_HOUR=7
+DAY_HOURS=24
+
+## Probability that an air update also carries each optional field
+OPTIONAL_FIELD_SHARE=0.15
+
+def zulu(when,ms=False):
+    if ms:
+        return when.strftime("%Y-%m-%dT%H:%M:%S.")+ \
+            "%03dZ" % (when.microsecond//1000)
+    return when.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+### One simulated flight and the values it reports
+class SynthFlight:
+    def __init__(self,rnd,num,start):
+        self.aid=rnd.choice(AIRLINES)+str(100+num % 9000)
+        self.tmaid=str(100000+num)
+        self.apt=rnd.choice(AIRPORTS)
+        self.dap=rnd.choice(CENTERS)
+        self.cat=rnd.choices(CATEGORIES,weights=(6,3,1))[0]
+        self.typ=rnd.choice(AIRCRAFT_TYPES)
+        self.rwy=rnd.choice(RUNWAYS)
+        self.start=start
+        self.end=start+timedelta(minutes=rnd.randint(45,240))
+        self.eta=self.end-timedelta(minutes=rnd.randint(0,10))
+        self.std=None
+        self.last_body=None
+        if self.cat == "DEPARTURE" and rnd.random() < 0.5:
+            self.std=(start+timedelta(minutes=rnd.randint(10,40))).replace(
+                second=0,microsecond=0)
+
+    def acs(self,now):
+        if now >= self.eta:
+            return "LANDED"
+        if now < self.start+timedelta(minutes=10):
+            return "PROPOSED"
+        return "ACTIVE"
+
+    ## The <flt> elements of one update, in AIR_FIELDS order
+    def update_fields(self,rnd,now,std_churn):
+        self.eta=self.eta+timedelta(seconds=rnd.randint(-30,30))
+        if self.std is not None and now < self.std and \
+           rnd.random() < std_churn:
+            self.std=self.std+timedelta(minutes=rnd.choice((-5,5,10,15)))
+        values={"cat":self.cat,"typ":self.typ,"eng":"JET",
+                "acs":self.acs(now),"rwy":self.rwy,
+                "eta_rwy":zulu(self.eta),"sta_rwy":zulu(self.eta)}
+        if self.std is not None:
+            values["std"]=zulu(self.std)
+        for name in AIR_FIELDS:
+            if name in values or name == "std" or \
+               rnd.random() >= OPTIONAL_FIELD_SHARE:
+                continue
+            if name in TIME_FIELDS:
+                values[name]=zulu(self.eta-timedelta(
+                    minutes=rnd.randint(1,40)))
+            elif name == "spd":
+                values[name]=str(rnd.randint(180,480))
+            elif name == "bcn":
+                values[name]="%04o" % rnd.randint(0,4095)
+            else:
+                values[name]=name.upper()+str(rnd.randint(0,9))
+        return [(name,values[name]) for name in AIR_FIELDS if name in values]
+
+def message_head(now):
+    return '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'+ \
+        '<ns2:tmaMessageList xmlns:ns2="urn:us:gov:dot:faa:atm:tfm:'+ \
+        'tbfmmeteringpublication"><tma msgTime="'+zulu(now,True)+ \
+        '" envName="ZDC" sourceTimeStamp="'+zulu(now,True)+'">'
+
+MESSAGE_TAIL='</tma></ns2:tmaMessageList>'
+
+def air_message(rnd,flight,now,synth_parms):
+    ## Some updates repeat the last one unchanged, as in the real feed. No
+    ## draw without a repeat share so a seed keeps giving the same files.
+    repeat_share=synth_parms.get("repeat_share",0)
+    body=flight.last_body
+    if body is None or repeat_share <= 0 or rnd.random() >= repeat_share:
+        fields=flight.update_fields(rnd,now,synth_parms["std_churn"])
+        body=''.join('<'+name+'>'+value+'</'+name+'>'
+                     for name,value in fields)
+        ## Now and then a value needs an XML escape, as in the real feed
+        if rnd.random() < synth_parms["escape_share"]:
+            body=body+'<tra>A&amp;B</tra>'
+        flight.last_body=body
+    return message_head(now)+'<air aid="'+flight.aid+'" apt="'+flight.apt+ \
+        '" dap="'+flight.dap+'" tmaId="'+flight.tmaid+ \
+        '" airType="FlightPlan"><flt>'+body+'</flt></air>'+MESSAGE_TAIL
+
+def other_message(rnd,msg_type,now):
+    if msg_type == "con":
+        body='<con><cid>'+str(rnd.randint(1,99))+'</cid><cfg>'+ \
+            rnd.choice(RUNWAYS)+'</cfg></con>'
+    elif msg_type == "adp":
+        body='<adp><apt>'+rnd.choice(AIRPORTS)+'</apt><rwy>'+ \
+            rnd.choice(RUNWAYS)+'</rwy><aar>'+str(rnd.randint(20,60))+ \
+            '</aar></adp>'
+    else:
+        body='<oth><txt>status '+str(rnd.randint(0,999))+'</txt></oth>'
+    return message_head(now)+body+MESSAGE_TAIL
+
+### The wrapped line pair of one message, like the real captures
+def capture_lines(message,now):
+    return "capture-timestamp: "+zulu(now,True)+"\n"+ \
+        repr(message.encode())+"\n"
+
+##############################
+###
+###  Writes the raw hour files of the local day target_date into out_dir
+###  (TBFM_YYYYMMDD_HH00.xml.gz) and returns the message counts. Flights
+###  are started so that about msgs_per_hour messages are sent per hour
+###  once the day is running: every active flight is one entry in a heap
+###  of next update times, and new flights start at next_new. Starts and
+###  updates are taken in time order, so every message is written to the
+###  file of its hour however sparse the rate.
+#############################
+def generate_day(out_dir,target_date,synth_parms):
+    rnd=random.Random(synth_parms["seed"])
+    start=datetime.strptime(target_date,"%Y%m%d")+ \
+        timedelta(hours=DAY_START_HOUR)
+    update_secs=synth_parms["update_secs"]
+    shares=synth_parms["shares"]
+    air_share=shares["air"]
+    ## Flights active at once (mean life ~2.4h) that produce the air share
+    active_target=synth_parms["msgs_per_hour"]*air_share*update_secs/3600.0
+    new_flight_secs=2.4*3600.0/max(active_target,1.0)
+
+    counts={"air":0,"con":0,"adp":0,"oth":0}
+    heap=[]
+    num_flights=0
+    next_new=start
+    ## Warm up so the first hour already has a full sky
+    for num in range(int(active_target)):
+        flight=SynthFlight(rnd,num_flights,
+                           start-timedelta(seconds=rnd.randint(0,7200)))
+        num_flights+=1
+        heapq.heappush(heap,(start+timedelta(seconds=rnd.uniform(
+            0,update_secs)),num,flight))
+    other_types=[msg_type for msg_type in ("con","adp","oth")
+                 if shares[msg_type] > 0]
+    other_weights=[shares[msg_type] for msg_type in other_types]
+    other_rate=sum(other_weights)/air_share if air_share > 0 else 0
+
+    for hour in range(DAY_HOURS):
+        hour_start=start+timedelta(hours=hour)
+        hour_end=hour_start+timedelta(hours=1)
+        outname=os.path.join(out_dir,"TBFM_"+
+                             hour_start.strftime("%Y%m%d_%H%M")+".xml.gz")
+        with gzip.open(outname,"wt",
+                       compresslevel=synth_parms["compresslevel"]) as f:
+            while True:
+                ## Start the flights due before the next update
+                if next_new < hour_end and (not heap or
+                                            next_new <= heap[0][0]):
+                    new=SynthFlight(rnd,num_flights,next_new)
+                    heapq.heappush(heap,(next_new,num_flights,new))
+                    num_flights+=1
+                    next_new=next_new+timedelta(
+                        seconds=rnd.expovariate(1.0/new_flight_secs))
+                    continue
+                if not heap or heap[0][0] >= hour_end:
+                    break
+                now,num,flight=heapq.heappop(heap)
+                f.write(capture_lines(air_message(rnd,flight,now,
+                                                  synth_parms),now))
+                counts["air"]+=1
+                ## Other messages arrive in between at their share
+                while other_types and rnd.random() < other_rate/(1+other_rate):
+                    msg_type=rnd.choices(other_types,weights=other_weights)[0]
+                    f.write(capture_lines(other_message(rnd,msg_type,now),
+                                          now))
+                    counts[msg_type]+=1
+                if now < flight.end:
+                    later=now+timedelta(seconds=rnd.uniform(
+                        0.5*update_secs,1.5*update_secs),
+                        milliseconds=rnd.randint(0,999))
+                    heapq.heappush(heap,(later,num,flight))
+        print("Wrote "+outname,flush=True)
+    return counts
+
+def main():
+
+    os.makedirs(parms["outdir"],exist_ok=True)
+    counts=generate_day(parms["outdir"],parms["target_date"],parms)
+    print("Messages: "+", ".join(msg_type+"="+str(counts[msg_type])
+                                 for msg_type in counts),flush=True)
+
+def build_parms(args):
+    """Helper function to parse command line arguments into dictionary
+        input: ArgumentParser class object
+        output: dictionary of expected parameters
+    """
+    air,con,adp,oth=[float(share) for share in args.mix.split(",")]
+    parms = {"outdir":args.outdir,
+             "target_date":args.target_date,
+             "msgs_per_hour":args.msgs_per_hour,
+             "update_secs":args.update_secs,
+             "std_churn":args.std_churn,
+             "escape_share":args.escape_share,
+             "repeat_share":args.repeat_share,
+             "shares":{"air":air,"con":con,"adp":adp,"oth":oth},
+             "seed":args.seed,
+             "compresslevel":args.compresslevel}
+    return(parms)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = \
+                 "Write a day of synthetic raw TBFM SWIM files.")
+    parser.add_argument("outdir",
+                        help = "Directory for the .xml.gz hour files.")
+    parser.add_argument("target_date", nargs="?", default="20191101",
+                        help = "Local day (YYYYMMDD), files run 0700 to "+
+                        "0600 of the next date.")
+    parser.add_argument("--msgs-per-hour", type=int, default=20000,
+                        help = "About how many messages each hour file "+
+                        "holds.")
+    parser.add_argument("--mix", default="0.85,0.05,0.05,0.05",
+                        help = "Shares of air,con,adp,oth messages.")
+    parser.add_argument("--update-secs", type=float, default=12.0,
+                        help = "Mean time between air updates of a flight.")
+    parser.add_argument("--std-churn", type=float, default=0.02,
+                        help = "Chance an update changes the flight's STD.")
+    parser.add_argument("--escape-share", type=float, default=0.001,
+                        help = "Share of air messages with an XML escape.")
+    parser.add_argument("--repeat-share", type=float, default=0.0,
+                        help = "Share of air updates that repeat the "+
+                        "flight's last one unchanged.")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--compresslevel", type=int, default=6,
+                        choices=range(0,10), metavar="0-9")
+    parms = build_parms(parser.parse_args())
+    main()
@@ -0,0 +1,97 @@
+##@Copyright 2020. Ulrich Linder, Al Capps
+##@Organization - aviationdatascience.org non-profit, through release from Penn State
+##@License - This work is licensed under MIT license - https://opensource.org/licenses/MIT
+## This permissive license lets you do basically whatever you want.
+## Per the details of the MIT license, the software is provided "as is".
+## Have fun!
+
+## Parsing of the ISO-8601 Zulu times found in TBFM SWIM, such as
+## 2019-11-01T07:50:52Z (std, eta_*, sta_*) and 2019-11-01T07:50:52.794Z
+## (msgTime), into epoch seconds. The fields sit at fixed positions so they
+## are sliced instead of going through strptime, and the values are UTC so
+## no local time conversion (and no DST shift) is involved. TBFM repeats the
+## same times over and over, so parsed values are memoized.
+import functools
+from datetime import datetime
+from datetime import timezone
+
+###The following can be treated as static and immutable.
+## Distinct time strings kept by the memo
+ZULU_CACHE_SIZE=1<<16
+
+## Distinct dates kept by the date memo (a few years of days)
+DATE_CACHE_SIZE=1<<12
+
+## Length of a Zulu time without fractional seconds
+ZULU_LEN=len("2019-11-01T07:50:52Z")
+
+EPOCH=datetime(1970,1,1,tzinfo=timezone.utc)
+
+### Epoch seconds of midnight UTC of a YYYY-MM-DD date
+@functools.lru_cache(maxsize=DATE_CACHE_SIZE)
+def _date_epoch(date_str):
+    day=datetime(int(date_str[0:4]),int(date_str[5:7]),int(date_str[8:10]),
+                 tzinfo=timezone.utc)
+    return int((day-EPOCH).total_seconds())
+
+##############################
+###
+###  Epoch seconds (float) of a Zulu time. Fractional seconds are kept,
+###  use int() to drop them. Raises ValueError for anything that is not
+###  YYYY-MM-DDTHH:MM:SS[.fff]Z, like strptime did.
+#############################
+@functools.lru_cache(maxsize=ZULU_CACHE_SIZE)
+def parse_zulu(value):
+    if len(value) < ZULU_LEN or value[-1] != "Z" or value[10] != "T" or \
+       value[4] != "-" or value[7] != "-" or value[13] != ":" or \
+       value[16] != ":" or not value[0:4].isdigit():
+        raise ValueError("time data "+repr(value)+" is not a Zulu time")
+    secs=_date_epoch(value[0:10])+int(value[11:13])*3600+ \
+        int(value[14:16])*60+int(value[17:19])
+    if len(value) == ZULU_LEN:
+        return float(secs)
+    if value[19] != ".":
+        raise ValueError("time data "+repr(value)+" is not a Zulu time")
+    return secs+float(value[19:-1])
+
+### Difference first-second in whole seconds, fractions of both dropped
+def zulu_diff_secs(firsttime,secondtime):
+    return int(parse_zulu(firsttime))-int(parse_zulu(secondtime))
+
+##############################
+###
+###  Vectorized variant for a column of Zulu time strings. Returns a float
+###  numpy array of epoch seconds, NaN where the value is empty, missing
+###  or not a time.
+#############################
+def parse_zulu_column(values):
+    import pandas as pd
+    times=pd.to_datetime(pd.Series(values,dtype=object),format="ISO8601",
+                         utc=True,errors="coerce")
+    return (times-pd.Timestamp(0,tz="UTC")).dt.total_seconds().to_numpy()
+
+##############################
+###
+###  A column of Zulu time strings as UTC timestamps (pandas Series), NaT
+###  where the value is empty, missing or not a time.
+#############################
+def to_zulu_times(values):
+    import pandas as pd
+    return pd.to_datetime(values,format="ISO8601",utc=True,errors="coerce")
+
+##############################
+###
+###  The other way: timestamps back to the TBFM text. with_ms always gives
+###  milliseconds (msgTime); otherwise they are only written when not zero,
+###  like std, eta_* and sta_*. NaT gives NaN. numpy formats the whole
+###  column at once, Series.dt.strftime goes row by row.
+#############################
+def format_zulu_times(times,with_ms):
+    import numpy as np
+    import pandas as pd
+    values=times.dt.tz_convert(None).to_numpy("datetime64[ms]")
+    text=np.char.add(np.datetime_as_string(values,unit="ms"),"Z")
+    if not with_ms:
+        whole=np.char.add(np.datetime_as_string(values,unit="s"),"Z")
+        text=np.where(values.astype("int64") % 1000 == 0,whole,text)
+    return pd.Series(text,index=times.index).where(times.notna())